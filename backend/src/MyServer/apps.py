@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MyServerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'MyServer'
+
+    def ready(self):
+        import MyServer.repoHelpers
+        MyServer.repoHelpers.serverRepos.load()
@@ -1,5 +1,10 @@
 """This module provides functions, data strucures and classes responsible for users authentication."""
 
+import asyncio
+import hashlib
+import json
+import threading
+import time
 import urllib.parse
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
@@ -8,6 +13,7 @@ from functools import wraps
 from typing import Dict, Tuple
 from uuid import uuid4, UUID
 
+import httpx
 import jwt
 import requests
 from decouple import config
@@ -19,6 +25,14 @@ from oauthlib.oauth2 import InvalidGrantError
 # for integrations tests
 from MyServer.testHelpers import server_test_mode, MockedAuthInfo, TEST_USERNAME, TEST_UID, TEST_MAIL, TEST_TOKEN, TEST_REPOS
 from MyServer.error import TokenNotPresentException, InvalidTokenException, OAuthProviderCommunicationException, InvalidAuthorizationCodeException
+from MyServer.offload import offloadPool
+from MyServer.providerSessions import AsyncProviderSessions, CachedPage, PageCache, ProviderSessions
+from MyServer.tokenStore import TokenStore, createTokenStore
+
+JWT_EXPIRATION_MINUTES = 30
+TOKEN_KEY_PREFIX = "oauth-token:"
+IDENTITY_KEY_PREFIX = "oauth-identity:"
+PROVIDER_PAGE_SIZE = 100
 
 
 class OAuthProvider(Enum):
@@ -57,16 +71,42 @@ class OAuthTokenWithInfo(OAuthToken):
 
 
 class TokenMap:
-    def __init__(self):
-        self._tokenDict: Dict[UUID, OAuthTokenWithInfo] = {}
+    """Map of JWT uuids to users' OAuth tokens, kept in a token store that can be shared between server processes.
+    Entries expire together with the JWT."""
+
+    def __init__(self, store: TokenStore, ttl: int):
+        self._store = store
+        self._ttl = ttl
 
     def insertToken(self, token: OAuthTokenWithInfo) -> UUID:
         uuid = uuid4()
-        self._tokenDict[uuid] = token
+        self._store.set(TOKEN_KEY_PREFIX + str(uuid), serializeToken(token), ex=self._ttl)
         return uuid
 
     def getToken(self, uuid: UUID) -> OAuthTokenWithInfo | None:
-        return self._tokenDict.get(uuid)
+        value = self._store.get(TOKEN_KEY_PREFIX + str(uuid))
+        if value is None:
+            return None
+        return deserializeToken(value)
+
+
+def serializeToken(token: OAuthTokenWithInfo) -> bytes:
+    return json.dumps({
+        "token": token.token,
+        "provider": token.provider.name,
+        "refreshToken": token.refreshToken,
+        "createdAt": token.createdAt,
+        "expiresIn": token.expiresIn,
+    }).encode()
+
+
+def deserializeToken(value: bytes) -> OAuthTokenWithInfo:
+    data = json.loads(value)
+    return OAuthTokenWithInfo(data["token"],
+                              OAuthProvider[data["provider"]],
+                              data["refreshToken"],
+                              data["createdAt"],
+                              data["expiresIn"])
 
 
 @dataclass
@@ -76,19 +116,225 @@ class AuthInfo:
     uid: str
 
 
-tokenMap = TokenMap()
+@dataclass
+class UserIdentity:
+    uid: str
+    login: str
+    email: str | None
+    fetchedAt: float
+
+
+class IdentityCache:
+    """Cache of users' identities (uid, login, e-mail) fetched from the OAuth providers, keyed by OAuth token.\n
+    Identities are kept in the token store next to the tokens. An identity younger than ttl seconds is served as is,
+    an older one (up to ttl + staleTtl seconds) is served while it is refreshed in the background,
+    and only a missing or expired one is fetched before returning."""
+
+    def __init__(self, store: TokenStore, ttl: int, staleTtl: int):
+        self._store = store
+        self._ttl = ttl
+        self._staleTtl = staleTtl
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+
+    def getIdentity(self, providerAPI: "AuthProviderAPI", token: str) -> UserIdentity:
+        key = self._key(token)
+        identity, stale = self._cached(self._store.get(key))
+        if identity is None:
+            return self._fetch(providerAPI, token)
+        if stale:
+            self._refreshInBackground(providerAPI, token, key)
+        return identity
+
+    async def getIdentityAsync(self, providerAPI: "AuthProviderAPI", token: str) -> UserIdentity:
+        """getIdentity for async views, the provider is called with the async client."""
+        key = self._key(token)
+        identity, stale = self._cached(await offloadPool.run(self._store.get, key))
+        if identity is None:
+            return await self._fetchAsync(providerAPI, token)
+        if stale:
+            self._refreshInBackground(providerAPI, token, key)
+        return identity
+
+    def setIdentity(self, token: str, identity: UserIdentity):
+        self._store.set(self._key(token), serializeIdentity(identity), ex=self._ttl + self._staleTtl)
+
+    def invalidate(self, token: str):
+        self._store.delete(self._key(token))
+
+    def _cached(self, value: bytes | None) -> Tuple[UserIdentity | None, bool]:
+        """Get the identity kept in the store and whether it should be refreshed. Missing and expired identities are None."""
+        if value is None:
+            return None, False
+        identity = deserializeIdentity(value)
+        age = time.time() - identity.fetchedAt
+        if age >= self._ttl + self._staleTtl:
+            return None, False
+        return identity, age >= self._ttl
+
+    def _fetch(self, providerAPI: "AuthProviderAPI", token: str) -> UserIdentity:
+        uid, login, email = providerAPI.get_identity(token)
+        if not email:
+            email = providerAPI.getUserMail(token)
+        identity = UserIdentity(uid, login, email, time.time())
+        self.setIdentity(token, identity)
+        return identity
+
+    async def _fetchAsync(self, providerAPI: "AuthProviderAPI", token: str) -> UserIdentity:
+        uid, login, email = await providerAPI.get_identity_async(token)
+        if not email:
+            email = await providerAPI.getUserMailAsync(token)
+        identity = UserIdentity(uid, login, email, time.time())
+        await offloadPool.run(self.setIdentity, token, identity)
+        return identity
+
+    def _refreshInBackground(self, providerAPI: "AuthProviderAPI", token: str, key: str):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._fetch(providerAPI, token)
+            except OAuthProviderCommunicationException:
+                pass  # the stale identity is served until it expires
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # OAuth tokens are not used as keys directly, so they do not appear in the store twice
+        return IDENTITY_KEY_PREFIX + hashlib.sha256(token.encode()).hexdigest()
+
+
+def serializeIdentity(identity: UserIdentity) -> bytes:
+    return json.dumps({
+        "uid": identity.uid,
+        "login": identity.login,
+        "email": identity.email,
+        "fetchedAt": identity.fetchedAt,
+    }).encode()
+
+
+def deserializeIdentity(value: bytes) -> UserIdentity:
+    data = json.loads(value)
+    return UserIdentity(data["uid"], data["login"], data["email"], data["fetchedAt"])
+
+
+tokenStore = createTokenStore(config("TOKEN_STORE_URL", default="memory://"),
+                              config("TOKEN_STORE_MAX_ENTRIES", default=100000, cast=int))
+tokenMap = TokenMap(tokenStore, JWT_EXPIRATION_MINUTES * 60)
+identityCache = IdentityCache(tokenStore,
+                              config("IDENTITY_CACHE_TTL", default=300, cast=int),
+                              config("IDENTITY_CACHE_STALE_TTL", default=JWT_EXPIRATION_MINUTES * 60, cast=int))
+
+
+def getUserIdentity(authInfo: AuthInfo) -> UserIdentity:
+    """Get identity of the authenticated user, served from the identity cache when possible."""
+    return identityCache.getIdentity(AuthProviderAPI(authInfo.provider), authInfo.token)
+
+
+async def getUserIdentityAsync(authInfo: AuthInfo) -> UserIdentity:
+    return await identityCache.getIdentityAsync(AuthProviderAPI(authInfo.provider), authInfo.token)
+
+
+providerSessions = ProviderSessions(config("PROVIDER_API_POOL_SIZE", default=10, cast=int),
+                                    config("PROVIDER_API_TIMEOUT", default=10, cast=float))
+asyncProviderSessions = AsyncProviderSessions(config("PROVIDER_API_ASYNC_POOL_SIZE", default=100, cast=int),
+                                              config("PROVIDER_API_TIMEOUT", default=10, cast=float))
+
+
+providerPages = PageCache(config("PROVIDER_PAGE_CACHE_MAX_ENTRIES", default=10000, cast=int))
+
+
+def session_get_with_catch(provider: OAuthProvider, url: str, token_str: str, allowNotModified: bool = False, **kwargs):
+    try:
+        response = providerSessions.get(provider.name, url, token_str, **kwargs)
+    except (requests.ConnectionError, requests.Timeout):
+        raise OAuthProviderCommunicationException
+    return check_provider_response(response, allowNotModified)
 
 
-def session_get_with_catch(session: OAuth2Session, *args, **kwargs):
+async def async_session_get_with_catch(provider: OAuthProvider, url: str, token_str: str, allowNotModified: bool = False, **kwargs):
     try:
-        response = session.get(*args, **kwargs)
-    except requests.ConnectionError:
+        response = await asyncProviderSessions.get(provider.name, url, token_str, **kwargs)
+    except httpx.TransportError:
         raise OAuthProviderCommunicationException
+    return check_provider_response(response, allowNotModified)
+
+
+def check_provider_response(response, allowNotModified: bool):
+    if allowNotModified and response.status_code == status.HTTP_304_NOT_MODIFIED:
+        return response
     if response.status_code != status.HTTP_200_OK:
         raise OAuthProviderCommunicationException
     return response
 
 
+def page_url(url: str, page: int) -> str:
+    separator = "&" if "?" in url else "?"
+    return f"{url}{separator}per_page={PROVIDER_PAGE_SIZE}&page={page}"
+
+
+def last_page_number(response) -> int | None:
+    """Get number of the last page from the pagination headers (GitLab: X-Total-Pages, GitHub and GitLab: Link)."""
+    totalPages = response.headers.get("X-Total-Pages")
+    if totalPages:
+        return int(totalPages)
+    lastUrl = response.links.get("last", {}).get("url")
+    if lastUrl:
+        return int(urllib.parse.parse_qs(urllib.parse.urlparse(lastUrl).query)["page"][0])
+    return None
+
+
+async def get_page_with_cache_async(provider: OAuthProvider, url: str, token_str: str, headers: Dict[str, str] | None = None) -> CachedPage:
+    """Get page of a list endpoint, revalidating the cached copy with its ETag if there is one."""
+    cached = providerPages.get(token_str, url)
+    r = await async_session_get_with_catch(provider, url, token_str, allowNotModified=cached is not None, headers=revalidation_headers(cached, headers))
+    return cache_page(token_str, url, cached, r)
+
+
+def revalidation_headers(cached: CachedPage | None, headers: Dict[str, str] | None) -> Dict[str, str]:
+    requestHeaders = dict(headers or {})
+    if cached is not None:
+        requestHeaders["If-None-Match"] = cached.etag
+    return requestHeaders
+
+
+def cache_page(token_str: str, url: str, cached: CachedPage | None, r) -> CachedPage:
+    """Get page of the response (the cached page for 304 Not Modified) and cache it if it has an ETag."""
+    if r.status_code == status.HTTP_304_NOT_MODIFIED:
+        return cached
+    page = CachedPage(r.headers.get("ETag"), r.json(), last_page_number(r), "next" in r.links)
+    if page.etag:
+        providerPages.set(token_str, url, page)
+    return page
+
+
+async def get_all_pages_async(provider: OAuthProvider, url: str, token_str: str, headers: Dict[str, str] | None = None) -> list:
+    """Get items of all pages of a list endpoint. When the first page tells the number of pages,
+    the remaining ones are fetched concurrently."""
+    first = await get_page_with_cache_async(provider, page_url(url, 1), token_str, headers)
+    items = list(first.data)
+    if first.lastPage is not None:
+        pages = await asyncio.gather(*(get_page_with_cache_async(provider, page_url(url, number), token_str, headers)
+                                       for number in range(2, first.lastPage + 1)))
+        for page in pages:
+            items.extend(page.data)
+        return items
+    # GitLab omits the number of pages for very long lists, they are followed one by one
+    page, number = first, 1
+    while page.hasNext:
+        number += 1
+        page = await get_page_with_cache_async(provider, page_url(url, number), token_str, headers)
+        items.extend(page.data)
+    return items
+
+
 class AuthProviderAPI:
     def __init__(self, provider: OAuthProvider):
         self._provider = provider
@@ -115,56 +361,81 @@ class AuthProviderAPI:
         if server_test_mode():
             return TEST_MAIL
 
-        session = OAuth2Session(token={"access_token": token_str, "token_type": "Bearer"})
+        r = session_get_with_catch(self._provider, self._emailsUrl(), token_str)
+        return self._primaryMail(r.json())
+
+    async def getUserMailAsync(self, token_str: str) -> str | None:
+        if server_test_mode():
+            return TEST_MAIL
+
+        r = await async_session_get_with_catch(self._provider, self._emailsUrl(), token_str)
+        return self._primaryMail(r.json())
+
+    def get_identity(self, token_str: str) -> Tuple[str, str, str | None]:
+        if server_test_mode():
+            return TEST_UID, TEST_USERNAME, TEST_MAIL
+
+        r = session_get_with_catch(self._provider, self._identityUrl(), token_str)
+        return self._parseIdentity(r.json())
+
+    async def get_identity_async(self, token_str: str) -> Tuple[str, str, str | None]:
+        if server_test_mode():
+            return TEST_UID, TEST_USERNAME, TEST_MAIL
+
+        r = await async_session_get_with_catch(self._provider, self._identityUrl(), token_str)
+        return self._parseIdentity(r.json())
+
+    async def get_repos_async(self, token_str: str) -> list[str] | None:
+        if server_test_mode():
+            return TEST_REPOS
+
+        url, headers = self._reposRequest()
+        return self._parseRepos(await get_all_pages_async(self._provider, url, token_str, headers=headers))
+
+    def _emailsUrl(self) -> str:
         if self._provider == OAuthProvider.GITHUB:
-            r = session_get_with_catch(session, 'https://api.github.com/user/emails')
-        else:
-            r = session_get_with_catch(session, 'https://gitlab.com/api/v4/user/emails')
-        emails = r.json()
+            return 'https://api.github.com/user/emails'
+        return 'https://gitlab.com/api/v4/user/emails'
+
+    @staticmethod
+    def _primaryMail(emails: list) -> str | None:
         for email in emails:
             if email['primary'] and email['verified']:
                 return email['email']
         return None
 
-    def get_identity(self, token_str: str) -> Tuple[str, str, str | None]:
-        if server_test_mode():
-            return TEST_UID, TEST_USERNAME, TEST_MAIL
+    def _identityUrl(self) -> str:
+        if self._provider == OAuthProvider.GITHUB:
+            return "https://api.github.com/user"
+        return "https://gitlab.com/api/v4/user"
 
-        session = OAuth2Session(token={"access_token": token_str, "token_type": "Bearer"})
+    def _parseIdentity(self, identity: dict) -> Tuple[str, str, str | None]:
         if self._provider == OAuthProvider.GITHUB:
-            r = session_get_with_catch(session, "https://api.github.com/user")
-            identity = r.json()
             return identity['id'], identity['login'], identity['email']
-        else:
-            r = session_get_with_catch(session, "https://gitlab.com/api/v4/user")
-            identity = r.json()
-            return identity['id'], identity['username'], identity['email']
+        return identity['id'], identity['username'], identity['email']
 
-    def get_repos(self, token_str: str) -> list[str] | None:
-        if server_test_mode():
-            return TEST_REPOS
+    def _reposRequest(self) -> Tuple[str, Dict[str, str] | None]:
+        if self._provider == OAuthProvider.GITHUB:
+            return 'https://api.github.com/user/repos', {'Accept': 'application/vnd.github+json'}
+        return 'https://gitlab.com/api/v4/projects?membership=true&min_access_level=40', None
 
-        session = OAuth2Session(token={"access_token": token_str, "token_type": "Bearer"})
+    def _parseRepos(self, repositories: list) -> list[str]:
         if self._provider == OAuthProvider.GITHUB:
-            r = session_get_with_catch(session, 'https://api.github.com/user/repos', headers={
-                'Accept': 'application/vnd.github+json'
-            })
-            repositories = r.json()
-            write_access_repos = [repo["full_name"] for repo in repositories if repo['permissions']['push']]
-            return write_access_repos
-        else:
-            r = session_get_with_catch(session, 'https://gitlab.com/api/v4/projects?membership=true&min_access_level=40')
-            repositories = r.json()
-            repo_names = [repo["path_with_namespace"] for repo in repositories]
-            return repo_names
+            # only repos the user can push to
+            return [repo["full_name"] for repo in repositories if repo['permissions']['push']]
+        return [repo["path_with_namespace"] for repo in repositories]
 
 
 def generate_frontend_redirect_url(request_uri: str, provider: AuthProviderAPI) -> str:
     token = provider.create_access_token(request_uri)  # handle exceptions
-    user_id, _, _ = provider.get_identity(token.token)
+    user_id, login, email = provider.get_identity(token.token)
+    if not email:
+        # the e-mail is private, it is fetched once at login instead of by the first identity lookup
+        email = provider.getUserMail(token.token)
     uuid = tokenMap.insertToken(token)
-    expiration_time_minutes = 30  # change later
-    exp = (datetime.now(timezone.utc) + timedelta(minutes=expiration_time_minutes)).timestamp()
+    # identity lookups of the session are served from the cache from now on
+    identityCache.setIdentity(token.token, UserIdentity(user_id, login, email, time.time()))
+    exp = (datetime.now(timezone.utc) + timedelta(minutes=JWT_EXPIRATION_MINUTES)).timestamp()
     iat = datetime.now(timezone.utc).timestamp()
     jwt_token = jwt.encode({"uuid": str(uuid), "exp": exp, "iat": iat, "user_id": user_id}, config("JWT_SECRET"))
     return config("FRONTEND_URL") + "/login_callback?" + urllib.parse.urlencode({
@@ -182,30 +453,52 @@ def generate_authorization_url(provider: OAuthProvider) -> str:
     return authorization_url
 
 
+def authenticateRequest(request) -> AuthInfo:
+    """Get the authenticated user of the request from the JWT in its Authorization header."""
+    if server_test_mode():
+        return MockedAuthInfo(OAuthProvider.GITHUB)
+    payload = decodeRequestJwt(request)
+    return authInfoFromJwt(payload, tokenMap.getToken(UUID(payload["uuid"])))
+
+
+async def authenticateRequestAsync(request) -> AuthInfo:
+    """authenticateRequest for async views, the token store is read in the offload pool."""
+    if server_test_mode():
+        return MockedAuthInfo(OAuthProvider.GITHUB)
+    payload = decodeRequestJwt(request)
+    return authInfoFromJwt(payload, await offloadPool.run(tokenMap.getToken, UUID(payload["uuid"])))
+
+
+def decodeRequestJwt(request) -> dict:
+    authHeader = request.headers.get("Authorization")
+    if not authHeader:
+        raise TokenNotPresentException()
+    auth_type, token = authHeader.split(" ")[:2]
+    if auth_type != "Bearer":
+        raise TokenNotPresentException()
+    jwtToken = authHeader.split(" ")[1]
+    try:
+        payload = jwt.decode(jwtToken, config("JWT_SECRET"), algorithms=["HS256"])
+    except jwt.ExpiredSignatureError:
+        raise InvalidTokenException("Token expired.")
+    except jwt.InvalidSignatureError:
+        raise InvalidTokenException("Token is invalid.")
+    except jwt.DecodeError:
+        raise InvalidTokenException("Token could not be decoded.")
+    return payload
+
+
+def authInfoFromJwt(payload: dict, oAuthToken: OAuthTokenWithInfo | None) -> AuthInfo:
+    if not oAuthToken:
+        raise InvalidTokenException("Token could not be verified.")
+    user_id = payload["user_id"]
+    return AuthInfo(oAuthToken.token, oAuthToken.provider, user_id)
+
+
 def requires_jwt_login(func):
     @wraps(func)
     def wrapper(self, request, *args, **kwargs):
-        authHeader = request.headers.get("Authorization")
-        if not authHeader:
-            raise TokenNotPresentException()
-        auth_type, token = authHeader.split(" ")[:2]
-        if auth_type != "Bearer":
-            raise TokenNotPresentException()
-        jwtToken = authHeader.split(" ")[1]
-        try:
-            payload = jwt.decode(jwtToken, config("JWT_SECRET"), algorithms=["HS256"])
-        except jwt.ExpiredSignatureError:
-            raise InvalidTokenException("Token expired.")
-        except jwt.InvalidSignatureError:
-            raise InvalidTokenException("Token is invalid.")
-        except jwt.DecodeError:
-            raise InvalidTokenException("Token could not be decoded.")
-        oAuthToken = tokenMap.getToken(UUID(payload["uuid"]))
-        if not oAuthToken:
-            raise InvalidTokenException("Token could not be verified.")
-        user_id = payload["user_id"]
-        authInfo = AuthInfo(oAuthToken.token, oAuthToken.provider, user_id)
-        request.auth = authInfo
+        request.auth = authenticateRequest(request)
         return func(self, request, *args, **kwargs)
 
     @wraps(func)
@@ -216,3 +509,20 @@ def requires_jwt_login(func):
     if server_test_mode():
         return test_wrapper
     return wrapper
+
+
+def requires_jwt_login_async(func):
+    """requires_jwt_login for async handlers."""
+    @wraps(func)
+    async def wrapper(self, request, *args, **kwargs):
+        request.auth = await authenticateRequestAsync(request)
+        return await func(self, request, *args, **kwargs)
+
+    @wraps(func)
+    async def test_wrapper(self, request, *args, **kwargs):
+        request.auth = MockedAuthInfo(OAuthProvider.GITHUB)
+        return await func(self, request, *args, **kwargs)
+
+    if server_test_mode():
+        return test_wrapper
+    return wrapper
@@ -0,0 +1,164 @@
+"""This module provides per-repo feeds of changes of requirement trees, streamed to clients as server-sent events."""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable
+from uuid import uuid4
+
+from decouple import config
+
+from MyServer.offload import offloadPool
+
+
+RESET_EVENT = "reset"
+
+
+@dataclass
+class ChangeEvent:
+    id: str
+    type: str
+    data: dict
+    # version of the tree after the change, not sent to the clients
+    version: str | None = None
+
+    def encode(self) -> bytes:
+        """Encode the event in the text/event-stream format."""
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n".encode()
+
+
+class _Subscriber:
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: asyncio.Queue[ChangeEvent] = asyncio.Queue()
+
+
+class ChangeFeed:
+    """Per-repo feeds of change events published by the mutations of requirement trees.\n
+    Events are published by the threads changing the trees and delivered to subscribers running on asyncio event loops.
+    The last historySize events of every repo are kept, so a reconnecting client resumes after the last event it received
+    (Last-Event-ID). Event ids start with an id of the process, a client that cannot resume (the events it missed were
+    dropped, the process was restarted or the client reconnected to another worker) gets a reset event and should reload the tree.
+    Changes made by other processes are detected by comparing the version of the tree every keepAlive seconds with the
+    version recorded by the last event. The version is computed once per repo and interval for all its subscribers."""
+
+    def __init__(self, historySize: int, keepAlive: float):
+        self._historySize = historySize
+        self._keepAlive = keepAlive
+        self._epoch = uuid4().hex[:8]
+        self._counters: dict[str, int] = {}
+        self._history: dict[str, deque[ChangeEvent]] = {}
+        self._subscribers: dict[str, set[_Subscriber]] = {}
+        self._published: dict[str, str] = {}
+        self._versionChecks: dict[str, tuple[float, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, repoFolder: str, type: str, version: str | None = None, **data) -> ChangeEvent:
+        """Publish an event of the repo. version is the version of the tree after the change, if it is known."""
+        key = os.path.abspath(repoFolder)
+        with self._lock:
+            number = self._counters.get(key, 0) + 1
+            self._counters[key] = number
+            event = ChangeEvent(f"{self._epoch}-{number}", type, data, version)
+            self._history.setdefault(key, deque(maxlen=self._historySize)).append(event)
+            if version is not None:
+                self._published[key] = version
+            else:
+                self._published.pop(key, None)
+            subscribers = list(self._subscribers.get(key, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.queue.put_nowait, event)
+            except RuntimeError:
+                # the loop of the subscriber was closed
+                pass
+        return event
+
+    def missedEvents(self, repoFolder: str, lastEventId: str | None) -> list[ChangeEvent] | None:
+        """Get events published after the event with the given id, or None if they cannot be told."""
+        if not lastEventId:
+            return []
+        key = os.path.abspath(repoFolder)
+        epoch, _, number = lastEventId.partition("-")
+        if epoch != self._epoch or not number.isdigit():
+            return None
+        number = int(number)
+        with self._lock:
+            history = list(self._history.get(key, ()))
+            counter = self._counters.get(key, 0)
+        if number > counter:
+            return None
+        missed = history[len(history) - (counter - number):] if counter > number else []
+        if len(missed) < counter - number:
+            return None
+        return missed
+
+    async def stream(self, repoFolder: str, lastEventId: str | None, getVersion: Callable[[], str]) -> AsyncIterator[bytes]:
+        """Yield the events of the repo in the text/event-stream format until the client disconnects.
+        getVersion() returns the current version of the tree, it is called in the offload pool."""
+        key = os.path.abspath(repoFolder)
+        subscriber = _Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.setdefault(key, set()).add(subscriber)
+        try:
+            version = await self._checkVersion(key, getVersion)
+            missed = self.missedEvents(key, lastEventId)
+            yield f"retry: {int(self._keepAlive * 1000)}\n\n".encode()
+            if missed is None:
+                yield self._reset()
+            for event in missed or ():
+                yield event.encode()
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), self._keepAlive)
+                except asyncio.TimeoutError:
+                    newVersion = await self._checkVersion(key, getVersion)
+                    with self._lock:
+                        published = self._published.get(key)
+                    # an event with the new version may still be on its way to the queue
+                    if version is not None and newVersion not in (version, published):
+                        yield self._reset()
+                    version = newVersion
+                    yield b": keep-alive\n\n"
+                    continue
+                if missed and event in missed:
+                    continue
+                # after a change without a known version the next check only records the version
+                version = event.version
+                yield event.encode()
+        finally:
+            with self._lock:
+                subscribers = self._subscribers.get(key)
+                if subscribers is not None:
+                    subscribers.discard(subscriber)
+                    if not subscribers:
+                        del self._subscribers[key]
+                        self._versionChecks.pop(key, None)
+
+    def subscriberCount(self, repoFolder: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(os.path.abspath(repoFolder), ()))
+
+    async def _checkVersion(self, key: str, getVersion: Callable[[], str]) -> str:
+        """Get the current version of the tree of the repo. A version computed less than keepAlive seconds ago
+        on the running event loop is shared, so the tree is checked once per interval for all subscribers."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            started, check = self._versionChecks.get(key, (0.0, None))
+            if check is None or check.get_loop() is not loop or time.monotonic() - started >= self._keepAlive:
+                check = asyncio.ensure_future(offloadPool.run(getVersion))
+                self._versionChecks[key] = (time.monotonic(), check)
+        # a disconnecting subscriber does not cancel the check of the others
+        return await asyncio.shield(check)
+
+    @staticmethod
+    def _reset() -> bytes:
+        # no id, the client keeps the id of the last event it received
+        return f"event: {RESET_EVENT}\ndata: {{}}\n\n".encode()
+
+
+changeFeed = ChangeFeed(config("CHANGE_FEED_HISTORY", default=1000, cast=int), config("CHANGE_FEED_KEEPALIVE", default=15, cast=float))
@@ -113,6 +113,30 @@ class ReqNotFoundException(CustomAPIException):
         super().__init__(detail)
 
 
+class InvalidQueryParameterException(CustomAPIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    api_error_code = 'INVALID_QUERY_PARAMETER'
+
+    def __init__(self, detail='Invalid query parameter.'):
+        super().__init__(detail)
+
+
+class InvalidBatchException(CustomAPIException):
+    status_code = status.HTTP_400_BAD_REQUEST
+    api_error_code = 'INVALID_BATCH'
+
+    def __init__(self, detail='Invalid batch of operations.'):
+        super().__init__(detail)
+
+
+class JobNotFoundException(CustomAPIException):
+    status_code = status.HTTP_404_NOT_FOUND
+    api_error_code = 'JOB_NOT_FOUND'
+
+    def __init__(self, detail='Job not found.'):
+        super().__init__(detail)
+
+
 class LinkCycleException(CustomAPIException):
     status_code = status.HTTP_409_CONFLICT
     default_detail = 'Link cycle attempt detected.'
@@ -151,6 +175,16 @@ class OAuthProviderCommunicationException(CustomAPIException):
         self.redirect = redirect
 
 
+def errorResponse(exc: CustomAPIException) -> JsonResponse:
+    """
+    Function creating the error message returned to the client by views that are not handled by the REST framework.
+    """
+    return JsonResponse({
+        "message": exc.detail,
+        "api_error_code": exc.api_error_code
+    }, status=exc.status_code)
+
+
 def custom_exception_handler(exc, context):
     """
     Function to handle a caught exception, creates an error message returned to the client.
@@ -165,8 +199,5 @@ def custom_exception_handler(exc, context):
             })
             response = HttpResponseRedirect(redirect_to=redirect_to)
         else:
-            response = JsonResponse({
-                "message": response.data["detail"],
-                "api_error_code": exc.api_error_code
-            }, status=response.status_code)
+            response = errorResponse(exc)
     return response
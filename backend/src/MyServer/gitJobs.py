@@ -0,0 +1,243 @@
+"""This module provides the queue of git jobs (commit and push) run in the background, outside of HTTP requests."""
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Callable
+from uuid import uuid4
+
+from decouple import config
+
+import MyServer.error
+from MyServer.authHelpers import tokenStore
+from MyServer.offload import offloadPool
+from MyServer.tokenStore import TokenStore
+
+
+class JobKind(Enum):
+    COMMIT = "commit"
+    SYNC = "sync"
+
+
+# messages of succeeded and failed jobs of every kind
+JOB_MESSAGES: dict[JobKind, tuple[str, str]] = {
+    JobKind.COMMIT: ("Successfully staged changes in repository!", "Could not publish changes in repository"),
+    JobKind.SYNC: ("OK", "Could not synchronize repository"),
+}
+
+
+# how often a job waited for by an async view is checked
+JOB_POLL_INTERVAL = 0.1
+# how often a job of another server process waited for by an async view is read from the store
+JOB_STORE_POLL_INTERVAL = 0.5
+# progress of a job is written to the store at most this often (in seconds), changes of its status always are
+JOB_PUBLISH_INTERVAL = 0.5
+JOB_KEY_PREFIX = "job:"
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    kind: JobKind
+    repoFolder: str
+    owner: str
+    run: Callable[["Job"], bool] | None
+    status: JobStatus = JobStatus.QUEUED
+    message: str | None = None
+    apiErrorCode: str | None = None
+    progress: dict | None = None
+    readable: bool = False
+    finishedAt: float | None = None
+    done: threading.Event = field(default_factory=threading.Event)
+    # called with the job and whether only its progress changed, see GitJobQueue._publish
+    onChange: Callable[["Job", bool], None] | None = None
+    publishedAt: float = 0.0
+
+    def setProgress(self, stage: str, current: float, total: float | None, message: str = ""):
+        self.progress = {"stage": stage, "current": current, "total": total, "message": message}
+        if self.onChange is not None:
+            self.onChange(self, True)
+
+    async def waitAsync(self, timeout: float) -> bool:
+        """Wait up to timeout seconds for the job to finish without blocking the event loop. Returns whether it finished."""
+        deadline = time.monotonic() + timeout
+        while not self.done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(JOB_POLL_INTERVAL, remaining))
+        return True
+
+    def markReadable(self):
+        """Mark the repo as readable (its requirements are in place) while the job may still be running."""
+        self.readable = True
+        if self.onChange is not None:
+            self.onChange(self, False)
+
+    def toDict(self) -> dict:
+        return {
+            "jobId": self.id,
+            "kind": self.kind.value,
+            "status": self.status.value,
+            "message": self.message,
+            "api_error_code": self.apiErrorCode,
+            "progress": self.progress,
+            "readable": self.readable,
+        }
+
+    def toStored(self) -> dict:
+        return {**self.toDict(), "repoFolder": self.repoFolder, "owner": self.owner, "finishedAt": self.finishedAt}
+
+    @classmethod
+    def fromStored(cls, data: dict) -> "Job":
+        """Create a read-only copy of a job from its stored state, the job itself is run by another server process."""
+        job = cls(data["jobId"], JobKind(data["kind"]), data["repoFolder"], data["owner"], None, JobStatus(data["status"]),
+                  data["message"], data["api_error_code"], data["progress"], data["readable"], data["finishedAt"])
+        if job.status in (JobStatus.SUCCEEDED, JobStatus.FAILED):
+            job.done.set()
+        return job
+
+
+class GitJobQueue:
+    """Runs git jobs on a pool of background threads.\n
+    Jobs of one repo are run one after another in order of submission, jobs of different repos run in parallel.
+    Finished jobs are kept for retention seconds so their status can be read.\n
+    The state of every job is also written to the store, so it can be read by the other server processes sharing it
+    (e.g. when polling reaches another gunicorn worker than the one which runs the job)."""
+
+    def __init__(self, maxWorkers: int, retention: int, store: TokenStore | None = None):
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="git-job")
+        self._retention = retention
+        self._store = store
+        self._jobs: dict[str, Job] = {}
+        self._pending: dict[str, deque[Job]] = {}
+        self._running: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: JobKind, repoFolder: str, owner: str, run: Callable[[Job], bool], coalesce: bool = False) -> Job:
+        """Queue run(job) as a job of the given repo. run(job) returns False or raises an exception if the job failed.\n
+        With coalesce, a job of the same kind already queued or running for the repo is returned instead of a new one."""
+        job = Job(str(uuid4()), kind, repoFolder, owner, run, onChange=self._publish)
+        with self._lock:
+            self._prune()
+            if coalesce:
+                sameJob = self._findUnfinished(kind, repoFolder, owner)
+                if sameJob is not None:
+                    return sameJob
+            self._jobs[job.id] = job
+            queue = self._pending.get(repoFolder)
+            started = queue is None
+            if started:
+                self._pending[repoFolder] = deque([job])
+            else:
+                # a worker is already running jobs of the repo, it will pick this one up
+                queue.append(job)
+        self._publish(job)
+        if started:
+            self._executor.submit(self._runRepoJobs, repoFolder)
+        return job
+
+    def getJob(self, jobId: str, owner: str) -> Job:
+        """Get the job, also one run by another server process sharing the store."""
+        with self._lock:
+            job = self._jobs.get(jobId)
+        if job is None:
+            job = self._load(jobId)
+        if job is None or job.owner != owner:
+            raise MyServer.error.JobNotFoundException()
+        return job
+
+    async def waitAsync(self, job: Job, timeout: float) -> Job:
+        """Wait up to timeout seconds for the job to finish without blocking the event loop.
+        A job of another server process is read again from the store while waiting.\n
+        Returns: the latest state of the job"""
+        with self._lock:
+            local = self._jobs.get(job.id) is job
+        if local:
+            await job.waitAsync(timeout)
+            return job
+        deadline = time.monotonic() + timeout
+        while not job.done.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(JOB_STORE_POLL_INTERVAL, remaining))
+            job = await offloadPool.run(self._load, job.id) or job
+        return job
+
+    def _runRepoJobs(self, repoFolder: str):
+        while True:
+            with self._lock:
+                self._running.pop(repoFolder, None)
+                queue = self._pending[repoFolder]
+                if not queue:
+                    del self._pending[repoFolder]
+                    return
+                job = queue.popleft()
+                job.status = JobStatus.RUNNING
+                self._running[repoFolder] = job
+            self._publish(job)
+            self._runJob(job)
+
+    def _runJob(self, job: Job):
+        succeededMessage, failedMessage = JOB_MESSAGES[job.kind]
+        try:
+            succeeded = job.run(job)
+            status, message, apiErrorCode = (JobStatus.SUCCEEDED, succeededMessage, None) if succeeded else (JobStatus.FAILED, failedMessage, None)
+        except MyServer.error.CustomAPIException as e:
+            status, message, apiErrorCode = JobStatus.FAILED, str(e.detail), e.api_error_code
+        except Exception as e:
+            status, message, apiErrorCode = JobStatus.FAILED, f"{failedMessage}: {e}", None
+        with self._lock:
+            job.status, job.message, job.apiErrorCode = status, message, apiErrorCode
+            job.finishedAt = time.time()
+            job.run = None
+        self._publish(job)
+        job.done.set()
+
+    def _findUnfinished(self, kind: JobKind, repoFolder: str, owner: str) -> Job | None:
+        running = self._running.get(repoFolder)
+        for job in ([running] if running else []) + list(self._pending.get(repoFolder, ())):
+            if job.kind == kind and job.owner == owner and not job.done.is_set():
+                return job
+        return None
+
+    def _publish(self, job: Job, progressOnly: bool = False):
+        if self._store is None:
+            return
+        now = time.monotonic()
+        if progressOnly and now - job.publishedAt < JOB_PUBLISH_INTERVAL:
+            return
+        job.publishedAt = now
+        try:
+            self._store.set(JOB_KEY_PREFIX + job.id, json.dumps(job.toStored()).encode(), ex=max(self._retention, 1))
+        except Exception:
+            pass  # the shared copy is best effort, the job is still served by this process
+
+    def _load(self, jobId: str) -> Job | None:
+        if self._store is None:
+            return None
+        value = self._store.get(JOB_KEY_PREFIX + jobId)
+        if value is None:
+            return None
+        return Job.fromStored(json.loads(value))
+
+    def _prune(self):
+        expiredBefore = time.time() - self._retention
+        for jobId in [jobId for jobId, job in self._jobs.items() if job.finishedAt is not None and job.finishedAt < expiredBefore]:
+            del self._jobs[jobId]
+
+
+gitJobs = GitJobQueue(config("GIT_JOB_WORKERS", default=4, cast=int), config("GIT_JOB_RETENTION", default=3600, cast=int), tokenStore)
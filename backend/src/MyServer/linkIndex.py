@@ -0,0 +1,166 @@
+"""This module provides the reverse-link index of requirement trees, mapping every requirement to the requirements linking to it."""
+
+import json
+import os
+import threading
+import weakref
+
+import doorstop
+from decouple import config
+
+from MyServer.treeCache import treeCache
+
+
+INDEX_VERSION = 1
+
+
+class LinkIndex:
+    """Index of the links of one requirement tree, kept in both directions (child -> parents, parent -> children)."""
+
+    def __init__(self):
+        self._links: dict[str, set[str]] = {}
+        self._linkedBy: dict[str, set[str]] = {}
+
+    @classmethod
+    def fromTree(cls, tree: doorstop.Tree) -> "LinkIndex":
+        index = cls()
+        for doc in tree.documents:
+            for req in doc.items:
+                index.addItem(str(req.uid))
+                for link in req.links:
+                    index.addLink(str(req.uid), str(link))
+        return index
+
+    @classmethod
+    def fromDict(cls, links: dict[str, list[str]]) -> "LinkIndex":
+        index = cls()
+        for childUID, parentUIDs in links.items():
+            index.addItem(childUID)
+            for parentUID in parentUIDs:
+                index.addLink(childUID, parentUID)
+        return index
+
+    def addItem(self, uid: str):
+        self._links.setdefault(uid, set())
+
+    def removeItem(self, uid: str):
+        """Remove the requirement together with its own links and the links pointing to it."""
+        for parentUID in self._links.pop(uid, set()):
+            self._discard(self._linkedBy, parentUID, uid)
+        for childUID in self._linkedBy.pop(uid, set()):
+            self._discard(self._links, childUID, uid, keepEmpty=True)
+
+    def addLink(self, childUID: str, parentUID: str):
+        self._links.setdefault(childUID, set()).add(parentUID)
+        self._linkedBy.setdefault(parentUID, set()).add(childUID)
+
+    def removeLink(self, childUID: str, parentUID: str):
+        self._discard(self._links, childUID, parentUID, keepEmpty=True)
+        self._discard(self._linkedBy, parentUID, childUID)
+
+    def linkedBy(self, uid: str) -> list[str]:
+        """Get UIDs of the requirements linking to the given one."""
+        return sorted(self._linkedBy.get(uid, ()))
+
+    def toDict(self) -> dict[str, list[str]]:
+        """Get the reverse-link representation: dict[requirement UID: UIDs of requirements linking to it]"""
+        return {uid: self.linkedBy(uid) for uid in sorted(self._links)}
+
+    def linksDict(self) -> dict[str, list[str]]:
+        return {uid: sorted(parents) for uid, parents in self._links.items()}
+
+    @staticmethod
+    def _discard(mapping: dict[str, set[str]], key: str, value: str, keepEmpty: bool = False):
+        values = mapping.get(key)
+        if values is None:
+            return
+        values.discard(value)
+        if not values and not keepEmpty:
+            del mapping[key]
+
+
+def indexPath(userFolder: str) -> str:
+    """Get path of the persisted index of the given folder. It is placed next to the repo, outside its working tree."""
+    return os.path.dirname(os.path.abspath(userFolder)) + ".linkindex.json"
+
+
+class LinkIndexRegistry:
+    """Per-repo registry of link indexes. An index belongs to one cached tree and is rebuilt (or loaded from disk,
+    if persistence is enabled) when the tree is rebuilt. Mutations of the tree update the index incrementally."""
+
+    def __init__(self, persist: bool):
+        self._persist = persist
+        self._indexes: dict[str, tuple[weakref.ref, LinkIndex]] = {}
+        self._lock = threading.RLock()
+
+    def getIndex(self, userFolder: str, tree: doorstop.Tree | None = None) -> LinkIndex:
+        """Return the index of the given folder, building it from the (cached) tree if needed."""
+        if tree is None:
+            tree = treeCache.getTree(userFolder)
+        key = os.path.abspath(userFolder)
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and entry[0]() is tree:
+                return entry[1]
+        index = self._load(userFolder, tree)
+        if index is None:
+            index = LinkIndex.fromTree(tree)
+            self._save(userFolder, tree, index)
+        with self._lock:
+            # the index is dropped together with its tree, e.g. when the tree is evicted from the tree cache
+            self._indexes[key] = (weakref.ref(tree, lambda ref: self._drop(key, ref)), index)
+        return index
+
+    def update(self, userFolder: str, tree: doorstop.Tree, change):
+        """Apply change(index) to the index of the given tree if it was already built, otherwise it is built lazily later."""
+        key = os.path.abspath(userFolder)
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is None or entry[0]() is not tree:
+                return
+            change(entry[1])
+        self._save(userFolder, tree, entry[1])
+
+    def invalidate(self, userFolder: str):
+        with self._lock:
+            self._indexes.pop(os.path.abspath(userFolder), None)
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+    def _drop(self, key: str, ref: weakref.ref):
+        with self._lock:
+            entry = self._indexes.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._indexes[key]
+
+    def _load(self, userFolder: str, tree: doorstop.Tree) -> LinkIndex | None:
+        if not self._persist:
+            return None
+        stamp = treeCache.getStamp(userFolder, tree)
+        try:
+            with open(indexPath(userFolder), "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if stamp is None or data.get("version") != INDEX_VERSION or data.get("stamp") != stamp:
+            return None
+        return LinkIndex.fromDict(data["links"])
+
+    def _save(self, userFolder: str, tree: doorstop.Tree, index: LinkIndex):
+        if not self._persist:
+            return
+        stamp = treeCache.getStamp(userFolder, tree)
+        if stamp is None:
+            return
+        path = indexPath(userFolder)
+        try:
+            with open(path + ".tmp", "w") as file:
+                json.dump({"version": INDEX_VERSION, "stamp": stamp, "links": index.linksDict()}, file)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+
+linkIndexes = LinkIndexRegistry(config("LINK_INDEX_PERSIST", default=False, cast=bool))
@@ -0,0 +1,191 @@
+"""This module provides bounded offloading of blocking work (token store, OAuth, Doorstop, git) to thread and process pools."""
+
+import asyncio
+import contextvars
+import multiprocessing
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Iterator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from decouple import config
+from django.urls import Resolver404, resolve
+
+
+@dataclass
+class OffloadStats:
+    submitted: int = 0
+    running: int = 0
+    completed: int = 0
+    maxQueued: int = 0
+    taskSeconds: float = 0.0
+    maxTaskSeconds: float = 0.0
+
+    @property
+    def queued(self) -> int:
+        """Number of calls waiting for a free worker."""
+        return self.submitted - self.running - self.completed
+
+    def record(self, seconds: float):
+        self.taskSeconds += seconds
+        self.maxTaskSeconds = max(self.maxTaskSeconds, seconds)
+
+
+class OffloadPool:
+    """Bounded thread pool running blocking calls of async views, so the event loop keeps serving other requests.\n
+    At most `workers` calls run at once, further calls wait in the queue of the pool without holding a thread."""
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="offload")
+        self._stats = OffloadStats()
+        self._lock = threading.Lock()
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run func(*args, **kwargs) in the pool and return its result."""
+        with self._lock:
+            self._stats.submitted += 1
+            self._stats.maxQueued = max(self._stats.maxQueued, self._stats.queued)
+
+        def call():
+            with self._lock:
+                self._stats.running += 1
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._stats.running -= 1
+                    self._stats.completed += 1
+                    self._stats.record(time.perf_counter() - start)
+
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, call)
+
+    async def iterate(self, iterator: Iterator[Any]) -> AsyncIterator[Any]:
+        """Async iterator over the items of a blocking iterator, each item is produced in the pool."""
+        done = object()
+        while (item := await self.run(next, iterator, done)) is not done:
+            yield item
+
+    def stats(self) -> OffloadStats:
+        with self._lock:
+            return OffloadStats(**vars(self._stats))
+
+
+def _timed(func: Callable[..., Any], *args) -> tuple[Any, float]:
+    # run in the worker process, so the duration does not include waiting in the queue
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class ProcessOffloadPool:
+    """Bounded pool of worker processes running CPU-bound calls (Doorstop tree builds) outside the server process,
+    so they do not hold its GIL. Functions, arguments and results must be picklable.\n
+    Workers are started with spawn on first use, as forking the threads of the server is not safe. At most `workers`
+    calls run at once, further calls wait in the queue. With 0 workers the pool is disabled."""
+
+    def __init__(self, workers: int):
+        self._workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._stats = OffloadStats()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._workers > 0
+
+    def run(self, func: Callable[..., Any], *args) -> Any:
+        """Run func(*args) in a worker process and return its result, blocking the calling thread."""
+        with self._lock:
+            self._stats.submitted += 1
+            self._updateRunning()
+            self._stats.maxQueued = max(self._stats.maxQueued, self._stats.queued)
+            executor = self._getExecutor()
+        seconds = None
+        try:
+            result, seconds = executor.submit(_timed, func, *args).result()
+            return result
+        except BrokenProcessPool:
+            # a worker died (e.g. it was killed for using too much memory), the next call starts a new pool
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+        finally:
+            with self._lock:
+                self._stats.completed += 1
+                if seconds is not None:
+                    self._stats.record(seconds)
+                self._updateRunning()
+
+    def stats(self) -> OffloadStats:
+        """Statistics of the pool. Calls are counted as running as soon as there is a free worker for them."""
+        with self._lock:
+            return OffloadStats(**vars(self._stats))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def _updateRunning(self):
+        self._stats.running = min(self._stats.submitted - self._stats.completed, self._workers)
+
+    def _getExecutor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+
+offloadPool = OffloadPool(config("OFFLOAD_WORKERS", default=32, cast=int))
+treeBuildPool = ProcessOffloadPool(config("TREE_BUILD_WORKERS", default=2, cast=int))
+
+
+def isSyncView(request) -> bool:
+    try:
+        view = resolve(request.path_info).func
+    except Resolver404:
+        return False
+    return not iscoroutinefunction(view)
+
+
+class SyncViewLimitMiddleware:
+    """Limits the number of sync views running at once when the server runs under ASGI.\n
+    Django runs every sync view in a thread of its own there, so without a limit every slow Doorstop request would
+    hold a thread. Requests over the limit wait on the event loop. Under WSGI the middleware does nothing."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._async = iscoroutinefunction(get_response)
+        if self._async:
+            markcoroutinefunction(self)
+        self._limit = config("SYNC_VIEW_CONCURRENCY", default=16, cast=int)
+        self._semaphores: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+    def __call__(self, request):
+        if self._async:
+            return self._acall(request)
+        return self.get_response(request)
+
+    async def _acall(self, request):
+        if not isSyncView(request):
+            return await self.get_response(request)
+        async with self._semaphore():
+            return await self.get_response(request)
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        # semaphores are bound to the event loop they are first used on
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self._limit)
+        return semaphore
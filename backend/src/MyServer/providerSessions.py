@@ -0,0 +1,170 @@
+"""This module provides persistent HTTP sessions used to call the APIs of the OAuth providers (GitHub, GitLab)."""
+
+import asyncio
+import hashlib
+import http.cookiejar
+import threading
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+
+def _noCookiesPolicy() -> http.cookiejar.CookiePolicy:
+    """Cookie policy that rejects cookies of every domain."""
+    return http.cookiejar.DefaultCookiePolicy(allowed_domains=[])
+
+
+@dataclass
+class ProviderSessionsStats:
+    requests: int
+    connections: int
+
+    @property
+    def reusedConnections(self) -> int:
+        """Number of requests sent over an already open connection."""
+        return self.requests - self.connections
+
+
+class ProviderSessions:
+    """Per-provider HTTP sessions shared by all requests and threads of the server.\n
+    Every session keeps up to poolSize keep-alive connections open, so the TCP and TLS handshakes are done once per
+    connection instead of once per API call. Sessions hold no credentials, the user's token is sent with every request,
+    and cookies set by the providers are never stored, so they cannot leak from one user's request to another."""
+
+    def __init__(self, poolSize: int, timeout: float):
+        self._poolSize = poolSize
+        self._timeout = timeout
+        self._sessions: dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    def get(self, provider: str, url: str, token: str, headers: dict[str, str] | None = None) -> requests.Response:
+        """Send GET request to the API of the provider authorized with the user's token."""
+        headers = {**(headers or {}), "Authorization": "Bearer " + token}
+        session = self._getSession(provider)
+        with self._lock:
+            self._requests += 1
+        return session.get(url, headers=headers, timeout=self._timeout)
+
+    def stats(self) -> ProviderSessionsStats:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            requestCount = self._requests
+        connections = 0
+        for session in sessions:
+            # the same adapter is mounted for several prefixes
+            for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is not None:
+                        connections += pool.num_connections
+        return ProviderSessionsStats(requestCount, connections)
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+    def _getSession(self, provider: str) -> requests.Session:
+        with self._lock:
+            session = self._sessions.get(provider)
+            if session is None:
+                session = requests.Session()
+                session.cookies.set_policy(_noCookiesPolicy())
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self._poolSize)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[provider] = session
+            return session
+
+
+class AsyncProviderSessions:
+    """Async counterpart of ProviderSessions used by the async views, a request waiting for the provider does not hold a thread.\n
+    Connections of an httpx client belong to the event loop they were opened on, so every event loop gets its own client
+    per provider. Every client keeps up to poolSize connections open, further requests wait for a free connection."""
+
+    def __init__(self, poolSize: int, timeout: float):
+        self._limits = httpx.Limits(max_connections=poolSize, max_keepalive_connections=poolSize)
+        # waiting for a free connection is not a failure of the provider
+        self._timeout = httpx.Timeout(timeout, pool=None)
+        self._clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]] = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._requests = 0
+
+    async def get(self, provider: str, url: str, token: str, headers: dict[str, str] | None = None) -> httpx.Response:
+        """Send GET request to the API of the provider authorized with the user's token."""
+        headers = {**(headers or {}), "Authorization": "Bearer " + token}
+        client = self._getClient(provider)
+        with self._lock:
+            self._requests += 1
+        return await client.get(url, headers=headers)
+
+    @property
+    def requestCount(self) -> int:
+        with self._lock:
+            return self._requests
+
+    async def aclose(self):
+        """Close the clients of the running event loop."""
+        with self._lock:
+            clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+    def _getClient(self, provider: str) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._clients.setdefault(loop, {})
+            client = clients.get(provider)
+            if client is None:
+                client = clients[provider] = httpx.AsyncClient(limits=self._limits, timeout=self._timeout,
+                                                               cookies=http.cookiejar.CookieJar(_noCookiesPolicy()))
+            return client
+
+
+@dataclass
+class CachedPage:
+    etag: str
+    data: list
+    lastPage: int | None
+    hasNext: bool
+
+
+class PageCache:
+    """LRU cache of pages of list responses of the providers' APIs, keyed by user's token and page url.
+    Pages are revalidated with If-None-Match, a 304 Not Modified response reuses the cached page."""
+
+    def __init__(self, maxEntries: int):
+        self._maxEntries = maxEntries
+        self._pages: OrderedDict[tuple[str, str], CachedPage] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str, url: str) -> CachedPage | None:
+        key = (self._tokenKey(token), url)
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def set(self, token: str, url: str, page: CachedPage):
+        with self._lock:
+            self._pages[(self._tokenKey(token), url)] = page
+            self._pages.move_to_end((self._tokenKey(token), url))
+            while len(self._pages) > self._maxEntries:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    @staticmethod
+    def _tokenKey(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
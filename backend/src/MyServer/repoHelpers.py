@@ -5,17 +5,40 @@ from MyServer.testHelpers import server_test_mode, TEST_SERVER_REPOS
 import git
 import os
 import csv
+import threading
+import time
+from shutil import rmtree
+from typing import Callable
 from decouple import config
 import MyServer.error
+from MyServer.changeFeed import RESET_EVENT, changeFeed
+from MyServer.repoLocks import fileLock, repoLocks
 
 
-def getReposFromFile() -> dict:
+SERVER_REPOS_FILE = "/app/serverRepos.csv"
+
+# clone strategy: history depth (0 - full history), partial clone filter ("" - no filter)
+# and sparse checkout of the req folder only
+CLONE_DEPTH = config("GIT_CLONE_DEPTH", default=0, cast=int)
+CLONE_FILTER = config("GIT_CLONE_FILTER", default="blob:none")
+CLONE_SPARSE = config("GIT_CLONE_SPARSE", default=True, cast=bool)
+# per-repo bare mirrors shared as object stores (git alternates) by the clones of all users
+SHARED_MIRRORS = config("GIT_SHARED_MIRRORS", default=True, cast=bool)
+MIRRORS_DIRNAME = "mirrors"
+
+PROVIDER_HOSTS = {
+    OAuthProvider.GITHUB: "github.com",
+    OAuthProvider.GITLAB: "gitlab.com",
+}
+
+
+def getReposFromFile(path: str = SERVER_REPOS_FILE) -> dict:
     """Load server repositories from conig file.\n
     Returns: dict[repo_name: repo_url]"""
     if server_test_mode():
         return TEST_SERVER_REPOS
 
-    with open("/app/serverRepos.csv", "r") as file:
+    with open(path, "r") as file:
         reader = csv.reader(file, delimiter=" ")
         repos = {}
         for row in reader:
@@ -23,6 +46,68 @@ def getReposFromFile() -> dict:
         return repos
 
 
+def repoUrlHost(repoUrl: str) -> str:
+    """Get host of repo's url, e.g. github.com for github.com/user/repo.git"""
+    return repoUrl.split("://")[-1].split("/")[0].lower()
+
+
+class ServerRepos:
+    """Process-wide registry of repositories allowed on the server.\n
+    The config file is parsed once and parsed again only when its mtime changes. Repos are indexed by name and by host."""
+
+    def __init__(self, path: str = SERVER_REPOS_FILE):
+        self._path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._repos: dict[str, str] = {}
+        self._reposByHost: dict[str, dict[str, str]] = {}
+
+    def load(self):
+        """Reload the config file if it has changed since it was last loaded."""
+        if server_test_mode():
+            mtime = "test"
+        else:
+            try:
+                mtime = os.stat(self._path).st_mtime_ns
+            except OSError:
+                mtime = None
+        if mtime == self._mtime and mtime is not None:
+            return
+        with self._lock:
+            if mtime == self._mtime and mtime is not None:
+                return
+            try:
+                repos = getReposFromFile(self._path)
+            except OSError:
+                repos = {}
+            reposByHost = {}
+            for repoName, repoUrl in repos.items():
+                reposByHost.setdefault(repoUrlHost(repoUrl), {})[repoName] = repoUrl
+            self._repos, self._reposByHost, self._mtime = repos, reposByHost, mtime
+
+    def getRepos(self) -> dict:
+        """Returns: dict[repo_name: repo_url]"""
+        self.load()
+        return self._repos
+
+    def getUrl(self, repoName: str) -> str | None:
+        return self.getRepos().get(repoName)
+
+    def byHost(self, host: str) -> dict:
+        """Get repos hosted on given host.\n
+        Returns: dict[repo_name: repo_url]"""
+        self.load()
+        return self._reposByHost.get(host.lower(), {})
+
+    def byProvider(self, provider: OAuthProvider) -> dict:
+        """Get repos hosted by given OAuth provider.\n
+        Returns: dict[repo_name: repo_url]"""
+        return self.byHost(PROVIDER_HOSTS[provider])
+
+
+serverRepos = ServerRepos()
+
+
 def stageChanges(repoFolderPath: str, message: str, userName: str, userMail) -> bool:
     """Commit changes in given repo whith given message and push it to remote.\n"""
     if server_test_mode():
@@ -30,16 +115,19 @@ def stageChanges(repoFolderPath: str, message: str, userName: str, userMail) ->
 
     try:
         repo = git.Repo(repoFolderPath)
-        repo.git.config('user.name', userName)
-        repo.git.config('user.email', userMail)
-        repo.git.add(repoFolderPath)
-        repo.index.commit(message)
+        # git allows a single writer of the index, other workers and processes wait instead of failing on its lock
+        with repoLocks.write(repoFolderPath):
+            repo.git.config('user.name', userName)
+            repo.git.config('user.email', userMail)
+            repo.git.add(repoFolderPath)
+            repo.index.commit(message)
         fetchInfo = repo.remote().fetch()
         for info in fetchInfo:
             if info.flags == info.REJECTED:
                 raise MyServer.error.FetchRejectedException()
         try:
-            repo.git.merge(f'origin/{repo.active_branch.name}')
+            ensureMergeBase(repo, f'origin/{repo.active_branch.name}')
+            mergeRemote(repo, repoFolderPath)
         except git.GitCommandError:
             raise MyServer.error.MergeRejectedException(f"Merge was rejected after fetching results from remote repo.")
         pushInfo = repo.remote().push()
@@ -47,6 +135,7 @@ def stageChanges(repoFolderPath: str, message: str, userName: str, userMail) ->
             pushInfo.raise_if_error()
         except Exception:
             raise MyServer.error.PushRejectedException(f"Push operation resulted in conflicts.")
+        repoFreshness.markFresh(repoFolderPath)
         return True
     except git.InvalidGitRepositoryError:
         return False
@@ -72,40 +161,264 @@ def getRepoInfo(request) -> tuple[str, str]:
     return f"{config('REPOS_FOLDER')}/{provider_prefix}/{userId}/{repoFolder}", repoName
 
 
-def cloneRepo(repoFolder: str, repoUrl, token, provider: OAuthProvider):
-    """Clone repo from given url"""
+class JobProgress(git.RemoteProgress):
+    """Reports progress of git clone and pull operations to a job (see gitJobs.Job.setProgress)."""
+
+    STAGES = {
+        git.RemoteProgress.COUNTING: "counting",
+        git.RemoteProgress.COMPRESSING: "compressing",
+        git.RemoteProgress.WRITING: "writing",
+        git.RemoteProgress.RECEIVING: "receiving",
+        git.RemoteProgress.RESOLVING: "resolving",
+        git.RemoteProgress.FINDING_SOURCES: "finding sources",
+        git.RemoteProgress.CHECKING_OUT: "checking out",
+    }
+
+    def __init__(self, job):
+        super().__init__()
+        self._job = job
+
+    def update(self, op_code, cur_count, max_count=None, message=""):
+        self._job.setProgress(self.STAGES.get(op_code & self.OP_MASK, "other"), cur_count, max_count, message)
+
+
+def ensureMergeBase(repo: git.Repo, ref: str):
+    """Fetch the full history of a shallow clone if it does not contain the common ancestor of HEAD and ref."""
+    if repo.git.rev_parse("--is-shallow-repository") != "true":
+        return
+    try:
+        repo.git.merge_base("HEAD", ref)
+    except git.GitCommandError:
+        repo.git.fetch("--unshallow")
+
+
+def mergeRemote(repo: git.Repo, repoFolder: str):
+    """Merge the fetched current branch of the remote while holding the lock of the repo.
+    If the merge changed the files, clients following the change feed of the repo are told to reload it."""
+    with repoLocks.write(repoFolder):
+        before = repo.head.commit.hexsha
+        repo.git.merge(f'origin/{repo.active_branch.name}')
+        changed = repo.head.commit.hexsha != before
+    if changed:
+        changeFeed.publish(repoFolder, RESET_EVENT)
+
+
+def cloneOptions() -> dict:
+    """Get options of git clone for the configured clone strategy."""
+    options = {"no_checkout": True}
+    if CLONE_DEPTH > 0:
+        options["depth"] = CLONE_DEPTH
+    if CLONE_FILTER:
+        options["filter"] = CLONE_FILTER
+    return options
+
+
+def checkoutReqFirst(repo: git.Repo, onReqReady: Callable[[], None] | None = None):
+    """Check out working tree of a repo cloned without checkout, starting with the requirements (req folder),
+    so they can be read while the rest of the files are being written."""
+    hasHead = repo.head.is_valid()
+    with repoLocks.write(repo.working_tree_dir):
+        if hasHead and "req" in repo.head.commit.tree:
+            repo.git.checkout("HEAD", "--", "req")
+        os.makedirs(os.path.join(repo.working_tree_dir, "req"), exist_ok=True)
+    if onReqReady is not None:
+        onReqReady()
+    if hasHead:
+        # unlike checkout of paths, read-tree respects sparse checkout
+        repo.git.read_tree("-mu", "HEAD")
+
+
+def authRepoUrl(repoUrl: str, token: str, provider: OAuthProvider) -> str:
+    """Get url of repo with user's token, used to clone and fetch it."""
+    if provider == OAuthProvider.GITHUB:
+        return f"https://{token}:@{repoUrl}"
+    return f"https://oauth2:{token}@{repoUrl}.git"
+
+
+def mirrorFolder(repoUrl: str) -> str:
+    """Get folder of the shared mirror of repo, e.g. REPOS_FOLDER/mirrors/github.com-user-repo.git"""
+    name = repoName2DirName(repoUrl.split("://")[-1].removesuffix(".git"))
+    return f"{config('REPOS_FOLDER')}/{MIRRORS_DIRNAME}/{name}.git"
+
+
+_mirrorLocks: dict[str, threading.Lock] = {}
+_mirrorLocksLock = threading.Lock()
+
+
+def updateMirror(repoUrl: str, token: str, provider: OAuthProvider) -> str | None:
+    """Create or refresh the shared bare mirror of repo with all its branches, fetched with the clone filter (e.g. without blobs).
+    The mirror is fetched at most once per GIT_PULL_TTL, the pulls of all users in the meantime are served from it.
+    The mirror is also locked with flock, so server processes do not fetch into it at once.
+    Shallow clones (GIT_CLONE_DEPTH) do not use mirrors, as git cannot borrow objects from a shallow repo.\n
+    Returns: folder of the mirror or None if it could not be updated (clones then work without it)."""
+    if server_test_mode() or not SHARED_MIRRORS or CLONE_DEPTH > 0:
+        return None
+    folder = mirrorFolder(repoUrl)
+    with _mirrorLocksLock:
+        lock = _mirrorLocks.setdefault(folder, threading.Lock())
+    try:
+        os.makedirs(os.path.dirname(folder), exist_ok=True)
+        with lock, fileLock(folder + ".lock"):
+            if repoFreshness.isFresh(folder) and os.path.exists(folder):
+                return folder
+            if os.path.exists(folder):
+                mirror = git.Repo(folder)
+            else:
+                mirror = git.Repo.init(folder, bare=True, mkdir=True)
+                # objects borrowed by the clones must never be pruned from the mirror
+                mirror.git.config("gc.auto", "0")
+                mirror.git.config("gc.pruneExpire", "never")
+                mirror.git.config("uploadpack.allowFilter", "true")
+            # the mirror's config keeps the url without the token, the url with the token replaces it on every fetch
+            mirror.git.config("remote.origin.url", repoUrl)
+            options = {}
+            if CLONE_FILTER:
+                mirror.git.config("remote.origin.promisor", "true")
+                mirror.git.config("remote.origin.partialclonefilter", CLONE_FILTER)
+                mirror.git.config("extensions.partialClone", "origin")
+                options["filter"] = CLONE_FILTER
+            mirror.git(c=f"url.{authRepoUrl(repoUrl, token, provider)}.insteadOf={repoUrl}").fetch(
+                "origin", "+refs/heads/*:refs/heads/*", "--prune", **options)
+            repoFreshness.markFresh(folder)
+    except (git.GitCommandError, git.InvalidGitRepositoryError, OSError):
+        return None
+    return folder
+
+
+def borrowsFrom(repo: git.Repo, mirror: str) -> bool:
+    """Check whether the clone borrows objects from the given mirror (it was cloned with the mirror as reference)."""
+    try:
+        with open(os.path.join(repo.git_dir, "objects", "info", "alternates")) as file:
+            alternates = file.read().split()
+    except OSError:
+        return False
+    return os.path.abspath(os.path.join(mirror, "objects")) in map(os.path.abspath, alternates)
+
+
+def cloneRepo(repoFolder: str, repoUrl, token, provider: OAuthProvider,
+              progress: git.RemoteProgress | None = None, onReqReady: Callable[[], None] | None = None,
+              reference: str | None = None):
+    """Clone repo from given url, borrowing objects from the reference repo (shared mirror) if it is given."""
     destination = f"{repoFolder}"
     os.makedirs(destination)
 
     if server_test_mode():
         repo = git.Repo.init(destination + "/req")
+        if onReqReady is not None:
+            onReqReady()
         return repo
 
-    if provider == OAuthProvider.GITHUB:
-        url = f"https://{token}:@{repoUrl}"
-    else:
-        url = f"https://oauth2:{token}@{repoUrl}.git"
+    options = cloneOptions()
+    if reference is not None:
+        options["reference"] = reference
     try:
-        repo = git.Repo.clone_from(url, destination)
+        repo = git.Repo.clone_from(authRepoUrl(repoUrl, token, provider), destination, progress=progress, **options)
+        if CLONE_SPARSE:
+            # top-level files and the req folder
+            repo.git.sparse_checkout("init", "--cone")
+            repo.git.sparse_checkout("set", "req")
+        checkoutReqFirst(repo, onReqReady)
     except git.GitCommandError:
         raise MyServer.error.CloneRejectedException(f"Clone was rejected.")
-    # ensure /req exists
-    os.makedirs(f"{destination}/req", exist_ok=True)
     return repo
 
 
-def pullRepo(repoFolder: str, token):
-    """Pull repo from give url"""
+def pullRepo(repoFolder: str, token, progress: git.RemoteProgress | None = None, mirror: str | None = None):
+    """Pull repo from give url, or from the shared mirror if the repo borrows its objects.
+    Requirements can be read while the remote is fetched, they are locked only while fetched changes are merged."""
     if server_test_mode():
         return
 
     repo = git.Repo(repoFolder)
     repo.git.update_environment(GIT_TERMINAL_PROMPT='0', GIT_USERNAME='x-access-token', GIT_PASSWORD=token)
-    origin = repo.remote()
-    pullInfo = origin.pull()
-    for info in pullInfo:
-        if info.flags == info.REJECTED:
+    if mirror is not None and borrowsFrom(repo, mirror):
+        # the objects are already in the mirror, only the branches are updated
+        try:
+            repo.git.fetch(mirror, "+refs/heads/*:refs/remotes/origin/*", "--prune")
+        except git.GitCommandError:
             raise MyServer.error.PullRejectedException("Pull was rejected.")
+    else:
+        origin = repo.remote()
+        fetchInfo = origin.fetch(progress=progress)
+        for info in fetchInfo:
+            if info.flags == info.REJECTED:
+                raise MyServer.error.PullRejectedException("Pull was rejected.")
+    try:
+        ensureMergeBase(repo, f'origin/{repo.active_branch.name}')
+        mergeRemote(repo, repoFolder)
+    except git.GitCommandError:
+        raise MyServer.error.PullRejectedException("Pull was rejected.")
+
+
+class RepoFreshness:
+    """Per-repo record of the last time the repo was known to be in sync with its remote.
+    A repo synced less than ttl seconds ago is not pulled again."""
+
+    def __init__(self, ttl: int):
+        self._ttl = ttl
+        self._syncedAt: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def markFresh(self, repoFolder: str):
+        with self._lock:
+            self._syncedAt[os.path.abspath(repoFolder)] = time.monotonic()
+
+    def isFresh(self, repoFolder: str) -> bool:
+        with self._lock:
+            syncedAt = self._syncedAt.get(os.path.abspath(repoFolder))
+        return syncedAt is not None and time.monotonic() - syncedAt < self._ttl
+
+    def invalidate(self, repoFolder: str):
+        with self._lock:
+            self._syncedAt.pop(os.path.abspath(repoFolder), None)
+
+
+repoFreshness = RepoFreshness(config("GIT_PULL_TTL", default=60, cast=int))
+
+
+def remoteHeadChanged(repoFolder: str, repoUrl: str, token: str, provider: OAuthProvider) -> bool:
+    """Check with git ls-remote (a single request, no objects are transferred) whether the current branch on the remote
+    points to another commit than the last fetched one. In case of doubt the head is considered changed."""
+    if server_test_mode():
+        return True
+    try:
+        repo = git.Repo(repoFolder)
+        branch = repo.active_branch.name
+        output = repo.git.ls_remote(authRepoUrl(repoUrl, token, provider), f"refs/heads/{branch}")
+        localSha = repo.git.rev_parse(f"refs/remotes/origin/{branch}")
+    except (git.GitCommandError, git.InvalidGitRepositoryError, git.NoSuchPathError, TypeError):
+        return True
+    return not output or output.split()[0] != localSha
+
+
+def syncRepo(repoFolder: str, repoUrl, token, provider: OAuthProvider, job) -> bool:
+    """Clone repo if it is not on the server yet, otherwise pull it if it may be out of date.
+    Progress is reported to the given job."""
+    progress = JobProgress(job)
+    exists = checkIfExists(repoFolder)
+    if exists:
+        job.markReadable()
+        if repoFreshness.isFresh(repoFolder):
+            return True
+    # the mirror is fetched once for all users, objects fetched into it are not transferred again to the clones using it
+    job.setProgress("updating mirror", 0, None)
+    mirror = updateMirror(repoUrl, token, provider)
+    if exists:
+        if mirror is not None or remoteHeadChanged(repoFolder, repoUrl, token, provider):
+            pullRepo(repoFolder, token, progress, mirror)
+        repoFreshness.markFresh(repoFolder)
+        return True
+    try:
+        cloneRepo(repoFolder, repoUrl, token, provider, progress, job.markReadable, mirror)
+    except BaseException:
+        # a partial clone would be taken for a cloned repo by the next sync, readers admitted when the requirements
+        # were checked out finish before it is removed
+        with repoLocks.write(repoFolder):
+            job.readable = False
+            rmtree(repoFolder, ignore_errors=True)
+        raise
+    repoFreshness.markFresh(repoFolder)
+    return True
 
 
 def checkIfExists(repoFolder: str) -> bool:
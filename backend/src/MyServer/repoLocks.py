@@ -0,0 +1,199 @@
+"""This module provides per-repo reader/writer locks coordinating Doorstop and git operations on users' repo folders."""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from decouple import config
+
+try:
+    import fcntl
+except ImportError:  # no cross-process locks on platforms without flock
+    fcntl = None
+
+
+@dataclass
+class LockStats:
+    acquisitions: int = 0
+    waitSeconds: float = 0.0
+    maxWaitSeconds: float = 0.0
+    holdSeconds: float = 0.0
+    maxHoldSeconds: float = 0.0
+
+    def record(self, wait: float, hold: float):
+        self.acquisitions += 1
+        self.waitSeconds += wait
+        self.maxWaitSeconds = max(self.maxWaitSeconds, wait)
+        self.holdSeconds += hold
+        self.maxHoldSeconds = max(self.maxHoldSeconds, hold)
+
+
+def lockPath(repoFolder: str) -> str:
+    """Get path of the lock file of the given repo. It is placed next to the repo, outside its working tree."""
+    return os.path.abspath(repoFolder) + ".lock"
+
+
+class RepoLock:
+    """Reader/writer lock of one repo: many concurrent readers or one writer.\n
+    Waiting writers are preferred over new readers. The lock is reentrant: a thread holding it may acquire it again
+    for reading or writing, except that a read lock cannot be upgraded to a write lock.
+    If fileLock is set, the lock is also held on a lock file with flock, which coordinates server processes."""
+
+    def __init__(self, repoFolder: str, fileLock: bool):
+        self._repoFolder = repoFolder
+        self._fileLock = fileLock and fcntl is not None
+        self._condition = threading.Condition()
+        self._readers: dict[int, int] = {}
+        self._writer: int | None = None
+        self._writerDepth = 0
+        self._waitingWriters = 0
+
+    @contextmanager
+    def read(self):
+        """Hold the lock for reading. Yields number of seconds spent waiting for the lock (0 for reentrant acquisitions)."""
+        me = threading.get_ident()
+        start = time.perf_counter()
+        with self._condition:
+            if self._writer == me:
+                self._writerDepth += 1
+                outermost = False
+            elif me in self._readers:
+                self._readers[me] += 1
+                outermost = False
+            else:
+                while self._writer is not None or self._waitingWriters:
+                    self._condition.wait()
+                self._readers[me] = 1
+                outermost = True
+        try:
+            with self._lockFile(fcntl.LOCK_SH if self._fileLock else None, outermost):
+                yield time.perf_counter() - start if outermost else 0.0
+        finally:
+            with self._condition:
+                if self._writer == me:
+                    self._writerDepth -= 1
+                else:
+                    self._readers[me] -= 1
+                    if not self._readers[me]:
+                        del self._readers[me]
+                        self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """Hold the lock for writing. Yields number of seconds spent waiting for the lock (0 for reentrant acquisitions)."""
+        me = threading.get_ident()
+        start = time.perf_counter()
+        with self._condition:
+            if self._writer == me:
+                self._writerDepth += 1
+                outermost = False
+            elif me in self._readers:
+                raise RuntimeError("Read lock of a repo cannot be upgraded to a write lock.")
+            else:
+                self._waitingWriters += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._condition.wait()
+                finally:
+                    self._waitingWriters -= 1
+                self._writer, self._writerDepth = me, 1
+                outermost = True
+        try:
+            with self._lockFile(fcntl.LOCK_EX if self._fileLock else None, outermost):
+                yield time.perf_counter() - start if outermost else 0.0
+        finally:
+            with self._condition:
+                self._writerDepth -= 1
+                if not self._writerDepth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+    @contextmanager
+    def _lockFile(self, operation: int | None, outermost: bool):
+        # there is nothing to coordinate until the repo is cloned
+        if operation is None or not outermost or not os.path.isdir(os.path.join(self._repoFolder, ".git")):
+            yield
+            return
+        try:
+            # every acquisition opens the file, as flock is shared by all holders of the same descriptor
+            file = open(lockPath(self._repoFolder), "a")
+        except OSError:
+            yield
+            return
+        try:
+            fcntl.flock(file, operation)
+            yield
+        finally:
+            file.close()
+
+
+class RepoLocks:
+    """Registry of the locks of all repos, keyed by repo folder, with wait and hold time statistics."""
+
+    def __init__(self, fileLocks: bool):
+        self._fileLocks = fileLocks
+        self._locks: dict[str, RepoLock] = {}
+        self._lock = threading.Lock()
+        self._stats = {"read": LockStats(), "write": LockStats()}
+
+    def getLock(self, repoFolder: str) -> RepoLock:
+        key = os.path.abspath(repoFolder)
+        with self._lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = RepoLock(key, self._fileLocks)
+            return lock
+
+    @contextmanager
+    def read(self, repoFolder: str):
+        with self.getLock(repoFolder).read() as wait:
+            with self._measure("read", wait):
+                yield
+
+    @contextmanager
+    def write(self, repoFolder: str):
+        with self.getLock(repoFolder).write() as wait:
+            with self._measure("write", wait):
+                yield
+
+    def stats(self) -> dict[str, LockStats]:
+        with self._lock:
+            return {mode: LockStats(**vars(stats)) for mode, stats in self._stats.items()}
+
+    @contextmanager
+    def _measure(self, mode: str, wait: float):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            hold = time.perf_counter() - start
+            with self._lock:
+                self._stats[mode].record(wait, hold)
+
+
+@contextmanager
+def fileLock(path: str):
+    """Hold an exclusive flock on the given lock file, coordinating server processes. Without flock nothing is locked."""
+    if fcntl is None:
+        yield
+        return
+    try:
+        file = open(path, "a")
+    except OSError:
+        yield
+        return
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+    finally:
+        file.close()
+
+
+def reqFolderRepo(userFolder: str) -> str:
+    """Get repo folder of the given requirements folder (<repo>/req)."""
+    return os.path.dirname(os.path.abspath(userFolder))
+
+
+repoLocks = RepoLocks(config("REPO_FILE_LOCKS", default=True, cast=bool))
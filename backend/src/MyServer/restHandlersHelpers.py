@@ -1,6 +1,20 @@
+import base64
+import bisect
+import functools
+import inspect
+import json
+import os
+from dataclasses import dataclass
 from shutil import rmtree
+from typing import Callable, Iterator
 import MyServer.error
 import doorstop
+from doorstop.core.types import Level, UID
+from MyServer.treeCache import folderStamp, snapshotCache, treeCache
+from MyServer.treeSnapshot import DocumentSnapshot, ItemSnapshot
+from MyServer.changeFeed import RESET_EVENT, changeFeed
+from MyServer.linkIndex import linkIndexes
+from MyServer.repoLocks import repoLocks, reqFolderRepo
 
 """
 Module to handle communication with the Doorstop API for modifying, adding and deleting requirements and project documents.
@@ -9,6 +23,50 @@ It contains functions for adding and removing documents and requirements and for
 representation of existing documents and requirements to customers.
 """
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# fields of the requirements representation and the snapshot columns of their values
+REQ_FIELD_COLUMNS = {
+    "id": "uid",
+    "text": "text",
+    "reviewed": "reviewed",
+    "docPrefix": "prefix",
+    "links": "links",
+}
+DOC_REQ_FIELDS = ("id", "text", "reviewed", "links")
+ALL_REQ_FIELDS = ("id", "text", "reviewed", "docPrefix", "links")
+MAX_BATCH_OPERATIONS = 1000
+
+
+def lockingUserFolder(write: bool):
+    """
+    Decorator holding the lock of the repo of the userFolder argument while the function runs, exclusively if write is set,
+    otherwise shared with other readers. Git operations on the repo take the same lock.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            userFolder = signature.bind(*args, **kwargs).arguments["userFolder"]
+            lock = repoLocks.write if write else repoLocks.read
+            with lock(reqFolderRepo(userFolder)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def publishChange(userFolder: str, type: str, **data):
+    """
+    Function publishing a change of the document tree in the given folder to the clients following the change feed of the repo.
+    The version of the tree after the change is recorded with the event when someone follows the feed.
+    """
+    repoFolder = reqFolderRepo(userFolder)
+    version = getReqsVersion(userFolder) if changeFeed.subscriberCount(repoFolder) else None
+    changeFeed.publish(repoFolder, type, version, **data)
+
+
+@lockingUserFolder(write=True)
 def addUserDocument(docId: str, parentId: str, userFolder: str):
     """
     Function containing the logic for adding a document. It uses the document tree from the Doorstop API to manage the process of adding a new document by calling the
@@ -16,32 +74,38 @@ def addUserDocument(docId: str, parentId: str, userFolder: str):
     appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(cwd=userFolder)
-        if len(docTree.documents) >= 1 and not parentId:
-            raise MyServer.error.NoParentSpecifiedException(f"parentID must be specified for the given document.")
-        if len(docTree.documents) == 0 and parentId:
-            raise MyServer.error.ParentOfEmptyTreeSpecifiedException()
-        docName = userFolder + "/" + docId
-        docTree.create_document(
-            docName, docId, parent=parentId)
+        with treeCache.editTree(userFolder) as docTree:
+            if len(docTree.documents) >= 1 and not parentId:
+                raise MyServer.error.NoParentSpecifiedException(f"parentID must be specified for the given document.")
+            if len(docTree.documents) == 0 and parentId:
+                raise MyServer.error.ParentOfEmptyTreeSpecifiedException()
+            docName = userFolder + "/" + docId
+            docTree.create_document(
+                docName, docId, parent=parentId)
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build document tree.")
     except FileNotFoundError:
         raise MyServer.error.DoorstopException(f"User folder {userFolder} was not found.")
+    publishChange(userFolder, "docAdded", docId=docId, parentId=parentId or None)
 
 def removeDocTree(tree: doorstop.Tree, docId: str, userFolder: str, rootTree: doorstop.Tree):
     """
     Function containing the logic for removing a specific subtree from the project document tree. It uses the tree from the Doorstop API to manage the process of deleting an existing subtree by calling the
-    appropriate Doorstop functions.
+    appropriate Doorstop functions. The requirements linking to the removed ones are looked up in the reverse-link index of the repo,
+    so only they are read and every one of them is written once, before the documents are deleted.
     """
     doc = tree.document
     if doc.prefix == docId:
         ToBeRemoved = tree.documents
-        ToCheck = [
-            document for document in rootTree.documents if document not in ToBeRemoved]
-        for document in ToBeRemoved:
-            for req in document.items:
-                RemoveLinksToReq(str(req.uid), ToCheck, userFolder)
+        removedUIDs = {str(req.uid) for document in ToBeRemoved for req in document.items}
+        linkIndex = linkIndexes.getIndex(userFolder, rootTree)
+        modified = {}
+        for uid in removedUIDs:
+            for childUID in linkIndex.linkedBy(uid):
+                if childUID not in removedUIDs and childUID not in modified:
+                    modified[childUID] = rootTree.find_item(childUID)
+        for req in modified.values():
+            req.links = [link for link in req.links if str(link) not in removedUIDs]
         for document in tree.documents:
             rmtree(document.path)
         return
@@ -50,6 +114,7 @@ def removeDocTree(tree: doorstop.Tree, docId: str, userFolder: str, rootTree: do
     return
 
 
+@lockingUserFolder(write=True)
 def deleteUserDocument(docId: str, userFolder: str):
     """
     Function containing the logic for deleting a document. Uses the document tree from the Doorstop API to manage the process of deleting an existing document by calling the
@@ -57,7 +122,7 @@ def deleteUserDocument(docId: str, userFolder: str):
     via appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(userFolder)
+        docTree = treeCache.getTree(userFolder)
         numberOfDocuments = len(docTree.documents)
         if numberOfDocuments == 0:
             raise MyServer.error.EmptyDocumentTreeException(f"No documents were created yet.")
@@ -65,12 +130,18 @@ def deleteUserDocument(docId: str, userFolder: str):
             doc = docTree.find_document(docId)
         except doorstop.DoorstopError:
             raise MyServer.error.DocNotFoundException(f"Document of given UID: {docId} was not found.")
-        removeDocTree(docTree, docId, userFolder, docTree)
+        try:
+            removeDocTree(docTree, docId, userFolder, docTree)
+        finally:
+            treeCache.invalidate(userFolder)
+            linkIndexes.invalidate(userFolder)
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build document tree.")
+    publishChange(userFolder, "docDeleted", docId=docId)
         
 
 
+@lockingUserFolder(write=True)
 def addUserRequirement(docId: str, reqNumberId: int, reqText: str, userFolder: str):
     """
     Function containing the logic for adding a requirement. It uses the document tree from the Doorstop API to manage the process of adding a new requirement by calling the
@@ -78,33 +149,24 @@ def addUserRequirement(docId: str, reqNumberId: int, reqText: str, userFolder: s
     via appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(userFolder)
-        try:
-            doc = docTree.find_document(docId)
-        except doorstop.DoorstopError:
-            raise MyServer.error.DocNotFoundException(f"Document of given UID: {docId} was not found.")
-        try:
-            req = doc.add_item(number=reqNumberId)
-        except doorstop.DoorstopError:
-            raise MyServer.error.InvalidReqIDException(f"Given Req ID: {reqNumberId} is invalid.")
-        if reqText:
-            req.text = reqText
+        with treeCache.editTree(userFolder) as docTree:
+            try:
+                doc = docTree.find_document(docId)
+            except doorstop.DoorstopError:
+                raise MyServer.error.DocNotFoundException(f"Document of given UID: {docId} was not found.")
+            try:
+                req = doc.add_item(number=reqNumberId)
+            except doorstop.DoorstopError:
+                raise MyServer.error.InvalidReqIDException(f"Given Req ID: {reqNumberId} is invalid.")
+            if reqText:
+                req.text = reqText
+        linkIndexes.update(userFolder, docTree, lambda index: index.addItem(str(req.uid)))
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build document tree.")
+    publishChange(userFolder, "reqAdded", reqId=str(req.uid), docId=docId, text=req.text)
 
 
-def RemoveLinksToReq(reqId: str, documents: list[doorstop.Document], userFolder: str):
-    """
-    Function containing logic for removing references to a given subtree requirement from the project document tree. It uses the document tree from the Doorstop API to manage the process of removing an existing subtree by calling the
-    relevant Doorstop functions.
-    """
-    for doc in documents:
-        reqs = doc.items
-        for req in reqs:
-            if str(req.uid) != reqId:
-                deleteUserLink(str(req.uid), reqId, userFolder)
-
-
+@lockingUserFolder(write=True)
 def deleteUserRequirement(docId: str, reqUID: str, userFolder: str):
     """
     Function containing the logic for removing a requirement. It uses the tree from the Doorstop API to manage the process of removing an existing requirement by calling the
@@ -112,17 +174,23 @@ def deleteUserRequirement(docId: str, reqUID: str, userFolder: str):
     via appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(userFolder)
-        doc = docTree.find_document(docId)
-        req = doc.find_item(reqUID)
-        RemoveLinksToReq(reqUID, docTree.documents, userFolder)
-        req.delete()
+        with treeCache.editTree(userFolder) as docTree:
+            doc = docTree.find_document(docId)
+            req = doc.find_item(reqUID)
+            uid = str(req.uid)
+            for childUID in linkIndexes.getIndex(userFolder, docTree).linkedBy(uid):
+                if childUID != uid:
+                    docTree.find_item(childUID).unlink(uid)
+            req.delete()
+        linkIndexes.update(userFolder, docTree, lambda index: index.removeItem(uid))
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build doorstop tree in the given user folder {userFolder}.")
     except FileNotFoundError:
         raise MyServer.error.ReqNotFoundException(f"{reqUID} does not exist or {docId} does not exist.")
+    publishChange(userFolder, "reqDeleted", reqId=uid, docId=docId)
 
 
+@lockingUserFolder(write=True)
 def editUserRequirement(docId: str, reqUID: str, reqText: str, userFolder: str):
     """
     Function containing the logic for modifying an existing requirement (modifying the requirement text). It uses the document tree from the Doorstop API to manage the process of modifying an existing requirement by calling the
@@ -130,7 +198,7 @@ def editUserRequirement(docId: str, reqUID: str, reqText: str, userFolder: str):
     via appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(userFolder)
+        docTree = treeCache.getTree(userFolder)
         doc = docTree.find_document(docId)
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build doorstop tree in the given user folder {userFolder}.")
@@ -138,9 +206,13 @@ def editUserRequirement(docId: str, reqUID: str, reqText: str, userFolder: str):
         req = doc.find_item(reqUID)
         req.text = reqText
     except doorstop.DoorstopError:
+        treeCache.invalidate(userFolder)
         raise MyServer.error.ReqNotFoundException(f"{reqUID} does not exist or {docId} does not exist.")
+    treeCache.touch(userFolder, docTree)
+    publishChange(userFolder, "reqEdited", reqId=str(req.uid), docId=docId, text=req.text)
 
 
+@lockingUserFolder(write=True)
 def addUserLink(req1UID: str, req2UID: str, userFolder: str):
     """
     Function containing the logic to add a reference in an existing requirement to another existing requirement. It uses the document tree from the Doorstop API to manage this process by calling the
@@ -148,11 +220,14 @@ def addUserLink(req1UID: str, req2UID: str, userFolder: str):
     via appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(userFolder)
-        docTree.link_items(req1UID, req2UID)
+        with treeCache.editTree(userFolder) as docTree:
+            child, parent = docTree.link_items(req1UID, req2UID)
+        linkIndexes.update(userFolder, docTree, lambda index: index.addLink(str(child.uid), str(parent.uid)))
     except doorstop.DoorstopError:
         raise MyServer.error.LinkCycleException(f"Attempted to create link cycle.")
+    publishChange(userFolder, "linkAdded", reqId=str(child.uid), linkedReqId=str(parent.uid))
 
+@lockingUserFolder(write=True)
 def deleteUserLink(req1UID: str, req2UID: str, userFolder: str):
     """
     Function containing the logic to remove a reference in an existing requirement to another existing requirement. It uses the document tree from the Doorstop API to manage this process by calling the
@@ -160,21 +235,282 @@ def deleteUserLink(req1UID: str, req2UID: str, userFolder: str):
     via appropriate exceptions.
     """
     try:
-        docTree = doorstop.build(userFolder)
-        docTree.unlink_items(req1UID, req2UID)
+        with treeCache.editTree(userFolder) as docTree:
+            child, parent = docTree.unlink_items(req1UID, req2UID)
+        linkIndexes.update(userFolder, docTree, lambda index: index.removeLink(str(child.uid), str(parent.uid)))
     except doorstop.DoorstopError:
         raise MyServer.error.ReqNotFoundException(f"{req1UID} does not exist or {req2UID} does not exist.")
+    publishChange(userFolder, "linkRemoved", reqId=str(child.uid), linkedReqId=str(parent.uid))
 
 
-def getDocReqs(docId: str, userFolder: str) -> list[doorstop.Item] or list:
+class BatchWriter:
     """
-    Function containing the logic for finding the requirements of an existing document. It uses the document tree from the Doorstop API to manage this process by calling the
-    appropriate Doorstop functions. If an error occurs during this process, an appropriate message is created and returned to the client
-    via appropriate exceptions.
+    Defers the saving of requirements modified by a batch of operations, so every touched requirement file is written once,
+    when the batch is finished, instead of once per operation. Changes are published to the change feed after they are saved.
+    Files created or deleted right away by Doorstop (new documents and requirements, deleted requirements) are recorded,
+    so a failed batch is rolled back without leaving any of its changes on disk.
     """
+
+    def __init__(self, userFolder: str):
+        self._userFolder = userFolder
+        self._touched: dict[str, doorstop.Item] = {}
+        self._changes: list[tuple[str, dict]] = []
+        self._undo: list[Callable[[], None]] = []
+
+    def touch(self, req: doorstop.Item) -> doorstop.Item:
+        req.auto = False
+        self._touched[str(req.uid)] = req
+        return req
+
+    def created(self, path: str):
+        """Record a file or folder created by the batch."""
+        self._undo.append(lambda: rmtree(path) if os.path.isdir(path) else os.remove(path))
+
+    def delete(self, req: doorstop.Item):
+        path = req.path
+        with open(path, "rb") as file:
+            content = file.read()
+
+        def restore():
+            with open(path, "wb") as file:
+                file.write(content)
+
+        self._touched.pop(str(req.uid), None)
+        self._undo.append(restore)
+        req.delete()
+
+    def changed(self, type: str, **data):
+        self._changes.append((type, data))
+
+    def rollback(self):
+        """Drop the changes of touched requirements, remove created files and restore deleted ones, the latest first."""
+        self._touched.clear()
+        self._changes.clear()
+        while self._undo:
+            self._undo.pop()()
+
+    def flush(self):
+        """Save all touched requirements, Doorstop turns automatic saving back on for every saved requirement."""
+        for req in self._touched.values():
+            req.save()
+        self._touched.clear()
+        for type, data in self._changes:
+            publishChange(self._userFolder, type, **data)
+        self._changes.clear()
+        self._undo.clear()
+
+
+def _batchAddDoc(docTree: doorstop.Tree, writer: BatchWriter, operation: dict, userFolder: str) -> dict:
+    docId, parentId = operation.get("docId"), operation.get("parentId")
+    if len(docTree.documents) >= 1 and not parentId:
+        raise MyServer.error.NoParentSpecifiedException(f"parentID must be specified for the given document.")
+    if len(docTree.documents) == 0 and parentId:
+        raise MyServer.error.ParentOfEmptyTreeSpecifiedException()
+    path = userFolder + "/" + docId
+    existed = os.path.exists(path)
+    docTree.create_document(path, docId, parent=parentId)
+    if not existed:
+        writer.created(path)
+    writer.changed("docAdded", docId=docId, parentId=parentId or None)
+    return {}
+
+
+def _batchAddReq(docTree: doorstop.Tree, writer: BatchWriter, operation: dict, userFolder: str) -> dict:
+    docId, reqNumberId = operation.get("docId"), operation.get("reqNumberId")
     try:
-        docTree = doorstop.build(userFolder)
         doc = docTree.find_document(docId)
+    except doorstop.DoorstopError:
+        raise MyServer.error.DocNotFoundException(f"Document of given UID: {docId} was not found.")
+    try:
+        req = writer.touch(doc.add_item(number=reqNumberId))
+    except doorstop.DoorstopError:
+        raise MyServer.error.InvalidReqIDException(f"Given Req ID: {reqNumberId} is invalid.")
+    writer.created(req.path)
+    if operation.get("reqText"):
+        req.text = operation.get("reqText")
+    uid = str(req.uid)
+    linkIndexes.update(userFolder, docTree, lambda index: index.addItem(uid))
+    writer.changed("reqAdded", reqId=uid, docId=docId, text=req.text)
+    return {"reqId": uid}
+
+
+def _batchFindReq(docTree: doorstop.Tree, docId: str, reqUID: str) -> doorstop.Item:
+    try:
+        return docTree.find_document(docId).find_item(reqUID)
+    except doorstop.DoorstopError:
+        raise MyServer.error.ReqNotFoundException(f"{reqUID} does not exist or {docId} does not exist.")
+
+
+def _batchEditReq(docTree: doorstop.Tree, writer: BatchWriter, operation: dict, userFolder: str) -> dict:
+    req = writer.touch(_batchFindReq(docTree, operation.get("docId"), operation.get("reqId")))
+    req.text = operation.get("reqText")
+    writer.changed("reqEdited", reqId=str(req.uid), docId=operation.get("docId"), text=req.text)
+    return {}
+
+
+def _batchDeleteReq(docTree: doorstop.Tree, writer: BatchWriter, operation: dict, userFolder: str) -> dict:
+    req = _batchFindReq(docTree, operation.get("docId"), operation.get("reqId"))
+    uid = str(req.uid)
+    for childUID in linkIndexes.getIndex(userFolder, docTree).linkedBy(uid):
+        if childUID != uid:
+            writer.touch(docTree.find_item(childUID)).unlink(uid)
+    writer.delete(req)
+    linkIndexes.update(userFolder, docTree, lambda index: index.removeItem(uid))
+    writer.changed("reqDeleted", reqId=uid, docId=operation.get("docId"))
+    return {}
+
+
+def _batchLink(docTree: doorstop.Tree, writer: BatchWriter, operation: dict, userFolder: str) -> dict:
+    req1UID, req2UID = operation.get("req1Id"), operation.get("req2Id")
+    try:
+        writer.touch(docTree.find_item(req1UID))
+        child, parent = docTree.link_items(req1UID, req2UID)
+    except doorstop.DoorstopError:
+        raise MyServer.error.LinkCycleException(f"Attempted to create link cycle.")
+    linkIndexes.update(userFolder, docTree, lambda index: index.addLink(str(child.uid), str(parent.uid)))
+    writer.changed("linkAdded", reqId=str(child.uid), linkedReqId=str(parent.uid))
+    return {}
+
+
+def _batchUnlink(docTree: doorstop.Tree, writer: BatchWriter, operation: dict, userFolder: str) -> dict:
+    req1UID, req2UID = operation.get("req1Id"), operation.get("req2Id")
+    try:
+        writer.touch(docTree.find_item(req1UID))
+        child, parent = docTree.unlink_items(req1UID, req2UID)
+    except doorstop.DoorstopError:
+        raise MyServer.error.ReqNotFoundException(f"{req1UID} does not exist or {req2UID} does not exist.")
+    linkIndexes.update(userFolder, docTree, lambda index: index.removeLink(str(child.uid), str(parent.uid)))
+    writer.changed("linkRemoved", reqId=str(child.uid), linkedReqId=str(parent.uid))
+    return {}
+
+
+# operations of a batch, they take the same parameters as the corresponding single requests
+BATCH_PARAMETERS = {
+    "addDoc": ("docId", "parentId"),
+    "addReq": ("docId", "reqNumberId", "reqText"),
+    "editReq": ("docId", "reqId", "reqText"),
+    "deleteReq": ("docId", "reqId"),
+    "link": ("req1Id", "req2Id"),
+    "unlink": ("req1Id", "req2Id"),
+}
+BATCH_OPERATIONS = {
+    "addDoc": _batchAddDoc,
+    "addReq": _batchAddReq,
+    "editReq": _batchEditReq,
+    "deleteReq": _batchDeleteReq,
+    "link": _batchLink,
+    "unlink": _batchUnlink,
+}
+
+
+def _batchParameterError(operation: dict) -> str | None:
+    """Check the types of the parameters of a batch operation, the document tree is checked when the operation is applied."""
+    for name in BATCH_PARAMETERS[operation["op"]]:
+        value = operation.get(name)
+        if name == "parentId":
+            valid = value is None or isinstance(value, str)
+        elif name == "reqNumberId":
+            valid = value in (None, "") or (isinstance(value, int) and not isinstance(value, bool))
+        elif name == "reqText":
+            valid = isinstance(value, str) or (value is None and operation["op"] == "addReq")
+        else:
+            valid = isinstance(value, str) and value != ""
+        if not valid:
+            return f"invalid parameter {name}."
+    return None
+
+
+def parseBatch(operations) -> list[dict]:
+    """
+    Function validating the operations of a batch request: a list of objects with the name of the operation in the op field and its parameters.
+    If an operation is invalid, an appropriate message is returned to the client via appropriate exceptions and no operation is applied.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise MyServer.error.InvalidBatchException(f"operations must be a non-empty list.")
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise MyServer.error.InvalidBatchException(f"A batch can contain at most {MAX_BATCH_OPERATIONS} operations.")
+    for i, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get("op") not in BATCH_OPERATIONS:
+            raise MyServer.error.InvalidBatchException(f"Operation {i} must be one of: {', '.join(BATCH_OPERATIONS)}.")
+        parameterError = _batchParameterError(operation)
+        if parameterError:
+            raise MyServer.error.InvalidBatchException(f"Operation {i}: {parameterError}")
+    return operations
+
+
+@lockingUserFolder(write=True)
+def applyUserBatch(operations: list[dict], userFolder: str) -> tuple[list[dict], MyServer.error.CustomAPIException | None]:
+    """
+    Function containing the logic for applying a batch of operations (adding documents, adding, modifying and removing requirements, adding and removing links)
+    in the given order against one document tree. Modified requirements are written once, after the last operation. The batch is atomic: it stops at the first
+    failed operation and the operations before it are rolled back, so no file is changed.\n
+    Returns: tuple[result of every operation ("ok", "rolledBack", "failed" or "skipped"), exception of the failed operation or None]
+    """
+    results = []
+    error = None
+    restored = True
+    try:
+        with treeCache.editTree(userFolder) as docTree:
+            writer = BatchWriter(userFolder)
+            try:
+                for operation in operations:
+                    if error is not None:
+                        results.append({"op": operation["op"], "status": "skipped"})
+                        continue
+                    try:
+                        result = BATCH_OPERATIONS[operation["op"]](docTree, writer, operation, userFolder)
+                        results.append({"op": operation["op"], "status": "ok", **result})
+                    except doorstop.DoorstopError:
+                        error = MyServer.error.DoorstopException(f"Could not apply operation {len(results)}.")
+                    except MyServer.error.CustomAPIException as e:
+                        error = e
+                    if error is not None:
+                        results.append({"op": operation["op"], "status": "failed", "message": str(error.detail), "api_error_code": error.api_error_code})
+            except BaseException:
+                writer.rollback()
+                raise
+            if error is None:
+                writer.flush()
+            else:
+                try:
+                    writer.rollback()
+                except OSError:
+                    restored = False
+    except doorstop.DoorstopError:
+        raise MyServer.error.DoorstopException(f"Could not build document tree.")
+    except FileNotFoundError:
+        raise MyServer.error.DoorstopException(f"User folder {userFolder} was not found.")
+    if error is not None:
+        # the cached tree and link index still hold the changes of the rolled back operations
+        treeCache.invalidate(userFolder)
+        linkIndexes.invalidate(userFolder)
+        for result in results:
+            if result["status"] == "ok":
+                result["status"] = "rolledBack"
+        if not restored:
+            publishChange(userFolder, RESET_EVENT)
+    return results, error
+
+
+@lockingUserFolder(write=False)
+def getReqsVersion(userFolder: str) -> str:
+    """
+    Function returning the version of the documents and requirements in the given folder, which changes whenever any of their files is modified.
+    It is computed from the modification times and sizes of the files, without building the document tree.
+    """
+    return folderStamp(os.path.abspath(userFolder))[0]
+
+
+@lockingUserFolder(write=False)
+def getDocReqs(docId: str, userFolder: str) -> list[ItemSnapshot] or list:
+    """
+    Function containing the logic for finding the requirements of an existing document. It uses the snapshot of the document tree built with the Doorstop API
+    (in a worker process for large repos). If an error occurs during this process, an appropriate message is created and returned to the client
+    via appropriate exceptions.
+    """
+    try:
+        docTree = snapshotCache.getSnapshot(userFolder)
+        doc = docTree.findDocument(docId)
         reqs = doc.items
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build document tree.")
@@ -183,96 +519,212 @@ def getDocReqs(docId: str, userFolder: str) -> list[doorstop.Item] or list:
     return reqs
 
 
-def buildDicts(tree: doorstop.Tree):
+@lockingUserFolder(write=False)
+def getLinkedBy(reqId: str, userFolder: str) -> list[str] or dict[str, list[str]]:
     """
-    Helper function containing the logic for building the individual document dictionaries included in the document representation returned to the customer. It uses the document tree from the Doorstop API to manage this process by calling the
-    relevant Doorstop functions.
+    Function containing the logic for finding the requirements linking to the given one, using the reverse-link index of the document tree.
+    If no requirement is given, the whole index is returned. If an error occurs during this process, an appropriate message is created and returned
+    to the client via appropriate exceptions.
+    """
+    try:
+        index = linkIndexes.getIndex(userFolder)
+    except doorstop.DoorstopError:
+        raise MyServer.error.DoorstopException(f"Could not build document tree.")
+    if not reqId:
+        return index.toDict()
+    return index.linkedBy(reqId)
+
+
+def buildDicts(doc: DocumentSnapshot):
+    """
+    Helper function containing the logic for building the individual document dictionaries included in the document representation returned to the customer.
+    It uses the snapshot of the document and its children.
     """
-    doc = tree.document
     dict = {}
-    dict["prefix"] = str(doc.prefix)
+    dict["prefix"] = doc.prefix
     dict["children"] = []
-    for child in tree.children:
+    for child in doc.children:
         dict["children"].append(buildDicts(child))
     return dict
 
 
+@lockingUserFolder(write=False)
 def serializeDocuments(userFolder: str):
     """
-    Function containing the logic for building the document representation returned to the client. It uses the document tree from the Doorstop API to manage this process by calling the
-    relevant Doorstop functions.
+    Function containing the logic for building the document representation returned to the client. It uses the snapshot of the document tree built with the Doorstop API
+    (in a worker process for large repos).
     """
     try:
         data = []
-        rootTree = doorstop.build(userFolder)
-        if len(rootTree.documents) == 0:
+        snapshot = snapshotCache.getSnapshot(userFolder)
+        if snapshot.root is None:
             return data
-        data.append(buildDicts(rootTree))
+        data.append(buildDicts(snapshot.root))
         return data
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build document tree.")
 
 
-def serializeDocReqs(reqs: list[doorstop.Item]) -> list[dict]:
+def serializeDocReqs(reqs: list[ItemSnapshot], fields: list[str] | None = None) -> list[dict]:
+    """
+    Function containing the logic for building the requirements dictionaries included in the requirements representation returned to the customer.
+    Only the given fields are included, all of DOC_REQ_FIELDS by default.
+    """
+    return list(serializeReqs(reqs, fields or DOC_REQ_FIELDS))
+
+
+def serializeReqs(reqs: list[ItemSnapshot], fields) -> Iterator[dict]:
+    """
+    Function lazily building the dictionaries of the requirements containing only the given fields. The values are read field by field
+    from the columns of the snapshot of the requirements.
+    """
+    if not reqs:
+        return
+    indexes = [req.index for req in reqs]
+    columns = [reqs[0].snapshot.column(REQ_FIELD_COLUMNS[field], indexes) for field in fields]
+    for values in zip(*columns):
+        yield {field: value for field, value in zip(fields, values)}
+
+
+@dataclass
+class ReqQuery:
+    """Filtering, projection and pagination parameters of a requirements representation request."""
+    fields: list[str] | None = None
+    prefix: str | None = None
+    reviewed: bool | None = None
+    hasLinks: bool | None = None
+    cursor: str | None = None
+    limit: int | None = None
+
+
+def _parseBool(params, name: str) -> bool | None:
+    value = params.get(name)
+    if value is None or value == "":
+        return None
+    if value.lower() in ("true", "1"):
+        return True
+    if value.lower() in ("false", "0"):
+        return False
+    raise MyServer.error.InvalidQueryParameterException(f"Parameter {name} must be true or false.")
+
+
+def parseReqQuery(params) -> ReqQuery:
+    """
+    Function parsing the query parameters of a requirements representation request: fields (comma separated), prefix, reviewed, hasLinks, cursor and limit.
+    If a parameter is invalid, an appropriate message is returned to the client via appropriate exceptions.
+    """
+    query = ReqQuery()
+    if params.get("fields"):
+        query.fields = [field for field in params.get("fields").split(",") if field]
+        unknown = [field for field in query.fields if field not in REQ_FIELD_COLUMNS]
+        if unknown:
+            raise MyServer.error.InvalidQueryParameterException(f"Unknown fields: {', '.join(unknown)}.")
+    query.prefix = params.get("prefix") or None
+    query.reviewed = _parseBool(params, "reviewed")
+    query.hasLinks = _parseBool(params, "hasLinks")
+    query.cursor = params.get("cursor") or None
+    if params.get("limit"):
+        try:
+            query.limit = int(params.get("limit"))
+        except ValueError:
+            query.limit = 0
+        if query.limit <= 0:
+            raise MyServer.error.InvalidQueryParameterException(f"Parameter limit must be a positive integer.")
+    return query
+
+
+def encodeCursor(req: ItemSnapshot) -> str:
+    """
+    Function encoding the cursor pointing after the given requirement: the prefix of its document, its level and its UID, which order the requirements.
+    """
+    return base64.urlsafe_b64encode(json.dumps([req.prefix, req.level, req.uid]).encode()).decode()
+
+
+def decodeCursor(cursor: str) -> tuple[str, Level, UID]:
+    try:
+        prefix, level, uid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not all(isinstance(value, str) for value in (prefix, level, uid)):
+            raise TypeError
+        return prefix, Level(level), UID(uid)
+    except (ValueError, TypeError, doorstop.DoorstopError):
+        raise MyServer.error.InvalidQueryParameterException(f"Invalid cursor.")
+
+
+def queryReqs(reqs: list, query: ReqQuery) -> tuple[list, str | None]:
     """
-    Function containing the logic for building the requirements dictionaries included in the requirements representation returned to the customer. It uses the Doorstop API to manage this process by calling the
-    relevant Doorstop functions.
+    Function filtering and paginating requirements according to the given query. The requirements are given either as items or as (item, document prefix) pairs,
+    in hierarchy order: by document and, within a document, by level and UID like Doorstop orders them.
+    The page starts at the first requirement ordered after the one the cursor points to, so the cursor stays valid when that requirement is deleted.\n
+    Returns: tuple[page of requirements, cursor of the next page or None if it is the last one]
     """
-    data = []
-    for req in reqs:
-        data.append({})
-        data[-1]["id"] = str(req.uid)
-        data[-1]["text"] = req.text
-        data[-1]["reviewed"] = req.reviewed
-        links = []
-        for link in req.links:
-            links.append(str(link))
-        data[-1]["links"] = links
-    return data
+    def item(entry):
+        return entry if isinstance(entry, ItemSnapshot) else entry[0]
+
+    def prefix(entry):
+        return entry.prefix if isinstance(entry, ItemSnapshot) else entry[1]
 
+    if query.prefix is not None:
+        reqs = [entry for entry in reqs if prefix(entry) == query.prefix]
+    if query.reviewed is not None:
+        reqs = [entry for entry in reqs if bool(item(entry).reviewed) == query.reviewed]
+    if query.hasLinks is not None:
+        reqs = [entry for entry in reqs if bool(item(entry).links) == query.hasLinks]
+    start = 0
+    if query.cursor:
+        cursorPrefix, level, uid = decodeCursor(query.cursor)
+        if reqs:
+            snapshot = item(reqs[0]).snapshot
+            documents = [document.prefix for document in snapshot.documents]
+            if cursorPrefix not in documents:
+                raise MyServer.error.InvalidQueryParameterException(f"Cursor points to a document that no longer exists.")
 
+            def sortKey(entry):
+                req = item(entry)
+                return snapshot.itemDocuments[req.index], Level(req.level), UID(req.uid)
+
+            start = bisect.bisect_right(reqs, (documents.index(cursorPrefix), level, uid), key=sortKey)
+    if query.limit is None:
+        return reqs[start:], None
+    page = reqs[start:start + query.limit]
+    if start + query.limit >= len(reqs):
+        return page, None
+    return page, encodeCursor(item(page[-1]))
+
+
+@lockingUserFolder(write=False)
 def getAllReqs(userFolder: str):
     """
-    Function containing the logic for building the requirements representation returned to the client. It uses the Doorstop API to manage this process by calling the
-    relevant Doorstop functions.
+    Function containing the logic for building the requirements representation returned to the client. It uses the snapshot of the document tree built with the Doorstop API
+    (in a worker process for large repos). The requirements are paired with the prefixes of their documents, in hierarchy order.
     """
     try:
-        rootTree = doorstop.build(userFolder)
-        if len(rootTree.documents) == 0:
-            return []
-        doc = buildDicts(rootTree)
-        reqs = getAllReqsWithChildren(userFolder, doc)
-        return reqs
+        return snapshotCache.getSnapshot(userFolder).items()
     except doorstop.DoorstopError:
         raise MyServer.error.DoorstopException(f"Could not build document tree.")
 
-def getAllReqsWithChildren(userFolder: str, doc):
+def serializeAllReqs(reqs, fields: list[str] | None = None):
     """
-    Function containing the logic for building the requirements representation returned to the client. It uses the Doorstop API to manage this process by calling the
-    relevant Doorstop functions.
+    Function containing the logic for building the requirements dictionaries included in the requirements representation returned to the customer.
+    Only the given fields are included, all of ALL_REQ_FIELDS by default.
     """
-    reqs = []
-    req = getDocReqs(doc["prefix"], userFolder)
-    reqs.extend([(r, doc["prefix"]) for r in req])
-    for child in doc["children"]:
-        reqs.extend(getAllReqsWithChildren(userFolder, child))
-    return reqs
+    return list(serializeReqs([req for req, docPrefix in reqs], fields or ALL_REQ_FIELDS))
 
-def serializeAllReqs(reqs):
-    """
-    Function containing the logic for building the requirements dictionaries included in the requirements representation returned to the customer. It uses the Doorstop API to manage this process by calling the
-    relevant Doorstop functions.
-    """
-    data = []
-    for reqlist in reqs:
-        req = reqlist[0]
-        data.append({})
-        data[-1]["id"] = str(req.uid)
-        data[-1]["text"] = req.text
-        data[-1]["reviewed"] = req.reviewed
-        data[-1]["docPrefix"] = reqlist[1]
-        links = []
-        for link in req.links:
-            links.append(str(link))
-        data[-1]["links"] = links
-    return data
+def streamAllReqs(reqs, fields: list[str] | None = None, chunkSize: int = STREAM_CHUNK_SIZE):
+    """
+    Generator encoding the requirements representation as a JSON array item by item, so the whole representation is never held in memory.
+    Yields chunks of at least chunkSize bytes (except for the last one).
+    """
+    chunk = ["["]
+    length = 1
+    for i, req in enumerate(serializeReqs([req for req, docPrefix in reqs], fields or ALL_REQ_FIELDS)):
+        part = json.dumps(req)
+        if i:
+            part = ", " + part
+        chunk.append(part)
+        length += len(part)
+        if length >= chunkSize:
+            yield "".join(chunk).encode()
+            chunk = []
+            length = 0
+    chunk.append("]")
+    yield "".join(chunk).encode()
@@ -1,21 +1,33 @@
+import asyncio
 from datetime import datetime, timezone
 import os
+import tempfile
+import time
 import unittest
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, AsyncMock, MagicMock, patch
 from uuid import UUID, uuid4
 from rest_framework import status
+import httpx
 import jwt
 from MyServer.authHelpers import (
     OAuthProvider,
     OAuthToken,
+    OAuthTokenWithInfo,
     TokenMap,
+    IdentityCache,
+    UserIdentity,
     AuthProviderAPI,
+    AuthInfo,
+    getUserIdentity,
+    authenticateRequestAsync,
     generate_frontend_redirect_url,
     generate_authorization_url,
     requires_jwt_login,
 )
 from MyServer.error import InvalidTokenException, TokenNotPresentException, OAuthProviderCommunicationException
 from MyServer.testHelpers import TEST_USERNAME, TEST_UID, TEST_MAIL, TEST_REPOS
+from MyServer.providerSessions import PageCache
+from MyServer.tokenStore import MemoryTokenStore, createTokenStore
 
 @requires_jwt_login
 def dummy_view(self, request):
@@ -54,6 +66,8 @@ class TestAuthHelpers(unittest.TestCase):
 
         mock_session_instance = mock_session.return_value
         mock_session_instance.fetch_token.return_value = {"access_token": "mocked_access_token"}
+        mock_session_instance.access_token = "mocked_access_token"
+        mock_session_instance.token = {"access_token": "mocked_access_token"}
         mock_get_identity.return_value = ("mocked_uid", "mocked_user_name", "mocked_user_mail")
 
         redirect_url = generate_frontend_redirect_url("/callback", AuthProviderAPI(OAuthProvider.GITHUB))
@@ -64,6 +78,33 @@ class TestAuthHelpers(unittest.TestCase):
         )
         mock_get_identity.assert_called_once()
         self.assertTrue(redirect_url.startswith("https://example.com/login_callback?token="))
+        with patch.object(AuthProviderAPI, "getUserMail") as mock_get_user_mail:
+            identity = getUserIdentity(AuthInfo("mocked_access_token", OAuthProvider.GITHUB, "mocked_uid"))
+        mock_get_identity.assert_called_once()
+        mock_get_user_mail.assert_not_called()
+        self.assertEqual(identity.email, "mocked_user_mail")
+
+    @patch("MyServer.authHelpers.AuthProviderAPI.getUserMail", return_value="private_mail")
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity", return_value=("private_uid", "private_user", None))
+    @patch("MyServer.authHelpers.config")
+    @patch("MyServer.authHelpers.OAuth2Session")
+    def test_generate_frontend_redirect_url_caches_private_mail(self, mock_session, mock_config, mock_get_identity, mock_get_user_mail):
+        mock_config.side_effect = lambda key: {
+            "GITHUB_CLIENT_ID": "mocked_client_id",
+            "GITHUB_CLIENT_SECRET": "mocked_client_secret",
+            "FRONTEND_URL": "https://example.com",
+            "JWT_SECRET": "mocked_jwt_secret",
+            "BACKEND_URL": "https://backend.example.com",
+        }[key]
+        mock_session.return_value.fetch_token.return_value = {"access_token": "private_access_token"}
+        mock_session.return_value.access_token = "private_access_token"
+        mock_session.return_value.token = {"access_token": "private_access_token"}
+
+        generate_frontend_redirect_url("/callback", AuthProviderAPI(OAuthProvider.GITHUB))
+        identity = getUserIdentity(AuthInfo("private_access_token", OAuthProvider.GITHUB, "private_uid"))
+        mock_get_identity.assert_called_once()
+        mock_get_user_mail.assert_called_once()
+        self.assertEqual(identity.email, "private_mail")
 
     @patch("MyServer.authHelpers.config")
     def test_generate_authorization_url_github(self, mock_config):
@@ -146,14 +187,110 @@ class TestAuthHelpers(unittest.TestCase):
         mock_get_token.assert_called_once_with(valid_uuid_UUID)
 
     def test_getToken_found(self):
-        token_map = TokenMap()
-        existing_uuid = uuid4()
-        existing_token = OAuthToken("mocked_token", OAuthProvider.GITHUB)
-        token_map._tokenDict[existing_uuid] = existing_token
+        token_map = TokenMap(MemoryTokenStore(), 60)
+        existing_token = OAuthTokenWithInfo("mocked_token", OAuthProvider.GITHUB, "refresh", 1, 7200)
+        existing_uuid = token_map.insertToken(existing_token)
         result = token_map.getToken(existing_uuid)
         self.assertEqual(result, existing_token)
-
-    @patch("MyServer.authHelpers.OAuth2Session.get")
+        self.assertIsNone(token_map.getToken(uuid4()))
+
+    def test_getToken_expired(self):
+        token_map = TokenMap(MemoryTokenStore(), 60)
+        existing_uuid = token_map.insertToken(OAuthTokenWithInfo("mocked_token", OAuthProvider.GITLAB, None, None, None))
+        with patch("MyServer.tokenStore.time.time", return_value=time.time() + 61):
+            self.assertIsNone(token_map.getToken(existing_uuid))
+
+    def test_getToken_shared_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "tokens.sqlite3")
+            existing_token = OAuthTokenWithInfo("mocked_token", OAuthProvider.GITLAB, None, None, None)
+            existing_uuid = TokenMap(createTokenStore("sqlite:///" + path), 60).insertToken(existing_token)
+            self.assertEqual(TokenMap(createTokenStore("sqlite:///" + path), 60).getToken(existing_uuid), existing_token)
+
+    def test_identityCache_fetches_missing_identity(self):
+        cache = IdentityCache(MemoryTokenStore(), 60, 600)
+        provider_api = MagicMock()
+        provider_api.get_identity.return_value = ("uid", "login", None)
+        provider_api.getUserMail.return_value = "mail"
+        identity = cache.getIdentity(provider_api, "token")
+        self.assertEqual((identity.uid, identity.login, identity.email), ("uid", "login", "mail"))
+        self.assertEqual(cache.getIdentity(provider_api, "token"), identity)
+        provider_api.get_identity.assert_called_once_with("token")
+        provider_api.getUserMail.assert_called_once_with("token")
+
+    def test_identityCache_refreshes_stale_identity_in_background(self):
+        cache = IdentityCache(MemoryTokenStore(), 60, 600)
+        cache.setIdentity("token", UserIdentity("uid", "login", "old_mail", time.time() - 120))
+        provider_api = MagicMock()
+        provider_api.get_identity.return_value = ("uid", "login", "new_mail")
+        with patch("MyServer.authHelpers.threading.Thread") as mock_thread:
+            identity = cache.getIdentity(provider_api, "token")
+            self.assertEqual(identity.email, "old_mail")
+            provider_api.get_identity.assert_not_called()
+            mock_thread.assert_called_once()
+            cache.getIdentity(provider_api, "token")
+            mock_thread.assert_called_once()
+        mock_thread.call_args.kwargs["target"]()
+        self.assertEqual(cache.getIdentity(provider_api, "token").email, "new_mail")
+        provider_api.get_identity.assert_called_once_with("token")
+
+    def test_identityCache_fetches_expired_identity(self):
+        cache = IdentityCache(MemoryTokenStore(), 60, 600)
+        cache.setIdentity("token", UserIdentity("uid", "login", "old_mail", time.time() - 700))
+        provider_api = MagicMock()
+        provider_api.get_identity.return_value = ("uid", "login", "new_mail")
+        self.assertEqual(cache.getIdentity(provider_api, "token").email, "new_mail")
+
+    def test_identityCache_getIdentityAsync_fetches_missing_identity(self):
+        cache = IdentityCache(MemoryTokenStore(), 60, 600)
+        provider_api = MagicMock()
+        provider_api.get_identity_async = AsyncMock(return_value=("uid", "login", None))
+        provider_api.getUserMailAsync = AsyncMock(return_value="mail")
+        identity = asyncio.run(cache.getIdentityAsync(provider_api, "token"))
+        self.assertEqual((identity.uid, identity.login, identity.email), ("uid", "login", "mail"))
+        self.assertEqual(asyncio.run(cache.getIdentityAsync(provider_api, "token")), identity)
+        self.assertEqual(cache.getIdentity(provider_api, "token"), identity)
+        provider_api.get_identity_async.assert_awaited_once_with("token")
+        provider_api.get_identity.assert_not_called()
+
+    @patch("MyServer.authHelpers.config", return_value="secret" * 6)
+    @patch("MyServer.authHelpers.tokenMap.getToken")
+    def test_authenticateRequestAsync(self, mock_get_token, mock_config):
+        uuid = uuid4()
+        mock_get_token.return_value = OAuthTokenWithInfo("oauth_token", OAuthProvider.GITHUB, None, None, None)
+        request = MagicMock()
+        request.headers = {"Authorization": "Bearer " + jwt.encode({"uuid": str(uuid), "user_id": "uid"}, "secret" * 6)}
+        self.assertEqual(asyncio.run(authenticateRequestAsync(request)), AuthInfo("oauth_token", OAuthProvider.GITHUB, "uid"))
+        mock_get_token.assert_called_once_with(uuid)
+        request.headers = {}
+        self.assertRaises(TokenNotPresentException, asyncio.run, authenticateRequestAsync(request))
+
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_repos_async_fetches_all_pages(self, mock_async_get):
+        async def page_response(url, headers):
+            page = int(url.rsplit("=", 1)[1])
+            return httpx.Response(200, headers={"X-Total-Pages": "3"} if page == 1 else {},
+                                  json=[{"path_with_namespace": f"project{page}"}], request=httpx.Request("GET", url))
+        mock_async_get.side_effect = page_response
+
+        repos = asyncio.run(AuthProviderAPI(OAuthProvider.GITLAB).get_repos_async("mocked_token"))
+
+        self.assertEqual(repos, ["project1", "project2", "project3"])
+        self.assertEqual(mock_async_get.call_count, 3)
+        mock_async_get.assert_any_call("https://gitlab.com/api/v4/projects?membership=true&min_access_level=40&per_page=100&page=1",
+                                       headers={"Authorization": "Bearer mocked_token"})
+
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_identity_async(self, mock_async_get):
+        mock_async_get.return_value = httpx.Response(200, json={"id": "mocked_id", "login": "mocked_login", "email": None})
+        identity = asyncio.run(AuthProviderAPI(OAuthProvider.GITHUB).get_identity_async("mocked_token"))
+        self.assertEqual(identity, ("mocked_id", "mocked_login", None))
+        mock_async_get.assert_called_once_with("https://api.github.com/user", headers={"Authorization": "Bearer mocked_token"})
+
+        mock_async_get.side_effect = httpx.ConnectTimeout("timeout")
+        self.assertRaises(OAuthProviderCommunicationException, asyncio.run, AuthProviderAPI(OAuthProvider.GITHUB).get_identity_async("mocked_token"))
+
+    @patch("MyServer.providerSessions.requests.Session.get")
     def test_getUserMail_github(self, mock_requests_get):
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -163,11 +300,11 @@ class TestAuthHelpers(unittest.TestCase):
         auth_provider = AuthProviderAPI(OAuthProvider.GITHUB)
         email = auth_provider.getUserMail("mocked_token")
 
-        mock_requests_get.assert_called_once_with("https://api.github.com/user/emails")
+        mock_requests_get.assert_called_once_with("https://api.github.com/user/emails", headers={"Authorization": "Bearer mocked_token"}, timeout=ANY)
         mock_requests_get.return_value.json.assert_called_once()
         self.assertEqual(email, "test@example.com")
 
-    @patch("MyServer.authHelpers.OAuth2Session.get")
+    @patch("MyServer.providerSessions.requests.Session.get")
     def test_getUserMail_gitlab(self, mock_requests_get):
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -177,20 +314,20 @@ class TestAuthHelpers(unittest.TestCase):
         auth_provider = AuthProviderAPI(OAuthProvider.GITLAB)
         email = auth_provider.getUserMail("mocked_token")
 
-        mock_requests_get.assert_called_once_with("https://gitlab.com/api/v4/user/emails")
+        mock_requests_get.assert_called_once_with("https://gitlab.com/api/v4/user/emails", headers={"Authorization": "Bearer mocked_token"}, timeout=ANY)
         mock_requests_get.return_value.json.assert_called_once()
         self.assertEqual(email, "test@example.com")
 
-    @patch("MyServer.authHelpers.OAuth2Session.get")
+    @patch("MyServer.providerSessions.requests.Session.get")
     def test_getUserMail_github_status_code_400(self, mock_requests_get):
         mock_response = MagicMock()
         mock_response.status_code = 400
 
         auth_provider = AuthProviderAPI(OAuthProvider.GITHUB)
         self.assertRaises(OAuthProviderCommunicationException, auth_provider.getUserMail, "mocked_token")
-        mock_requests_get.assert_called_once_with("https://api.github.com/user/emails")
+        mock_requests_get.assert_called_once_with("https://api.github.com/user/emails", headers={"Authorization": "Bearer mocked_token"}, timeout=ANY)
 
-    @patch("MyServer.authHelpers.OAuth2Session.get")
+    @patch("MyServer.providerSessions.requests.Session.get")
     def test_getUserMail_gitlab_no_valid_email(self, mock_requests_get):
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -212,11 +349,10 @@ class TestAuthHelpers(unittest.TestCase):
         email = auth_provider.getUserMail("mocked_token")
         self.assertIsNone(email)
 
-    @patch("MyServer.authHelpers.OAuth2Session")
-    def test_get_identity_github(self, mock_oauth_session):
-        mock_oauth_session_instance = mock_oauth_session.return_value
-        mock_oauth_session_instance.get.return_value.status_code = 200
-        mock_oauth_session_instance.get.return_value.json.return_value = {
+    @patch("MyServer.providerSessions.requests.Session.get")
+    def test_get_identity_github(self, mock_requests_get):
+        mock_requests_get.return_value.status_code = 200
+        mock_requests_get.return_value.json.return_value = {
             "id": "mocked_id",
             "login": "mocked_login",
             "email": "mocked_email"
@@ -226,65 +362,76 @@ class TestAuthHelpers(unittest.TestCase):
         token = OAuthToken("mocked_token", OAuthProvider.GITHUB)
         identity = auth_provider.get_identity(token.token)
 
-        mock_oauth_session.assert_called_once_with(token={"access_token": token.token, "token_type": "Bearer"})
-        mock_oauth_session_instance.get.assert_called_once_with("https://api.github.com/user")
+        mock_requests_get.assert_called_once_with("https://api.github.com/user", headers={"Authorization": "Bearer mocked_token"}, timeout=ANY)
         self.assertEqual(identity, ("mocked_id", "mocked_login", "mocked_email"))
     
-    @patch("MyServer.authHelpers.OAuth2Session")
-    def test_get_identity_gitlab(self, mock_oauth_session):
-        mock_oauth_session_instance = mock_oauth_session.return_value
-        mock_oauth_session_instance.get.return_value.status_code = 200
-        mock_oauth_session_instance.get.return_value.json.return_value = {"id": "mocked_id", "username": "mocked_login", "email": "mocked_email"}
+    @patch("MyServer.providerSessions.requests.Session.get")
+    def test_get_identity_gitlab(self, mock_requests_get):
+        mock_requests_get.return_value.status_code = 200
+        mock_requests_get.return_value.json.return_value = {"id": "mocked_id", "username": "mocked_login", "email": "mocked_email"}
     
         auth_provider = AuthProviderAPI(OAuthProvider.GITLAB)
         token = OAuthToken("mocked_token", OAuthProvider.GITLAB)
         identity = auth_provider.get_identity(token.token)
     
-        mock_oauth_session.assert_called_once_with(token={"access_token": token.token, "token_type": "Bearer"})
-        mock_oauth_session_instance.get.assert_called_once_with("https://gitlab.com/api/v4/user")
+        mock_requests_get.assert_called_once_with("https://gitlab.com/api/v4/user", headers={"Authorization": "Bearer mocked_token"}, timeout=ANY)
         self.assertEqual(identity, ("mocked_id", "mocked_login", "mocked_email"))
 
-    @patch("MyServer.authHelpers.OAuth2Session.get")
-    def test_get_repos_github(self, mock_requests_get):
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = [
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_repos_async_github(self, mock_async_get):
+        mock_async_get.return_value = httpx.Response(200, json=[
             {"full_name": "user/repo1", "permissions": {"push": True}},
             {"full_name": "user/repo2", "permissions": {"push": False}},
-        ]
-        mock_requests_get.return_value = mock_response
+        ])
 
-        auth_provider = AuthProviderAPI(OAuthProvider.GITHUB)
-        repos = auth_provider.get_repos("mocked_token")
+        repos = asyncio.run(AuthProviderAPI(OAuthProvider.GITHUB).get_repos_async("mocked_token"))
 
-        mock_requests_get.assert_called_once_with("https://api.github.com/user/repos", headers={"Accept": "application/vnd.github+json"})
-        mock_response.json.assert_called_once()
+        mock_async_get.assert_called_once_with("https://api.github.com/user/repos?per_page=100&page=1", headers={"Accept": "application/vnd.github+json", "Authorization": "Bearer mocked_token"})
         self.assertEqual(repos, ["user/repo1"])
 
-    @patch("MyServer.authHelpers.OAuth2Session.get")
-    def test_get_repos_gitlab(self, mock_requests_get):
-        mock_response = MagicMock()
-        mock_response.status_code = 200
-        mock_response.json.return_value = [{"path_with_namespace": "project1"}, {"path_with_namespace": "project2"}]
-        mock_requests_get.return_value = mock_response
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_repos_async_gitlab(self, mock_async_get):
+        mock_async_get.return_value = httpx.Response(200, json=[{"path_with_namespace": "project1"}, {"path_with_namespace": "project2"}])
 
-        auth_provider = AuthProviderAPI(OAuthProvider.GITLAB)
-        repos = auth_provider.get_repos("mocked_token")
+        repos = asyncio.run(AuthProviderAPI(OAuthProvider.GITLAB).get_repos_async("mocked_token"))
 
-        mock_requests_get.assert_called_once_with("https://gitlab.com/api/v4/projects?membership=true&min_access_level=40")
-        mock_response.json.assert_called_once()
+        mock_async_get.assert_called_once_with("https://gitlab.com/api/v4/projects?membership=true&min_access_level=40&per_page=100&page=1", headers={"Authorization": "Bearer mocked_token"})
         self.assertEqual(repos, ["project1", "project2"])
 
-    @patch("MyServer.authHelpers.OAuth2Session.get")
-    def test_get_repos_github_status_401(self, mock_requests_get):
-        mock_response = MagicMock()
-        mock_response.status_code = 401
-        mock_requests_get.return_value = mock_response
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_repos_async_github_status_401(self, mock_async_get):
+        mock_async_get.return_value = httpx.Response(401)
 
         auth_provider = AuthProviderAPI(OAuthProvider.GITHUB)
-        self.assertRaises(OAuthProviderCommunicationException, auth_provider.get_repos, "mocked_token")
+        self.assertRaises(OAuthProviderCommunicationException, asyncio.run, auth_provider.get_repos_async("mocked_token"))
+
+        mock_async_get.assert_called_once_with("https://api.github.com/user/repos?per_page=100&page=1", headers={"Accept": "application/vnd.github+json", "Authorization": "Bearer mocked_token"})
+
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_repos_async_follows_next_links(self, mock_async_get):
+        async def page_response(url, headers):
+            page = int(url.rsplit("=", 1)[1])
+            return httpx.Response(200, headers={"Link": '<next>; rel="next"'} if page < 2 else {},
+                                  json=[{"full_name": f"user/repo{page}", "permissions": {"push": True}}])
+        mock_async_get.side_effect = page_response
+
+        repos = asyncio.run(AuthProviderAPI(OAuthProvider.GITHUB).get_repos_async("mocked_token"))
+
+        self.assertEqual(repos, ["user/repo1", "user/repo2"])
+
+    @patch("MyServer.authHelpers.providerPages", new_callable=lambda: PageCache(10))
+    @patch("MyServer.providerSessions.httpx.AsyncClient.get")
+    def test_get_repos_async_revalidates_cached_pages(self, mock_async_get, mock_provider_pages):
+        mock_async_get.return_value = httpx.Response(200, headers={"ETag": '"etag1"'}, json=[{"path_with_namespace": "project1"}])
+        auth_provider = AuthProviderAPI(OAuthProvider.GITLAB)
+        self.assertEqual(asyncio.run(auth_provider.get_repos_async("mocked_token")), ["project1"])
+
+        mock_async_get.return_value = httpx.Response(304)
+        self.assertEqual(asyncio.run(auth_provider.get_repos_async("mocked_token")), ["project1"])
+        self.assertEqual(mock_async_get.call_args.kwargs["headers"]["If-None-Match"], '"etag1"')
 
-        mock_requests_get.assert_called_once_with("https://api.github.com/user/repos", headers={"Accept": "application/vnd.github+json"})
+        mock_async_get.return_value = httpx.Response(304)
+        self.assertRaises(OAuthProviderCommunicationException, asyncio.run, auth_provider.get_repos_async("other_token"))
 
 #    SERVER_TEST_MODE is True
 
@@ -301,8 +448,8 @@ class TestAuthHelpers(unittest.TestCase):
         self.assertEqual(identity, (TEST_UID, TEST_USERNAME, TEST_MAIL))
 
     @patch.dict(os.environ, {"SERVER_TEST_MODE": "1"})
-    def test_get_repos_server_test_mode(self):
+    def test_get_repos_async_server_test_mode(self):
         auth_provider = AuthProviderAPI(OAuthProvider.GITLAB)
-        repos = auth_provider.get_repos("mocked_token")
+        repos = asyncio.run(auth_provider.get_repos_async("mocked_token"))
         self.assertEqual(repos, TEST_REPOS)
 
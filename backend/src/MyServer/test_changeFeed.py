@@ -0,0 +1,125 @@
+import asyncio
+import threading
+import unittest
+
+from MyServer.changeFeed import ChangeFeed
+
+
+async def readEvents(stream, count: int) -> list[bytes]:
+    """Read the given number of messages from the stream, skipping keep-alive comments and the retry message."""
+    messages = []
+    while len(messages) < count:
+        message = await asyncio.wait_for(anext(stream), 5)
+        if not message.startswith((b":", b"retry:")):
+            messages.append(message)
+    return messages
+
+
+class TestChangeFeed(unittest.TestCase):
+    def test_publish_assigns_increasing_ids_per_repo(self):
+        feed = ChangeFeed(historySize=10, keepAlive=15)
+        first = feed.publish("/repos/a", "reqAdded", reqId="REQ001")
+        second = feed.publish("/repos/a", "reqEdited", reqId="REQ001", text="text")
+        other = feed.publish("/repos/b", "reqAdded", reqId="REQ001")
+        self.assertEqual(first.id.split("-")[1], "1")
+        self.assertEqual(second.id.split("-")[1], "2")
+        self.assertEqual(other.id.split("-")[1], "1")
+        self.assertEqual(second.encode(), f'id: {second.id}\nevent: reqEdited\ndata: {{"reqId": "REQ001", "text": "text"}}\n\n'.encode())
+
+    def test_missedEvents(self):
+        feed = ChangeFeed(historySize=2, keepAlive=15)
+        first = feed.publish("/repos/a", "reqAdded", reqId="REQ001")
+        second = feed.publish("/repos/a", "reqAdded", reqId="REQ002")
+        third = feed.publish("/repos/a", "reqAdded", reqId="REQ003")
+        self.assertEqual(feed.missedEvents("/repos/a", None), [])
+        self.assertEqual(feed.missedEvents("/repos/a", second.id), [third])
+        self.assertEqual(feed.missedEvents("/repos/a", third.id), [])
+        # dropped from history, restarted process and unknown ids
+        self.assertIsNone(feed.missedEvents("/repos/a", first.id.replace("-1", "-0")))
+        self.assertIsNone(feed.missedEvents("/repos/a", "other-1"))
+        self.assertIsNone(feed.missedEvents("/repos/a", first.id.replace("-1", "-9")))
+        self.assertEqual(feed.missedEvents("/repos/a", first.id), [second, third])
+
+    def test_stream_delivers_events_published_by_other_threads(self):
+        feed = ChangeFeed(historySize=10, keepAlive=15)
+        missed = feed.publish("/repos/a", "reqAdded", reqId="REQ001")
+        first = feed.publish("/repos/a", "reqAdded", reqId="REQ002")
+
+        async def follow():
+            stream = feed.stream("/repos/a", first.id.replace("-2", "-1"), lambda: "version")
+            self.assertEqual(await readEvents(stream, 1), [first.encode()])
+            thread = threading.Thread(target=feed.publish, args=("/repos/a", "reqDeleted"), kwargs={"reqId": "REQ001"})
+            thread.start()
+            [message] = await readEvents(stream, 1)
+            thread.join()
+            await stream.aclose()
+            return message
+
+        message = asyncio.run(follow())
+        self.assertIn(b"event: reqDeleted", message)
+        self.assertNotEqual(missed.encode(), message)
+        self.assertEqual(feed.subscriberCount("/repos/a"), 0)
+
+    def test_stream_resets_client_that_cannot_resume(self):
+        feed = ChangeFeed(historySize=10, keepAlive=15)
+
+        async def follow():
+            stream = feed.stream("/repos/a", "other-5", lambda: "version")
+            messages = await readEvents(stream, 1)
+            await stream.aclose()
+            return messages
+
+        self.assertEqual(asyncio.run(follow()), [b"event: reset\ndata: {}\n\n"])
+
+    def test_stream_resets_client_when_tree_is_changed_by_other_process(self):
+        feed = ChangeFeed(historySize=10, keepAlive=0.05)
+        versions = iter(["version1", "version1", "version2"])
+
+        async def follow():
+            stream = feed.stream("/repos/a", None, lambda: next(versions, "version2"))
+            messages = await readEvents(stream, 1)
+            await stream.aclose()
+            return messages
+
+        self.assertEqual(asyncio.run(follow()), [b"event: reset\ndata: {}\n\n"])
+
+    def test_stream_compares_version_with_version_of_last_event(self):
+        feed = ChangeFeed(historySize=10, keepAlive=0.05)
+        versions = iter(["version1", "version2", "version2", "version3"])
+
+        async def follow():
+            stream = feed.stream("/repos/a", None, lambda: next(versions, "version3"))
+            await anext(stream)
+            event = feed.publish("/repos/a", "reqAdded", "version2", reqId="REQ001")
+            # the local change is not reported as a reset, the later change of another process is
+            messages = await readEvents(stream, 2)
+            await stream.aclose()
+            return event, messages
+
+        event, messages = asyncio.run(follow())
+        self.assertEqual(messages, [event.encode(), b"event: reset\ndata: {}\n\n"])
+
+    def test_version_is_checked_once_per_interval_for_all_subscribers(self):
+        feed = ChangeFeed(historySize=10, keepAlive=0.05)
+        calls = []
+
+        def getVersion():
+            calls.append(1)
+            return "version"
+
+        async def follow():
+            stream = feed.stream("/repos/a", None, getVersion)
+            keepAlives = 0
+            async for message in stream:
+                keepAlives += message.startswith(b":")
+                if keepAlives == 3:
+                    break
+            await stream.aclose()
+
+        async def followAll():
+            await asyncio.gather(*(follow() for _ in range(5)))
+
+        asyncio.run(followAll())
+        # an initial check and at most one check per keep-alive
+        self.assertLessEqual(len(calls), 4)
+        self.assertEqual(feed.subscriberCount("/repos/a"), 0)
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import unittest
+
+from MyServer.error import JobNotFoundException, PushRejectedException
+from MyServer.gitJobs import JOB_MESSAGES, GitJobQueue, JobKind, JobStatus
+from MyServer.tokenStore import MemoryTokenStore
+
+
+class TestGitJobQueue(unittest.TestCase):
+    def test_job_statuses(self):
+        queue = GitJobQueue(maxWorkers=2, retention=60)
+        succeeded = queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: True)
+        failed = queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: False)
+        for job in (succeeded, failed):
+            self.assertTrue(job.done.wait(5))
+        self.assertEqual(succeeded.toDict()["status"], "succeeded")
+        self.assertEqual(succeeded.message, JOB_MESSAGES[JobKind.COMMIT][0])
+        self.assertEqual((failed.status, failed.message, failed.apiErrorCode),
+                         (JobStatus.FAILED, JOB_MESSAGES[JobKind.COMMIT][1], None))
+
+    def test_failed_job_keeps_api_error_code(self):
+        queue = GitJobQueue(maxWorkers=1, retention=60)
+
+        def run(job):
+            raise PushRejectedException("Push operation resulted in conflicts.")
+
+        job = queue.submit(JobKind.COMMIT, "repo", "owner", run)
+        self.assertTrue(job.done.wait(5))
+        self.assertEqual(job.toDict(), {"jobId": job.id, "kind": "commit", "status": "failed",
+                                        "message": "Push operation resulted in conflicts.", "api_error_code": "PUSH_REJECTED",
+                                        "progress": None, "readable": False})
+
+    def test_waitAsync(self):
+        queue = GitJobQueue(maxWorkers=1, retention=60)
+        release = threading.Event()
+        job = queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: release.wait(5))
+        self.assertFalse(asyncio.run(job.waitAsync(0.05)))
+
+        async def releaseAndWait():
+            asyncio.get_running_loop().call_later(0.05, release.set)
+            return await job.waitAsync(5)
+
+        self.assertTrue(asyncio.run(releaseAndWait()))
+        self.assertEqual(job.status, JobStatus.SUCCEEDED)
+
+    def test_progress_and_readable(self):
+        queue = GitJobQueue(maxWorkers=1, retention=60)
+
+        def run(job):
+            job.setProgress("receiving", 5, 10)
+            job.markReadable()
+            return True
+
+        job = queue.submit(JobKind.SYNC, "repo", "owner", run)
+        self.assertTrue(job.done.wait(5))
+        self.assertEqual(job.toDict()["progress"], {"stage": "receiving", "current": 5, "total": 10, "message": ""})
+        self.assertTrue(job.toDict()["readable"])
+        self.assertEqual(job.message, "OK")
+
+    def test_jobs_of_one_repo_run_in_order(self):
+        queue = GitJobQueue(maxWorkers=4, retention=60)
+        release = threading.Event()
+        order = []
+
+        def run(name):
+            def job(_):
+                if name == "first":
+                    release.wait(5)
+                order.append(name)
+                return True
+            return job
+
+        first = queue.submit(JobKind.COMMIT, "repo", "owner", run("first"))
+        second = queue.submit(JobKind.COMMIT, "repo", "owner", run("second"))
+        other = queue.submit(JobKind.COMMIT, "other_repo", "owner", run("other"))
+        self.assertTrue(other.done.wait(5))
+        self.assertEqual(second.status, JobStatus.QUEUED)
+        release.set()
+        self.assertTrue(second.done.wait(5))
+        self.assertEqual(order, ["other", "first", "second"])
+        self.assertEqual(first.status, JobStatus.SUCCEEDED)
+
+    def test_getJob(self):
+        queue = GitJobQueue(maxWorkers=1, retention=60)
+        job = queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: True)
+        self.assertIs(queue.getJob(job.id, "owner"), job)
+        self.assertRaises(JobNotFoundException, queue.getJob, job.id, "someone_else")
+        self.assertRaises(JobNotFoundException, queue.getJob, "unknown", "owner")
+
+    def test_job_of_other_process_is_read_from_store(self):
+        store = MemoryTokenStore()
+        queue, otherQueue = GitJobQueue(maxWorkers=1, retention=60, store=store), GitJobQueue(maxWorkers=1, retention=60, store=store)
+        release = threading.Event()
+
+        def run(job):
+            job.markReadable()
+            release.wait(5)
+            return True
+
+        job = queue.submit(JobKind.SYNC, "repo", "owner", run)
+        shared = otherQueue.getJob(job.id, "owner")
+        self.assertIsNot(shared, job)
+        self.assertEqual(shared.kind, JobKind.SYNC)
+        self.assertFalse(shared.done.is_set())
+        self.assertRaises(JobNotFoundException, otherQueue.getJob, job.id, "someone_else")
+
+        async def releaseAndWait():
+            asyncio.get_running_loop().call_later(0.05, release.set)
+            return await otherQueue.waitAsync(shared, 5)
+
+        finished = asyncio.run(releaseAndWait())
+        self.assertTrue(finished.done.is_set())
+        self.assertEqual(finished.toDict(), job.toDict())
+        self.assertTrue(finished.readable)
+
+    def test_finished_jobs_are_pruned(self):
+        queue = GitJobQueue(maxWorkers=1, retention=-1)
+        job = queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: True)
+        self.assertTrue(job.done.wait(5))
+        queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: True)
+        self.assertRaises(JobNotFoundException, queue.getJob, job.id, "owner")
+
+    def test_coalesced_jobs(self):
+        queue = GitJobQueue(maxWorkers=1, retention=60)
+        release = threading.Event()
+        running = queue.submit(JobKind.SYNC, "repo", "owner", lambda job: release.wait(5), coalesce=True)
+        self.assertIs(queue.submit(JobKind.SYNC, "repo", "owner", lambda job: True, coalesce=True), running)
+        self.assertIsNot(queue.submit(JobKind.SYNC, "other_repo", "owner", lambda job: True, coalesce=True), running)
+        commit = queue.submit(JobKind.COMMIT, "repo", "owner", lambda job: True, coalesce=True)
+        self.assertIsNot(commit, running)
+        release.set()
+        self.assertTrue(commit.done.wait(5))
+        self.assertIsNot(queue.submit(JobKind.SYNC, "repo", "owner", lambda job: True, coalesce=True), running)
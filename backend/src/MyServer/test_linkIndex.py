@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import doorstop
+
+from MyServer.linkIndex import LinkIndex, LinkIndexRegistry, indexPath
+from MyServer.restHandlersHelpers import addUserDocument, addUserLink, addUserRequirement, deleteUserLink, deleteUserRequirement
+from MyServer.treeCache import treeCache
+
+
+class TestLinkIndex(unittest.TestCase):
+    def test_links(self):
+        index = LinkIndex()
+        index.addLink("A002", "A001")
+        index.addLink("A003", "A001")
+        index.addLink("A003", "A002")
+        self.assertEqual(index.linkedBy("A001"), ["A002", "A003"])
+        index.removeLink("A003", "A001")
+        self.assertEqual(index.linkedBy("A001"), ["A002"])
+        self.assertEqual(index.toDict(), {"A002": ["A003"], "A003": []})
+
+    def test_removeItem(self):
+        index = LinkIndex()
+        index.addItem("A001")
+        index.addLink("A002", "A001")
+        index.addLink("A001", "A003")
+        index.removeItem("A001")
+        self.assertEqual(index.linkedBy("A001"), [])
+        self.assertEqual(index.linkedBy("A003"), [])
+        self.assertEqual(index.linksDict(), {"A002": []})
+
+    def test_fromDict(self):
+        index = LinkIndex.fromDict({"A001": [], "A002": ["A001"]})
+        self.assertEqual(index.linkedBy("A001"), ["A002"])
+        self.assertEqual(index.linksDict(), {"A001": [], "A002": ["A001"]})
+
+    def test_indexPath(self):
+        self.assertEqual(indexPath("/repos/github/1/repo/req"), "/repos/github/1/repo.linkindex.json")
+
+
+class TestLinkIndexRegistry(unittest.TestCase):
+    def setUp(self):
+        self.test_root = tempfile.mkdtemp()
+        self.test_folder = os.path.join(self.test_root, "repo", "req")
+        os.makedirs(os.path.join(self.test_folder, "documents"))
+        os.makedirs(os.path.join(self.test_folder, "config"))
+        with open(os.path.join(self.test_folder, "config", "settings.yml"), "w") as settings_file:
+            settings_file.write("root: documents")
+
+    def tearDown(self):
+        treeCache.clear()
+        shutil.rmtree(self.test_root)
+
+    @staticmethod
+    def mock_find_root(cwd):
+        return cwd
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_incremental_updates(self):
+        registry = LinkIndexRegistry(persist=False)
+        with patch("MyServer.restHandlersHelpers.linkIndexes", registry):
+            addUserDocument("doc", None, self.test_folder)
+            addUserRequirement("doc", 1, "text", self.test_folder)
+            index = registry.getIndex(self.test_folder)
+            addUserRequirement("doc", 2, "text", self.test_folder)
+            addUserRequirement("doc", 3, "text", self.test_folder)
+            addUserLink("doc002", "doc001", self.test_folder)
+            addUserLink("doc003", "doc001", self.test_folder)
+            self.assertIs(registry.getIndex(self.test_folder), index)
+            self.assertEqual(index.linkedBy("doc001"), ["doc002", "doc003"])
+            deleteUserLink("doc003", "doc001", self.test_folder)
+            self.assertEqual(index.linkedBy("doc001"), ["doc002"])
+            deleteUserRequirement("doc", "doc001", self.test_folder)
+            self.assertIs(registry.getIndex(self.test_folder), index)
+            self.assertEqual(index.toDict(), {"doc002": [], "doc003": []})
+            self.assertEqual(index.toDict(), LinkIndex.fromTree(doorstop.build(self.test_folder)).toDict())
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_persisted_index_is_loaded(self):
+        registry = LinkIndexRegistry(persist=True)
+        with patch("MyServer.restHandlersHelpers.linkIndexes", registry):
+            addUserDocument("doc", None, self.test_folder)
+            addUserRequirement("doc", 1, "text", self.test_folder)
+            addUserRequirement("doc", 2, "text", self.test_folder)
+            registry.getIndex(self.test_folder)
+            addUserLink("doc002", "doc001", self.test_folder)
+        self.assertTrue(os.path.exists(indexPath(self.test_folder)))
+        registry = LinkIndexRegistry(persist=True)
+        with patch("MyServer.linkIndex.LinkIndex.fromTree") as mock_from_tree:
+            index = registry.getIndex(self.test_folder)
+        mock_from_tree.assert_not_called()
+        self.assertEqual(index.linkedBy("doc001"), ["doc002"])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_stale_persisted_index_is_rebuilt(self):
+        registry = LinkIndexRegistry(persist=True)
+        addUserDocument("doc", None, self.test_folder)
+        addUserRequirement("doc", 1, "text", self.test_folder)
+        registry.getIndex(self.test_folder)
+        treeCache.clear()
+        with open(os.path.join(self.test_folder, "doc", "doc002.yml"), "w") as file:
+            file.write("links:\n- doc001: null\ntext: text\n")
+        index = LinkIndexRegistry(persist=True).getIndex(self.test_folder)
+        self.assertEqual(index.linkedBy("doc001"), ["doc002"])
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+from MyServer.offload import OffloadPool, SyncViewLimitMiddleware
+
+
+class TestOffloadPool(unittest.TestCase):
+    def test_calls_beyond_workers_are_queued(self):
+        pool = OffloadPool(workers=2)
+        release = threading.Event()
+        running = threading.Semaphore(0)
+
+        def block(number):
+            running.release()
+            release.wait(5)
+            return number
+
+        async def runAll():
+            calls = [asyncio.ensure_future(pool.run(block, number)) for number in range(4)]
+            await asyncio.to_thread(running.acquire)
+            await asyncio.to_thread(running.acquire)
+            stats = pool.stats()
+            release.set()
+            return stats, await asyncio.gather(*calls)
+
+        stats, results = asyncio.run(runAll())
+        self.assertEqual(results, [0, 1, 2, 3])
+        self.assertEqual((stats.running, stats.queued), (2, 2))
+        self.assertEqual(pool.stats().completed, 4)
+        self.assertGreaterEqual(pool.stats().maxQueued, 2)
+
+    def test_exceptions_are_raised_in_caller(self):
+        pool = OffloadPool(workers=1)
+
+        def fail():
+            raise ValueError("failed")
+
+        self.assertRaises(ValueError, asyncio.run, pool.run(fail))
+        self.assertEqual(pool.stats().completed, 1)
+
+    def test_iterate_produces_items_in_pool(self):
+        pool = OffloadPool(workers=1)
+        threads = []
+
+        def items():
+            for number in range(3):
+                threads.append(threading.current_thread())
+                yield number
+
+        async def collect():
+            return [item async for item in pool.iterate(items())]
+
+        self.assertEqual(asyncio.run(collect()), [0, 1, 2])
+        self.assertNotIn(threading.current_thread(), threads)
+
+
+class TestSyncViewLimitMiddleware(unittest.TestCase):
+    @patch("MyServer.offload.config", return_value=1)
+    @patch("MyServer.offload.isSyncView", return_value=True)
+    def test_sync_views_run_one_at_a_time(self, mock_is_sync_view, mock_config):
+        active, maxActive = 0, 0
+
+        async def getResponse(request):
+            nonlocal active, maxActive
+            active += 1
+            maxActive = max(maxActive, active)
+            await asyncio.sleep(0.01)
+            active -= 1
+            return request
+
+        middleware = SyncViewLimitMiddleware(getResponse)
+
+        async def requestAll():
+            return await asyncio.gather(*(middleware(number) for number in range(3)))
+
+        self.assertEqual(asyncio.run(requestAll()), [0, 1, 2])
+        self.assertEqual(maxActive, 1)
+        mock_is_sync_view.return_value = False
+        maxActive = 0
+        asyncio.run(requestAll())
+        self.assertEqual(maxActive, 3)
+
+    def test_wsgi_requests_are_passed_through(self):
+        getResponse = MagicMock(return_value="response")
+        self.assertEqual(SyncViewLimitMiddleware(getResponse)("request"), "response")
+        getResponse.assert_called_once_with("request")
@@ -0,0 +1,82 @@
+import asyncio
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from MyServer.providerSessions import AsyncProviderSessions, ProviderSessions
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.endswith("/cookie"):
+            body = self.headers.get("Cookie", "").encode()
+        else:
+            body = self.headers.get("Authorization", "").encode()
+        self.send_response(200)
+        self.send_header("Set-Cookie", "session=user1; Path=/")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestProviderSessions(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/user"
+
+    def test_connections_are_reused_and_token_is_sent_per_request(self):
+        sessions = ProviderSessions(poolSize=2, timeout=5)
+        self.addCleanup(sessions.close)
+        self.assertEqual(sessions.get("GITHUB", self.url, "token1").text, "Bearer token1")
+        self.assertEqual(sessions.get("GITHUB", self.url, "token2").text, "Bearer token2")
+        self.assertEqual(sessions.get("GITHUB", self.url, "token3").text, "Bearer token3")
+        stats = sessions.stats()
+        self.assertEqual(stats.requests, 3)
+        self.assertEqual(stats.connections, 1)
+        self.assertEqual(stats.reusedConnections, 2)
+
+    def test_sessions_are_kept_per_provider(self):
+        sessions = ProviderSessions(poolSize=2, timeout=5)
+        self.addCleanup(sessions.close)
+        sessions.get("GITHUB", self.url, "token")
+        sessions.get("GITLAB", self.url, "token")
+        self.assertEqual(sessions.stats().connections, 2)
+
+    def test_response_cookies_are_not_sent_with_next_request(self):
+        sessions = ProviderSessions(poolSize=2, timeout=5)
+        self.addCleanup(sessions.close)
+        sessions.get("GITHUB", self.url, "token1")
+        self.assertEqual(sessions.get("GITHUB", self.url + "/cookie", "token2").text, "")
+
+    def test_async_response_cookies_are_not_sent_with_next_request(self):
+        sessions = AsyncProviderSessions(poolSize=2, timeout=5)
+
+        async def getTwice():
+            try:
+                await sessions.get("GITHUB", self.url, "token1")
+                return (await sessions.get("GITHUB", self.url + "/cookie", "token2")).text
+            finally:
+                await sessions.aclose()
+
+        self.assertEqual(asyncio.run(getTwice()), "")
+
+    def test_async_requests_wait_for_free_connection(self):
+        sessions = AsyncProviderSessions(poolSize=2, timeout=5)
+
+        async def getAll():
+            try:
+                responses = await asyncio.gather(*(sessions.get("GITHUB", self.url, f"token{number}") for number in range(6)))
+            finally:
+                await sessions.aclose()
+            return [response.text for response in responses]
+
+        self.assertEqual(asyncio.run(getAll()), [f"Bearer token{number}" for number in range(6)])
+        self.assertEqual(sessions.requestCount, 6)
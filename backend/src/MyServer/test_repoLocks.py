@@ -0,0 +1,101 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from MyServer.repoLocks import RepoLocks, lockPath, reqFolderRepo
+
+
+class TestRepoLocks(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.repo = os.path.join(self.folder.name, "repo")
+        os.makedirs(os.path.join(self.repo, ".git"))
+        self.locks = RepoLocks(fileLocks=True)
+
+    def test_readers_share_lock(self):
+        inside = threading.Barrier(2, timeout=5)
+
+        def read():
+            with self.locks.read(self.repo):
+                inside.wait()
+
+        threads = [threading.Thread(target=read) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(inside.broken)
+        self.assertEqual(self.locks.stats()["read"].acquisitions, 2)
+
+    def test_writer_excludes_readers(self):
+        events = []
+        writing = threading.Event()
+
+        def read():
+            writing.wait()
+            with self.locks.read(self.repo):
+                events.append("read")
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        with self.locks.write(self.repo):
+            writing.set()
+            time.sleep(0.1)
+            events.append("written")
+        reader.join()
+        self.assertEqual(events, ["written", "read"])
+        self.assertGreater(self.locks.stats()["read"].maxWaitSeconds, 0.05)
+
+    def test_waiting_writer_is_preferred(self):
+        events = []
+        writerWaiting = threading.Event()
+
+        def write():
+            writerWaiting.set()
+            with self.locks.write(self.repo):
+                events.append("written")
+
+        def read():
+            with self.locks.read(self.repo):
+                events.append("read")
+
+        with self.locks.read(self.repo):
+            writer = threading.Thread(target=write)
+            writer.start()
+            writerWaiting.wait()
+            time.sleep(0.1)
+            reader = threading.Thread(target=read)
+            reader.start()
+            time.sleep(0.1)
+            self.assertEqual(events, [])
+        writer.join()
+        reader.join()
+        self.assertEqual(events, ["written", "read"])
+
+    def test_lock_is_reentrant(self):
+        with self.locks.write(self.repo):
+            with self.locks.read(self.repo):
+                with self.locks.write(self.repo):
+                    pass
+        with self.locks.read(self.repo):
+            with self.locks.read(self.repo):
+                self.assertRaises(RuntimeError, self.locks.write(self.repo).__enter__)
+        stats = self.locks.stats()
+        self.assertEqual(stats["write"].acquisitions, 2)
+        self.assertEqual(stats["read"].acquisitions, 3)
+        self.assertEqual(stats["write"].maxWaitSeconds, stats["write"].waitSeconds)
+
+    def test_lock_file_is_created_next_to_cloned_repo(self):
+        with self.locks.write(self.repo):
+            self.assertTrue(os.path.exists(lockPath(self.repo)))
+        missing = os.path.join(self.folder.name, "missing")
+        with self.locks.read(missing):
+            pass
+        self.assertFalse(os.path.exists(lockPath(missing)))
+
+    def test_keys_are_normalized(self):
+        self.assertIs(self.locks.getLock(self.repo), self.locks.getLock(self.repo + "/req/.."))
+        self.assertEqual(reqFolderRepo(self.repo + "/req"), self.repo)
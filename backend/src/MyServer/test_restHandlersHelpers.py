@@ -1,3 +1,4 @@
+import json
 import unittest
 from unittest.mock import patch
 import doorstop
@@ -5,22 +6,33 @@ import os
 import tempfile
 import shutil
 import MyServer.error as my_errors
+from MyServer.treeCache import treeCache
+from MyServer.treeSnapshot import snapshotTree
 
 import yaml
 from MyServer.restHandlersHelpers import (
     addUserDocument,
     addUserLink,
     addUserRequirement,
+    applyUserBatch,
     buildDicts,
     deleteUserDocument,
     deleteUserLink,
     deleteUserRequirement,
+    encodeCursor,
     editUserRequirement,
     getAllReqs,
     getDocReqs,
+    getLinkedBy,
+    getReqsVersion,
+    parseBatch,
+    parseReqQuery,
+    queryReqs,
+    ReqQuery,
     serializeAllReqs,
     serializeDocReqs,
     serializeDocuments,
+    streamAllReqs,
 )
 
 
@@ -126,11 +138,31 @@ class TestRestHandlersHelpers(unittest.TestCase):
         self.assertTrue(child_id not in os.listdir(self.test_folder))
         self.assertRaises(my_errors.EmptyDocumentTreeException, deleteUserDocument, "invalid_doc", self.test_folder)
 
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_delete_user_document_removes_links(self):
+        addUserDocument("root", None, self.test_folder)
+        addUserDocument("removed", "root", self.test_folder)
+        addUserDocument("kept", "root", self.test_folder)
+        addUserRequirement("root", 1, "text", self.test_folder)
+        addUserRequirement("removed", 1, "text", self.test_folder)
+        addUserRequirement("removed", 2, "text", self.test_folder)
+        addUserRequirement("kept", 1, "text", self.test_folder)
+        addUserLink("kept001", "removed001", self.test_folder)
+        addUserLink("kept001", "removed002", self.test_folder)
+        addUserLink("kept001", "root001", self.test_folder)
+        with patch("MyServer.restHandlersHelpers.doorstop.Item.save", autospec=True, side_effect=doorstop.Item.save) as mock_save:
+            deleteUserDocument("removed", self.test_folder)
+        self.assertEqual([str(call.args[0].uid) for call in mock_save.call_args_list], ["kept001"])
+        self.assertTrue("removed" not in os.listdir(self.test_folder))
+        reqs = getDocReqs("kept", self.test_folder)
+        self.assertEqual([str(link) for link in reqs[0].links], ["root001"])
+
     @patch("doorstop.core.vcs.find_root", new=mock_find_root)
     def test_delete_user_document_doorstop_error(self):
         doc_id = "test_doc"
         addUserDocument(doc_id, None, self.test_folder)
         addUserRequirement(doc_id, 1, "text", self.test_folder)
+        treeCache.clear()
         with patch("MyServer.restHandlersHelpers.doorstop.build", side_effect=doorstop.DoorstopError("Mocked DoorstopError")):
             self.assertRaises(my_errors.DoorstopException, deleteUserDocument, doc_id, self.test_folder)
 
@@ -162,9 +194,151 @@ class TestRestHandlersHelpers(unittest.TestCase):
         addUserRequirement(doc_id, 1, "text", self.test_folder)
         addUserRequirement(doc_id, 2, "text", self.test_folder)
         addUserLink("test_doc002", "test_doc001", self.test_folder)
+        treeCache.clear()
         with patch("MyServer.restHandlersHelpers.doorstop.build", side_effect=doorstop.DoorstopError("Mocked DoorstopError")):
             self.assertRaises(my_errors.DoorstopException, deleteUserRequirement, "test_doc", "test_doc001", self.test_folder)
 
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_removeUserRequirement_removes_links(self):
+        doc_id = "test_doc"
+        addUserDocument(doc_id, None, self.test_folder)
+        for number in range(1, 5):
+            addUserRequirement(doc_id, number, "text", self.test_folder)
+        addUserLink("test_doc002", "test_doc001", self.test_folder)
+        addUserLink("test_doc003", "test_doc001", self.test_folder)
+        addUserLink("test_doc003", "test_doc004", self.test_folder)
+        treeCache.clear()
+        with patch("MyServer.restHandlersHelpers.doorstop.Item.unlink", autospec=True, side_effect=doorstop.Item.unlink) as mock_unlink, \
+                patch("MyServer.treeCache.doorstop.build", side_effect=doorstop.build) as mock_build:
+            deleteUserRequirement(doc_id, "test_doc001", self.test_folder)
+        mock_build.assert_called_once()
+        self.assertEqual(sorted(str(call.args[0].uid) for call in mock_unlink.call_args_list), ["test_doc002", "test_doc003"])
+        reqs = {str(req.uid): [str(link) for link in req.links] for req in getDocReqs(doc_id, self.test_folder)}
+        self.assertEqual(reqs, {"test_doc002": [], "test_doc003": ["test_doc004"], "test_doc004": []})
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_applyUserBatch(self):
+        addUserDocument("test_doc", None, self.test_folder)
+        addUserRequirement("test_doc", 1, "text", self.test_folder)
+        addUserRequirement("test_doc", 2, "text", self.test_folder)
+        operations = [
+            {"op": "addDoc", "docId": "child_doc", "parentId": "test_doc"},
+            {"op": "addReq", "docId": "child_doc", "reqNumberId": 1, "reqText": "child"},
+            {"op": "link", "req1Id": "child_doc001", "req2Id": "test_doc001"},
+            {"op": "link", "req1Id": "child_doc001", "req2Id": "test_doc002"},
+            {"op": "editReq", "docId": "child_doc", "reqId": "child_doc001", "reqText": "edited"},
+            {"op": "unlink", "req1Id": "child_doc001", "req2Id": "test_doc002"},
+            {"op": "deleteReq", "docId": "test_doc", "reqId": "test_doc002"},
+        ]
+        with patch("MyServer.restHandlersHelpers.doorstop.Item.save", autospec=True, side_effect=doorstop.Item.save) as mock_save:
+            results, error = applyUserBatch(operations, self.test_folder)
+        self.assertIsNone(error)
+        self.assertEqual([result["status"] for result in results], ["ok"] * len(operations))
+        self.assertEqual(results[1]["reqId"], "child_doc001")
+        # the new requirement is written when it is created and once more after the last operation
+        self.assertEqual([str(call.args[0].uid) for call in mock_save.call_args_list], ["child_doc001", "child_doc001"])
+        with open(os.path.join(self.test_folder, "child_doc", "child_doc001.yml")) as file:
+            content = yaml.safe_load(file)
+        self.assertEqual(content["text"].strip(), "edited")
+        self.assertEqual([list(link.keys())[0] for link in content["links"]], ["test_doc001"])
+        self.assertFalse(os.path.exists(os.path.join(self.test_folder, "test_doc", "test_doc002.yml")))
+        self.assertEqual(getLinkedBy("test_doc001", self.test_folder), ["child_doc001"])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_mutations_publish_changes(self):
+        addUserDocument("test_doc", None, self.test_folder)
+        with patch("MyServer.restHandlersHelpers.changeFeed.publish") as mock_publish:
+            addUserRequirement("test_doc", 1, "text", self.test_folder)
+            addUserRequirement("test_doc", 2, "", self.test_folder)
+            addUserLink("test_doc002", "test_doc001", self.test_folder)
+            applyUserBatch([{"op": "editReq", "docId": "test_doc", "reqId": "test_doc002", "reqText": "edited"}], self.test_folder)
+            deleteUserRequirement("test_doc", "test_doc001", self.test_folder)
+        repoFolder = os.path.dirname(os.path.abspath(self.test_folder))
+        self.assertEqual([(call.args, call.kwargs) for call in mock_publish.call_args_list], [
+            ((repoFolder, "reqAdded", None), {"reqId": "test_doc001", "docId": "test_doc", "text": "text"}),
+            ((repoFolder, "reqAdded", None), {"reqId": "test_doc002", "docId": "test_doc", "text": ""}),
+            ((repoFolder, "linkAdded", None), {"reqId": "test_doc002", "linkedReqId": "test_doc001"}),
+            ((repoFolder, "reqEdited", None), {"reqId": "test_doc002", "docId": "test_doc", "text": "edited"}),
+            ((repoFolder, "reqDeleted", None), {"reqId": "test_doc001", "docId": "test_doc"}),
+        ])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_mutations_record_version_for_followed_feed(self):
+        addUserDocument("test_doc", None, self.test_folder)
+        with patch("MyServer.restHandlersHelpers.changeFeed.subscriberCount", return_value=1), \
+                patch("MyServer.restHandlersHelpers.changeFeed.publish") as mock_publish:
+            addUserRequirement("test_doc", 1, "text", self.test_folder)
+        self.assertEqual(mock_publish.call_args.args[2], getReqsVersion(self.test_folder))
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_applyUserBatch_stops_at_failed_operation(self):
+        addUserDocument("test_doc", None, self.test_folder)
+        operations = [
+            {"op": "addReq", "docId": "test_doc", "reqNumberId": 1, "reqText": "first"},
+            {"op": "editReq", "docId": "test_doc", "reqId": "test_doc005", "reqText": "missing"},
+            {"op": "addReq", "docId": "test_doc", "reqNumberId": 2, "reqText": "skipped"},
+        ]
+        results, error = applyUserBatch(operations, self.test_folder)
+        self.assertIsInstance(error, my_errors.ReqNotFoundException)
+        self.assertEqual([result["status"] for result in results], ["rolledBack", "failed", "skipped"])
+        self.assertEqual(results[1]["api_error_code"], "REQ_NOT_FOUND")
+        self.assertEqual(getDocReqs("test_doc", self.test_folder), [])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_applyUserBatch_rolls_back_failed_batch(self):
+        addUserDocument("test_doc", None, self.test_folder)
+        addUserRequirement("test_doc", 1, "text", self.test_folder)
+        addUserRequirement("test_doc", 2, "text", self.test_folder)
+        addUserLink("test_doc002", "test_doc001", self.test_folder)
+        files = {}
+        for folder, _, names in os.walk(self.test_folder):
+            for name in names:
+                with open(os.path.join(folder, name), "rb") as file:
+                    files[os.path.join(folder, name)] = file.read()
+        operations = [
+            {"op": "addDoc", "docId": "child_doc", "parentId": "test_doc"},
+            {"op": "addReq", "docId": "child_doc", "reqNumberId": 1, "reqText": "child"},
+            {"op": "addReq", "docId": "test_doc", "reqNumberId": 3, "reqText": "new"},
+            {"op": "editReq", "docId": "test_doc", "reqId": "test_doc002", "reqText": "edited"},
+            {"op": "deleteReq", "docId": "test_doc", "reqId": "test_doc001"},
+            {"op": "link", "req1Id": "test_doc002", "req2Id": "missing"},
+        ]
+        with patch("MyServer.restHandlersHelpers.changeFeed.publish") as mock_publish:
+            results, error = applyUserBatch(operations, self.test_folder)
+        self.assertIsInstance(error, my_errors.LinkCycleException)
+        self.assertEqual([result["status"] for result in results], ["rolledBack"] * 5 + ["failed"])
+        mock_publish.assert_not_called()
+        restored = {}
+        for folder, _, names in os.walk(self.test_folder):
+            for name in names:
+                with open(os.path.join(folder, name), "rb") as file:
+                    restored[os.path.join(folder, name)] = file.read()
+        self.assertEqual(restored, files)
+        self.assertEqual(getLinkedBy("test_doc001", self.test_folder), ["test_doc002"])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_getReqsVersion(self):
+        addUserDocument("test_doc", None, self.test_folder)
+        addUserRequirement("test_doc", 1, "text", self.test_folder)
+        treeCache.clear()
+        with patch("MyServer.treeCache.doorstop.build") as mock_build:
+            version = getReqsVersion(self.test_folder)
+            self.assertEqual(getReqsVersion(self.test_folder), version)
+        mock_build.assert_not_called()
+        editUserRequirement("test_doc", "test_doc001", "new text", self.test_folder)
+        self.assertNotEqual(getReqsVersion(self.test_folder), version)
+
+    def test_parseBatch(self):
+        operations = [{"op": "addReq", "docId": "test_doc"}]
+        self.assertEqual(parseBatch(operations), operations)
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, None)
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, [])
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, [{"op": "unknown"}])
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, ["addReq"])
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, operations + [{"op": "editReq", "docId": "test_doc", "reqText": "text"}])
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, [{"op": "addReq", "docId": "test_doc", "reqNumberId": "1"}])
+        self.assertRaises(my_errors.InvalidBatchException, parseBatch, [{"op": "link", "req1Id": "test_doc001", "req2Id": 2}])
+
     @patch("doorstop.core.vcs.find_root", new=mock_find_root)
     def test_editUserRequirement(self):
         doc_id = "test_doc"
@@ -196,6 +370,7 @@ class TestRestHandlersHelpers(unittest.TestCase):
         doc_id = "test_doc"
         addUserDocument(doc_id, None, self.test_folder)
         addUserRequirement(doc_id, 1, "text", self.test_folder)
+        treeCache.clear()
         with patch("MyServer.restHandlersHelpers.doorstop.build", side_effect=doorstop.DoorstopError("Mocked DoorstopError")):
             self.assertRaises(my_errors.DoorstopException, getDocReqs, doc_id, self.test_folder)
 
@@ -204,16 +379,31 @@ class TestRestHandlersHelpers(unittest.TestCase):
         doc_id = "test_doc"
         addUserDocument(doc_id, None, self.test_folder)
         addUserRequirement(doc_id, 1, "text", self.test_folder)
+        treeCache.clear()
         with patch("MyServer.restHandlersHelpers.doorstop.build", side_effect=FileNotFoundError("Mocked FileNotFoundError")):
             self.assertRaises(my_errors.DocNotFoundException, getDocReqs, doc_id, self.test_folder)
 
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_getLinkedBy(self):
+        doc_id = "test_doc"
+        addUserDocument(doc_id, None, self.test_folder)
+        addUserRequirement(doc_id, 1, "text", self.test_folder)
+        addUserRequirement(doc_id, 2, "text", self.test_folder)
+        addUserLink("test_doc002", "test_doc001", self.test_folder)
+        self.assertEqual(getLinkedBy("test_doc001", self.test_folder), ["test_doc002"])
+        self.assertEqual(getLinkedBy("", self.test_folder), {"test_doc001": ["test_doc002"], "test_doc002": []})
+
+    @patch("doorstop.core.vcs.find_root", side_effect=doorstop.DoorstopError)
+    def test_getLinkedBy_doorstop_error(self, mock_find_root):
+        self.assertRaises(my_errors.DoorstopException, getLinkedBy, "test_doc001", self.test_folder)
+
     @patch("doorstop.core.vcs.find_root", new=mock_find_root)
     def test_buildDicts(self):
         doc_id = "test_doc"
         addUserDocument(doc_id, None, self.test_folder)
         addUserDocument("test_child_1", doc_id, self.test_folder)
         tree = doorstop.build(self.test_folder)
-        result = buildDicts(tree)
+        result = buildDicts(snapshotTree(tree).root)
         expected_result = {"prefix": doc_id, "children": [{"prefix": "test_child_1", "children": []}]}
         self.assertEqual(result, expected_result)
 
@@ -302,4 +492,92 @@ class TestRestHandlersHelpers(unittest.TestCase):
         self.assertEqual(len(result), len(expected_result))
         self.assertTrue(result[0]["id"] in [req["id"] for req in expected_result])
         self.assertTrue(expected_result[0]["links"] in [req["links"] for req in result])
-        self.assertTrue(result[0]["text"] in [req["text"] for req in expected_result])
\ No newline at end of file
+        self.assertTrue(result[0]["text"] in [req["text"] for req in expected_result])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_getAllReqs_hierarchy_order_single_build(self):
+        addUserDocument("root", None, self.test_folder)
+        addUserDocument("child", "root", self.test_folder)
+        addUserRequirement("child", 1, "text", self.test_folder)
+        addUserRequirement("root", 1, "text", self.test_folder)
+        treeCache.clear()
+        with patch("MyServer.treeCache.doorstop.build", side_effect=doorstop.build) as mock_build:
+            result = getAllReqs(self.test_folder)
+        mock_build.assert_called_once()
+        self.assertEqual([(str(req.uid), prefix) for req, prefix in result], [("root001", "root"), ("child001", "child")])
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_streamAllReqs(self):
+        doc_id = "test_doc"
+        addUserDocument(doc_id, None, self.test_folder)
+        for number in range(1, 4):
+            addUserRequirement(doc_id, number, "text", self.test_folder)
+        addUserLink("test_doc001", "test_doc002", self.test_folder)
+        reqs = getAllReqs(self.test_folder)
+        chunks = list(streamAllReqs(reqs, chunkSize=1))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(b"".join(chunks), json.dumps(serializeAllReqs(reqs)).encode())
+        self.assertEqual(b"".join(streamAllReqs([])), b"[]")
+
+    def test_parseReqQuery(self):
+        query = parseReqQuery({"fields": "id,links", "prefix": "doc", "reviewed": "false", "hasLinks": "1", "cursor": "abc", "limit": "10"})
+        self.assertEqual(query, ReqQuery(["id", "links"], "doc", False, True, "abc", 10))
+        self.assertEqual(parseReqQuery({}), ReqQuery())
+        self.assertRaises(my_errors.InvalidQueryParameterException, parseReqQuery, {"fields": "id,unknown"})
+        self.assertRaises(my_errors.InvalidQueryParameterException, parseReqQuery, {"reviewed": "maybe"})
+        self.assertRaises(my_errors.InvalidQueryParameterException, parseReqQuery, {"limit": "0"})
+        self.assertRaises(my_errors.InvalidQueryParameterException, parseReqQuery, {"limit": "ten"})
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_queryReqs_filters_and_pages(self):
+        addUserDocument("root", None, self.test_folder)
+        addUserDocument("child", "root", self.test_folder)
+        for number in range(1, 4):
+            addUserRequirement("root", number, "text", self.test_folder)
+            addUserRequirement("child", number, "text", self.test_folder)
+        addUserLink("child001", "root001", self.test_folder)
+        addUserLink("child003", "root001", self.test_folder)
+        reqs = getAllReqs(self.test_folder)
+
+        linked, cursor = queryReqs(reqs, ReqQuery(hasLinks=True))
+        self.assertEqual([str(req.uid) for req, _ in linked], ["child001", "child003"])
+        self.assertIsNone(cursor)
+
+        pages = []
+        query = ReqQuery(prefix="root", limit=2)
+        while True:
+            page, query.cursor = queryReqs(reqs, query)
+            pages.append([str(req.uid) for req, _ in page])
+            if not query.cursor:
+                break
+        self.assertEqual(pages, [["root001", "root002"], ["root003"]])
+
+        docReqs = getDocReqs("child", self.test_folder)
+        page, cursor = queryReqs(docReqs, ReqQuery(hasLinks=False, limit=1))
+        self.assertEqual([str(req.uid) for req in page], ["child002"])
+        self.assertIsNone(cursor)
+        self.assertRaises(my_errors.InvalidQueryParameterException, queryReqs, reqs, ReqQuery(cursor="bm9uZQ=="))
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_queryReqs_cursor_survives_deletion(self):
+        addUserDocument("root", None, self.test_folder)
+        addUserDocument("child", "root", self.test_folder)
+        for number in range(1, 4):
+            addUserRequirement("root", number, "text", self.test_folder)
+        addUserRequirement("child", 1, "text", self.test_folder)
+        page, cursor = queryReqs(getAllReqs(self.test_folder), ReqQuery(limit=2))
+        self.assertEqual([str(req.uid) for req, _ in page], ["root001", "root002"])
+        deleteUserRequirement("root", "root002", self.test_folder)
+        page, cursor = queryReqs(getAllReqs(self.test_folder), ReqQuery(limit=2, cursor=cursor))
+        self.assertEqual([str(req.uid) for req, _ in page], ["root003", "child001"])
+        self.assertIsNone(cursor)
+        deleteUserDocument("child", self.test_folder)
+        self.assertRaises(my_errors.InvalidQueryParameterException, queryReqs, getAllReqs(self.test_folder),
+                          ReqQuery(cursor=encodeCursor(page[1][0])))
+
+    @patch("doorstop.core.vcs.find_root", new=mock_find_root)
+    def test_serialize_projection(self):
+        addUserDocument("doc", None, self.test_folder)
+        addUserRequirement("doc", 1, "text", self.test_folder)
+        self.assertEqual(serializeDocReqs(getDocReqs("doc", self.test_folder), ["id", "docPrefix"]), [{"id": "doc001", "docPrefix": "doc"}])
+        self.assertEqual(serializeAllReqs(getAllReqs(self.test_folder), ["links", "id"]), [{"links": [], "id": "doc001"}])
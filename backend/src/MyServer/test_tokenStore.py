@@ -0,0 +1,87 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+
+from MyServer.tokenStore import MemoryTokenStore, SQLiteTokenStore, TokenStoreStats, createTokenStore
+
+
+class TestTokenStore(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def check_store(self, store):
+        store.set("key", b"value", ex=10)
+        store.set("forever", b"value")
+        self.assertEqual(store.get("key"), b"value")
+        self.assertIsNone(store.get("missing"))
+        with patch("MyServer.tokenStore.time.time", return_value=time.time() + 11):
+            self.assertIsNone(store.get("key"))
+            self.assertEqual(store.get("forever"), b"value")
+        store.delete("forever", "missing")
+        self.assertIsNone(store.get("forever"))
+
+    def test_memory_store(self):
+        self.check_store(MemoryTokenStore())
+
+    def test_sqlite_store(self):
+        self.check_store(SQLiteTokenStore(os.path.join(self.folder.name, "tokens.sqlite3")))
+
+    def test_sqlite_store_purges_expired(self):
+        store = SQLiteTokenStore(os.path.join(self.folder.name, "tokens.sqlite3"))
+        store.set("expired", b"value", ex=-1)
+        for i in range(SQLiteTokenStore.PURGE_INTERVAL):
+            store.set(f"key{i}", b"value", ex=10)
+        count = store._connection().execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+        self.assertEqual(count, SQLiteTokenStore.PURGE_INTERVAL)
+
+    def test_createTokenStore(self):
+        self.assertIsInstance(createTokenStore("memory://"), MemoryTokenStore)
+        self.assertIsInstance(createTokenStore("sqlite:///" + os.path.join(self.folder.name, "a", "tokens.sqlite3")), SQLiteTokenStore)
+        self.assertRaises(ImproperlyConfigured, createTokenStore, "unknown://")
+
+    def test_createTokenStore_sqlite_paths(self):
+        absolute = os.path.join(self.folder.name, "tokens.sqlite3")
+        self.assertEqual(createTokenStore("sqlite:///" + absolute)._path, absolute)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.folder.name)
+        self.assertEqual(createTokenStore("sqlite:///data/tokens.sqlite3")._path, "data/tokens.sqlite3")
+        self.assertTrue(os.path.exists(os.path.join(self.folder.name, "data", "tokens.sqlite3")))
+        self.assertRaises(ImproperlyConfigured, createTokenStore, "sqlite://tokens.sqlite3")
+        self.assertRaises(ImproperlyConfigured, createTokenStore, "sqlite:///")
+
+    def test_memory_store_removes_expired_entries_in_expiry_order(self):
+        store = MemoryTokenStore()
+        store.set("late", b"value", ex=20)
+        store.set("early", b"value", ex=10)
+        store.set("forever", b"value")
+        with patch("MyServer.tokenStore.time.time", return_value=time.time() + 11):
+            store.set("new", b"value", ex=10)
+            self.assertEqual(store.stats(), TokenStoreStats(entries=3, bytes=29, expirations=1, evictions=0))
+        with patch("MyServer.tokenStore.time.time", return_value=time.time() + 20.5):
+            self.assertIsNone(store.get("late"))
+            self.assertEqual(store.stats().entries, 2)
+            self.assertEqual(store.stats().expirations, 2)
+
+    def test_memory_store_evicts_least_recently_used(self):
+        store = MemoryTokenStore(maxEntries=2)
+        store.set("a", b"1", ex=10)
+        store.set("b", b"2", ex=10)
+        store.get("a")
+        store.set("c", b"3", ex=10)
+        self.assertIsNone(store.get("b"))
+        self.assertEqual(store.get("a"), b"1")
+        self.assertEqual(store.get("c"), b"3")
+        self.assertEqual(store.stats(), TokenStoreStats(entries=2, bytes=4, expirations=0, evictions=1))
+
+    def test_memory_store_replaced_entry_keeps_new_expiry(self):
+        store = MemoryTokenStore()
+        store.set("key", b"old", ex=10)
+        store.set("key", b"new", ex=30)
+        with patch("MyServer.tokenStore.time.time", return_value=time.time() + 11):
+            self.assertEqual(store.get("key"), b"new")
+        self.assertEqual(store.stats().bytes, 6)
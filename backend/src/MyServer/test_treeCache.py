@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import MagicMock, patch
+
+import doorstop
+
+from MyServer.treeCache import SnapshotCache, TreeCache, folderStamp
+from MyServer.treeIndex import TreeIndexStore
+from MyServer.treeSnapshot import TreeSnapshot, buildSnapshot
+
+
+class TestTreeCache(unittest.TestCase):
+    def setUp(self):
+        self.test_folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.test_folder, "doc"))
+        with open(os.path.join(self.test_folder, "doc", "item.yml"), "w") as file:
+            file.write("text: a")
+
+    def tearDown(self):
+        shutil.rmtree(self.test_folder)
+
+    def test_folderStamp_changes(self):
+        stamp, size = folderStamp(self.test_folder)
+        self.assertEqual(size, 7)
+        self.assertEqual(folderStamp(self.test_folder), (stamp, size))
+        with open(os.path.join(self.test_folder, "doc", "item.yml"), "w") as file:
+            file.write("text: ab")
+        self.assertNotEqual(folderStamp(self.test_folder)[0], stamp)
+
+    def test_folderStamp_missing_folder(self):
+        self.assertEqual(folderStamp(os.path.join(self.test_folder, "missing"))[1], 0)
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_getTree_hit_and_miss(self, mock_build):
+        cache = TreeCache(1024)
+        tree = cache.getTree(self.test_folder)
+        self.assertIs(cache.getTree(self.test_folder), tree)
+        mock_build.assert_called_once_with(self.test_folder)
+        stats = cache.stats()
+        self.assertEqual((stats.hits, stats.misses, stats.entries, stats.bytes), (1, 1, 1, 7))
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_getTree_loads_items_before_caching(self, mock_build):
+        document = MagicMock()
+        mock_build.return_value = [document]
+        TreeCache(1024).getTree(self.test_folder)
+        document.__iter__.assert_called_once()
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_getTree_rebuilds_on_change(self, mock_build):
+        cache = TreeCache(1024)
+        cache.getTree(self.test_folder)
+        with open(os.path.join(self.test_folder, "doc", "other.yml"), "w") as file:
+            file.write("text: b")
+        cache.getTree(self.test_folder)
+        self.assertEqual(mock_build.call_count, 2)
+        self.assertEqual(cache.stats().bytes, 14)
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_editTree_keeps_entry(self, mock_build):
+        cache = TreeCache(1024)
+        with cache.editTree(self.test_folder) as tree:
+            with open(os.path.join(self.test_folder, "doc", "item.yml"), "w") as file:
+                file.write("text: changed")
+        self.assertIs(cache.getTree(self.test_folder), tree)
+        mock_build.assert_called_once()
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_editTree_drops_entry_on_error(self, mock_build):
+        cache = TreeCache(1024)
+        with self.assertRaises(doorstop.DoorstopError):
+            with cache.editTree(self.test_folder):
+                raise doorstop.DoorstopError("error")
+        self.assertEqual(cache.stats().entries, 0)
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_peekTree(self, mock_build):
+        cache = TreeCache(1024)
+        stamp = folderStamp(self.test_folder)[0]
+        self.assertIsNone(cache.peekTree(self.test_folder, stamp))
+        with cache.editTree(self.test_folder) as tree:
+            with open(os.path.join(self.test_folder, "doc", "item.yml"), "w") as file:
+                file.write("text: changed")
+        self.assertIsNone(cache.peekTree(self.test_folder, stamp))
+        self.assertIs(cache.peekTree(self.test_folder, folderStamp(self.test_folder)[0]), tree)
+
+    @patch("MyServer.treeCache.doorstop.build", side_effect=doorstop.DoorstopError("error"))
+    def test_getTree_error_not_cached(self, mock_build):
+        cache = TreeCache(1024)
+        self.assertRaises(doorstop.DoorstopError, cache.getTree, self.test_folder)
+        self.assertEqual(cache.stats().entries, 0)
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_lru_eviction_by_size(self, mock_build):
+        other_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_folder)
+        with open(os.path.join(other_folder, "item.yml"), "w") as file:
+            file.write("text: a")
+        cache = TreeCache(10)
+        cache.getTree(self.test_folder)
+        cache.getTree(other_folder)
+        stats = cache.stats()
+        self.assertEqual((stats.entries, stats.evictions, stats.bytes), (1, 1, 7))
+        cache.getTree(other_folder)
+        self.assertEqual(cache.stats().hits, 1)
+
+    @patch("MyServer.treeCache.doorstop.build")
+    def test_invalidate(self, mock_build):
+        cache = TreeCache(1024)
+        cache.getTree(self.test_folder)
+        cache.invalidate(self.test_folder)
+        cache.getTree(self.test_folder)
+        self.assertEqual(mock_build.call_count, 2)
+
+
+class TestSnapshotCache(unittest.TestCase):
+    def setUp(self):
+        self.test_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_folder)
+        with open(os.path.join(self.test_folder, "item.yml"), "w") as file:
+            file.write("text: a")
+        self.pool = MagicMock(enabled=True)
+        self.pool.run.return_value = TreeSnapshot()
+        self.trees = MagicMock()
+        self.trees.peekTree.return_value = None
+        self.index = TreeIndexStore(persist=False)
+
+    @patch("MyServer.treeCache.snapshotTree", return_value=TreeSnapshot())
+    def test_small_folder_is_built_in_process(self, mock_snapshot_tree):
+        cache = SnapshotCache(1024, 8, self.pool, self.trees, self.index)
+        self.assertIs(cache.getSnapshot(self.test_folder), mock_snapshot_tree.return_value)
+        self.assertIs(cache.getSnapshot(self.test_folder), mock_snapshot_tree.return_value)
+        mock_snapshot_tree.assert_called_once_with(self.trees.getTree.return_value)
+        self.pool.run.assert_not_called()
+
+    @patch("MyServer.treeCache.snapshotTree", return_value=TreeSnapshot())
+    def test_cached_tree_is_used_for_large_folder(self, mock_snapshot_tree):
+        self.trees.peekTree.return_value = tree = MagicMock()
+        cache = SnapshotCache(1024, 0, self.pool, self.trees, self.index)
+        self.assertIs(cache.getSnapshot(self.test_folder), mock_snapshot_tree.return_value)
+        mock_snapshot_tree.assert_called_once_with(tree)
+        self.pool.run.assert_not_called()
+
+    def test_large_folder_is_built_in_pool(self):
+        cache = SnapshotCache(1024, 7, self.pool, self.trees, self.index)
+        self.assertIs(cache.getSnapshot(self.test_folder), self.pool.run.return_value)
+        self.pool.run.assert_called_once_with(buildSnapshot, os.path.abspath(self.test_folder))
+        self.trees.getTree.assert_not_called()
+
+    @patch("MyServer.treeCache.snapshotTree", return_value=TreeSnapshot())
+    def test_disabled_pool_is_not_used(self, mock_snapshot_tree):
+        self.pool.enabled = False
+        SnapshotCache(1024, 0, self.pool, self.trees, self.index).getSnapshot(self.test_folder)
+        self.pool.run.assert_not_called()
+        mock_snapshot_tree.assert_called_once()
+
+    def test_concurrent_requests_wait_for_one_build(self):
+        building = threading.Event()
+        release = threading.Event()
+
+        def build(*args):
+            building.set()
+            release.wait(5)
+            return TreeSnapshot()
+
+        self.pool.run.side_effect = build
+        cache = SnapshotCache(1024, 0, self.pool, self.trees, self.index)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.getSnapshot(self.test_folder))) for _ in range(3)]
+        threads[0].start()
+        building.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.pool.run.assert_called_once()
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(result is results[0] for result in results))
+
+    def test_build_error_is_raised_and_not_cached(self):
+        self.pool.run.side_effect = doorstop.DoorstopError("error")
+        cache = SnapshotCache(1024, 0, self.pool, self.trees, self.index)
+        self.assertRaises(doorstop.DoorstopError, cache.getSnapshot, self.test_folder)
+        self.assertEqual(cache.stats().entries, 0)
+
+    def test_snapshot_is_loaded_from_index(self):
+        self.index = MagicMock()
+        cache = SnapshotCache(1024, 0, self.pool, self.trees, self.index)
+        self.assertIs(cache.getSnapshot(self.test_folder), self.index.load.return_value)
+        self.index.load.assert_called_once_with(self.test_folder, folderStamp(self.test_folder)[0])
+        self.pool.run.assert_not_called()
+        self.index.save.assert_not_called()
+
+    def test_snapshot_missing_from_index_is_built_and_saved(self):
+        self.index = MagicMock()
+        self.index.load.return_value = None
+        cache = SnapshotCache(1024, 0, self.pool, self.trees, self.index)
+        self.assertIs(cache.getSnapshot(self.test_folder), self.pool.run.return_value)
+        self.index.save.assert_called_once_with(self.test_folder, folderStamp(self.test_folder)[0], self.pool.run.return_value)
@@ -0,0 +1,97 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import doorstop
+import git
+
+from MyServer.treeIndex import TreeIndexStore, dumpSnapshot, indexKey, indexPath, loadSnapshot, reqTreeHash
+from MyServer.treeSnapshot import TreeSnapshot, snapshotTree
+
+
+class TestTreeIndex(unittest.TestCase):
+    def setUp(self):
+        self.test_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_folder)
+        self.repo = git.Repo.init(os.path.join(self.test_folder, "repo"))
+        self.user_folder = os.path.join(self.test_folder, "repo", "req")
+        os.makedirs(self.user_folder)
+        tree = doorstop.build(self.user_folder)
+        tree.create_document(os.path.join(self.user_folder, "reqs"), "REQ")
+        tree.create_document(os.path.join(self.user_folder, "reqs", "llr"), "LLR", parent="REQ")
+        tree.add_item("REQ").text = "first ąę"
+        item = tree.add_item("LLR")
+        item.text = "second"
+        item.link("REQ001")
+        item.link("OTHER001")
+        self.repo.git.add("--all")
+        self.repo.index.commit("reqs")
+
+    def test_reqTreeHash(self):
+        self.assertEqual(reqTreeHash(self.user_folder), self.repo.git.rev_parse("HEAD:req"))
+        status = self.repo.git.status("--porcelain")
+        with open(os.path.join(self.user_folder, "reqs", "REQ001.yml"), "a") as file:
+            file.write("\n")
+        changed = reqTreeHash(self.user_folder)
+        self.assertNotEqual(changed, self.repo.git.rev_parse("HEAD:req"))
+        self.assertNotEqual(self.repo.git.status("--porcelain"), status)
+        self.repo.git.checkout("--", "req")
+        self.assertEqual(reqTreeHash(self.user_folder), self.repo.git.rev_parse("HEAD:req"))
+
+    def test_reqTreeHash_writes_no_objects(self):
+        objects = self.repo.git.count_objects()
+        with open(os.path.join(self.user_folder, "reqs", "REQ001.yml"), "a") as file:
+            file.write("\n")
+        self.assertIsNotNone(reqTreeHash(self.user_folder))
+        self.assertEqual(self.repo.git.count_objects(), objects)
+        self.assertIsNone(reqTreeHash(os.path.join(self.test_folder, "missing")))
+
+    def test_dumpSnapshot_loadSnapshot(self):
+        snapshot = snapshotTree(doorstop.build(self.user_folder))
+        data = dumpSnapshot(snapshot, "stamp", "hash")
+        self.assertEqual(indexKey(data)["stamp"], "stamp")
+        self.assertEqual(indexKey(data)["treeHash"], "hash")
+        self.assertEqual(data.index(b"\n", data.index(b"\n") + 1) % 8, 7)
+        loaded = loadSnapshot(data)
+        self.assertEqual(loaded, snapshot)
+        self.assertEqual([child.prefix for child in loaded.root.children], ["LLR"])
+        self.assertEqual(loaded.findDocument("LLR").items, snapshot.findDocument("LLR").items)
+        self.assertIsNone(loadSnapshot(data[:-1]))
+        self.assertIsNone(loadSnapshot(b"garbage"))
+        self.assertIsNone(indexKey(b"garbage"))
+        self.assertIsNone(indexKey(data.replace(b'"version": 3', b'"version": 0', 1)))
+        self.assertEqual(loadSnapshot(dumpSnapshot(TreeSnapshot(), "stamp")), TreeSnapshot())
+
+    def test_store(self):
+        snapshot = snapshotTree(doorstop.build(self.user_folder))
+        store = TreeIndexStore(persist=True)
+        self.assertIsNone(store.load(self.user_folder, "stamp1"))
+        store.save(self.user_folder, "stamp1", snapshot)
+        loaded = store.load(self.user_folder, "stamp1")
+        self.assertEqual(loaded, snapshot)
+        self.assertIsInstance(loaded.textOffsets, memoryview)
+        with open(indexPath(self.user_folder), "rb") as file:
+            self.assertEqual(indexKey(file.read())["treeHash"], self.repo.git.rev_parse("HEAD:req"))
+        # other stamps are hashed only on the first load of the folder in the process
+        with patch("MyServer.treeIndex.reqTreeHash") as mock_hash:
+            self.assertIsNone(store.load(self.user_folder, "stamp2"))
+        mock_hash.assert_not_called()
+
+    def test_store_matches_tree_hash_on_cold_start(self):
+        snapshot = snapshotTree(doorstop.build(self.user_folder))
+        store = TreeIndexStore(persist=True)
+        store.load(self.user_folder, "stamp1")
+        store.save(self.user_folder, "stamp1", snapshot)
+        self.assertEqual(TreeIndexStore(persist=True).load(self.user_folder, "stamp2"), snapshot)
+        self.assertEqual(TreeIndexStore(persist=True).load(self.user_folder, "stamp2"), snapshot)
+        with open(os.path.join(self.user_folder, "reqs", "REQ001.yml"), "a") as file:
+            file.write("\n")
+        self.assertIsNone(TreeIndexStore(persist=True).load(self.user_folder, "stamp3"))
+
+    def test_store_not_persisted(self):
+        store = TreeIndexStore(persist=False)
+        store.save(self.user_folder, "stamp", snapshotTree(doorstop.build(self.user_folder)))
+        self.assertFalse(os.path.exists(indexPath(self.user_folder)))
+        self.assertIsNone(store.load(self.user_folder, "stamp"))
@@ -0,0 +1,74 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+import doorstop
+import git
+
+from MyServer.offload import ProcessOffloadPool
+from MyServer.treeSnapshot import TreeSnapshot, buildSnapshot, snapshotTree
+
+
+class TestTreeSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.test_folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_folder)
+        git.Repo.init(self.test_folder)
+        tree = doorstop.build(self.test_folder)
+        tree.create_document(os.path.join(self.test_folder, "reqs"), "REQ")
+        tree.create_document(os.path.join(self.test_folder, "reqs", "llr"), "LLR", parent="REQ")
+        tree.create_document(os.path.join(self.test_folder, "reqs", "tst"), "TST", parent="REQ")
+        tree.add_item("REQ").text = "first"
+        tree.add_item("TST").text = "test"
+        item = tree.add_item("LLR")
+        item.text = "second"
+        item.link("REQ001")
+
+    def test_snapshotTree(self):
+        tree = doorstop.build(self.test_folder)
+        snapshot = snapshotTree(tree)
+        children = [str(child.document.prefix) for child in tree.children]
+        self.assertEqual([document.prefix for document in snapshot.documents], ["REQ"] + children)
+        self.assertEqual([child.prefix for child in snapshot.root.children], children)
+        [item] = snapshot.findDocument("llr").items
+        self.assertEqual((item.uid, item.prefix, item.text, item.reviewed, item.links), ("LLR001", "LLR", "second", False, ["REQ001"]))
+        self.assertEqual([(item.uid, prefix) for item, prefix in snapshot.items()], [("REQ001", "REQ")] + [(prefix + "001", prefix) for prefix in children])
+        self.assertRaises(doorstop.DoorstopError, snapshot.findDocument, "missing")
+        self.assertEqual(pickle.loads(pickle.dumps(snapshot)), snapshot)
+
+    def test_snapshotTree_external_links(self):
+        tree = doorstop.build(self.test_folder)
+        tree.find_item("TST001").link("OTHER001")
+        tree.find_item("TST001").link("REQ001")
+        tree.find_item("REQ001").link("OTHER001")
+        snapshot = snapshotTree(tree)
+        self.assertEqual(snapshot.externalUIDs, ["OTHER001"])
+        self.assertEqual(snapshot.findDocument("TST").items[0].links, ["OTHER001", "REQ001"])
+        self.assertEqual(snapshot.findDocument("REQ").items[0].links, ["OTHER001"])
+        self.assertEqual(list(snapshot.linkTargets).count(len(snapshot.uids)), 2)
+
+    def test_column(self):
+        snapshot = snapshotTree(doorstop.build(self.test_folder))
+        for indexes in ([0, 1, 2], [2, 0], [1]):
+            views = [snapshot.views(range(len(snapshot.uids)))[index] for index in indexes]
+            for field in ("uid", "prefix", "text", "reviewed", "links"):
+                self.assertEqual(list(snapshot.column(field, indexes)), [getattr(view, field) for view in views])
+        self.assertEqual(list(snapshot.column("links", [])), [])
+        self.assertRaises(KeyError, snapshot.column, "missing", [0])
+
+    def test_snapshotTree_no_documents(self):
+        shutil.rmtree(os.path.join(self.test_folder, "reqs"))
+        snapshot = snapshotTree(doorstop.build(self.test_folder))
+        self.assertEqual(snapshot, TreeSnapshot())
+        self.assertEqual(snapshot.items(), [])
+
+    def test_buildSnapshot_in_worker_process(self):
+        pool = ProcessOffloadPool(workers=1)
+        self.addCleanup(pool.shutdown)
+        self.assertEqual(pool.run(buildSnapshot, self.test_folder), snapshotTree(doorstop.build(self.test_folder)))
+        stats = pool.stats()
+        self.assertEqual((stats.submitted, stats.completed, stats.running, stats.queued), (1, 1, 0, 0))
+        self.assertGreater(stats.taskSeconds, 0)
+        self.assertRaises(FileNotFoundError, pool.run, buildSnapshot, os.path.join(self.test_folder, "missing"))
@@ -11,21 +11,85 @@ def mock_requires_jwt_login(func):
     return wrapper
 
 
+def mock_requires_jwt_login_async(func):
+    @wraps(func)
+    async def wrapper(self, request, *args, **kwargs):
+        request.auth = AuthInfo("test_token", OAuthProvider.GITLAB, "test_id")
+        return await func(self, request, *args, **kwargs)
+
+    return wrapper
+
+
 patch("MyServer.authHelpers.requires_jwt_login", mock_requires_jwt_login).start()
+patch("MyServer.authHelpers.requires_jwt_login_async", mock_requires_jwt_login_async).start()
 import json
-from django.http import JsonResponse
+import threading
+from django.http import JsonResponse, StreamingHttpResponse
 from django.test import SimpleTestCase
 from django.urls import reverse
 from rest_framework import status
 import rest_framework
+import MyServer.authHelpers
 import MyServer.views as views
-from rest_framework.test import APIRequestFactory
+from MyServer.changeFeed import changeFeed
+from MyServer.error import MergeRejectedException, OAuthProviderCommunicationException, ReqNotFoundException, TokenNotPresentException
+from MyServer.gitJobs import JobStatus, gitJobs
 from django.http import HttpResponseRedirect
 from MyServer.authHelpers import AuthProviderAPI, OAuthProvider, AuthInfo
 from oauthlib.oauth2 import AccessDeniedError
 
 
 class TestViews(SimpleTestCase):
+    def setUp(self):
+        MyServer.authHelpers.identityCache.invalidate("test_token")
+
+    def wait_for_job(self, job_id):
+        job = gitJobs.getJob(job_id, "GITLAB:test_id")
+        self.assertTrue(job.done.wait(5))
+        return job
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity_async", return_value=("test_id", "test_username", "test_email"))
+    @patch("MyServer.repoHelpers.stageChanges", side_effect=MergeRejectedException())
+    def test_GitJobView_GET(self, mock_stage, mock_get_identity, mock_repo_info):
+        response = self.client.post(reverse("commitInRepo"), data={"commitText": "Test commit"}, content_type="application/json")
+        job_id = response.json()["jobId"]
+        self.assertTrue(gitJobs.getJob(job_id, "GITLAB:test_id").done.wait(5))
+        response = self.client.get(reverse("gitJobView", kwargs={"jobId": job_id}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"jobId": job_id, "kind": "commit", "status": "failed",
+                                           "message": "Merge was rejected.", "api_error_code": "MERGE_REJECTED",
+                                           "progress": None, "readable": False})
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.repoHelpers.serverRepos.getUrl", return_value="repo_url")
+    @patch("MyServer.repoHelpers.syncRepo")
+    def test_GetUserReposList_POST(self, mock_sync, mock_get_url, mock_repo_info):
+        release = threading.Event()
+        mock_sync.side_effect = lambda *args: release.wait(5)
+        response = self.client.post(reverse("gitReposView"), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_id = response.json()["jobId"]
+        self.assertEqual(response.json()["kind"], "sync")
+        release.set()
+        response = self.client.get(reverse("gitJobView", kwargs={"jobId": job_id}) + "?wait=5")
+        self.assertEqual(response.json()["status"], "succeeded")
+        self.assertEqual(response.json()["message"], "OK")
+        mock_sync.assert_called_once_with("repo_folder", "repo_url", "test_token", OAuthProvider.GITLAB, ANY)
+
+    def test_GitJobView_GET_invalidWait(self):
+        with patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name")), \
+                patch("MyServer.repoHelpers.stageChanges", return_value=True), \
+                patch("MyServer.authHelpers.AuthProviderAPI.get_identity_async", return_value=("test_id", "test_username", "test_email")):
+            job_id = self.client.post(reverse("commitInRepo"), data={"commitText": "Test commit"}, content_type="application/json").json()["jobId"]
+        response = self.client.get(reverse("gitJobView", kwargs={"jobId": job_id}) + "?wait=soon")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_GitJobView_GET_notFound(self):
+        response = self.client.get(reverse("gitJobView", kwargs={"jobId": "unknown"}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json()["api_error_code"], "JOB_NOT_FOUND")
+
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
     @patch("MyServer.restHandlersHelpers.deleteUserRequirement")
@@ -44,7 +108,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response_delete.data["message"], "OK")
         mock_delete_user_requirement.assert_called_once_with(data["docId"], data["reqId"], "repo_folder/req")
         mock_repo_info.assert_called_once()
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
 
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -59,7 +123,7 @@ class TestViews(SimpleTestCase):
 
         self.assertEqual(response_delete.status_code, status.HTTP_404_NOT_FOUND)
         mock_get_repo_info.assert_called_once()
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
@@ -78,7 +142,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response_delete.status_code, status.HTTP_200_OK)
         self.assertEqual(response_delete.data["message"], "OK")
         mock_edit_user_requirement.assert_called_once_with(data["docId"], data["reqId"], data["reqText"], "repo_folder/req")
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -98,7 +162,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response_delete.status_code, status.HTTP_200_OK)
         self.assertEqual(response_delete.data["message"], "OK")
         mock_add_user_requirement.assert_called_once_with(data["docId"], data["reqNumberId"], data["reqText"], "repo_folder/req")
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -113,20 +177,89 @@ class TestViews(SimpleTestCase):
         response = self.client.get(url)
 
         mock_get_user_requirement.assert_called_once_with("your_doc_id", "repo_folder/req")
-        mock_serialize_doc_reqs.assert_called_once_with(["req1", "req2"])
+        mock_serialize_doc_reqs.assert_called_once_with(["req1", "req2"], None)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b'[{"id": "1", "text": "Req 1", "reviewed": true, "links": ["link1", "link2"]}]')
         self.assertEqual(type(response), JsonResponse)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.getReqsVersion", return_value="version1")
+    @patch("MyServer.restHandlersHelpers.serializeDocReqs", return_value=[{"id": "1"}])
+    @patch("MyServer.restHandlersHelpers.getDocReqs", return_value=["req1"])
+    def test_ReqView_GET_not_modified(self, mock_get_doc_reqs, mock_serialize_doc_reqs, mock_version, mock_repo_info):
+        url = reverse("req") + "?docId=your_doc_id"
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertEqual(response["Cache-Control"], "private, no-cache")
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+        mock_get_doc_reqs.assert_called_once()
+        mock_version.assert_called_with("repo_folder/req")
+
+        self.assertNotEqual(self.client.get(reverse("req") + "?docId=your_doc_id&fields=id")["ETag"], etag)
+        mock_version.return_value = "version2"
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.getReqsVersion", return_value="version1")
+    @patch("MyServer.restHandlersHelpers.serializeDocuments", return_value=["doc1"])
+    def test_DocView_GET_not_modified(self, mock_serialize_documents, mock_version, mock_repo_info):
+        etag = self.client.get(reverse("doc"))["ETag"]
+        response = self.client.get(reverse("doc"), HTTP_IF_NONE_MATCH=f'"other", W/{etag}')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        mock_serialize_documents.assert_called_once()
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.getReqsVersion", return_value="version1")
+    @patch("MyServer.restHandlersHelpers.getAllReqs", return_value=[])
+    async def test_allReqsView_GET_not_modified(self, mock_get_reqs, mock_version, mock_repo_info):
+        etag = (await self.async_client.get(reverse("allReqsView")))["ETag"]
+        response = await self.async_client.get(reverse("allReqsView"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        mock_get_reqs.assert_called_once()
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
+    @patch("MyServer.restHandlersHelpers.serializeDocReqs")
+    @patch("MyServer.restHandlersHelpers.queryReqs")
+    @patch("MyServer.restHandlersHelpers.getDocReqs")
+    def test_ReqView_GET_paginated(self, mock_get_user_requirement, mock_query_reqs, mock_serialize_doc_reqs, mock_get_repos_from_file, mock_repo_info):
+        mock_get_user_requirement.return_value = ["req1", "req2", "req3"]
+        mock_query_reqs.return_value = (["req1"], "next_cursor")
+        mock_serialize_doc_reqs.return_value = [{"id": "1"}]
+        url = reverse("req") + "?docId=your_doc_id&limit=1&fields=id&hasLinks=true"
+        response = self.client.get(url)
+
+        query = mock_query_reqs.call_args[0][1]
+        self.assertEqual((query.limit, query.fields, query.hasLinks), (1, ["id"], True))
+        mock_serialize_doc_reqs.assert_called_once_with(["req1"], ["id"])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'[{"id": "1"}]')
+        self.assertEqual(response["X-Next-Cursor"], "next_cursor")
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
+    @patch("MyServer.restHandlersHelpers.getDocReqs")
+    def test_ReqView_GET_invalidQuery(self, mock_get_user_requirement, mock_get_repos_from_file, mock_repo_info):
+        url = reverse("req") + "?docId=your_doc_id&limit=-1"
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        mock_get_user_requirement.assert_not_called()
+
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     def test_ReqView_GET_ServerProblem(self, mock_get_repos_from_file):
         url = reverse("req")
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
 
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     def test_ReqView_GET_noDocId(self, mock_get_repos_from_file):
@@ -134,7 +267,7 @@ class TestViews(SimpleTestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
@@ -149,7 +282,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b"[]")
         self.assertEqual(type(response), JsonResponse)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -164,7 +297,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b'["doc1", "doc2"]')
         self.assertEqual(type(response), JsonResponse)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -182,7 +315,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b'{"message":"OK"}')
         self.assertEqual(type(response), rest_framework.response.Response)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -199,7 +332,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b'{"message":"OK"}')
         self.assertEqual(type(response), rest_framework.response.Response)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -216,7 +349,7 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b'{"message":"OK"}')
         self.assertEqual(type(response), rest_framework.response.Response)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
@@ -233,7 +366,68 @@ class TestViews(SimpleTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b'{"message":"OK"}')
         self.assertEqual(type(response), rest_framework.response.Response)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
+        mock_repo_info.assert_called_once()
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.getReqsVersion", return_value="version")
+    @patch("MyServer.authHelpers.authenticateRequestAsync", return_value=AuthInfo("test_token", OAuthProvider.GITLAB, "test_id"))
+    async def test_changeEvents_GET(self, mock_authenticate, mock_version, mock_repo_info):
+        seen = changeFeed.publish("repo_folder", "reqAdded", reqId="REQ001", docId="REQ", text="")
+        missed = changeFeed.publish("repo_folder", "linkAdded", reqId="REQ002", linkedReqId="REQ001")
+        response = await self.async_client.get(reverse("changeEvents"), headers={"Last-Event-ID": seen.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b"retry:"))
+        self.assertEqual(await anext(stream), missed.encode())
+        await stream.aclose()
+
+    @patch("MyServer.authHelpers.authenticateRequestAsync", side_effect=TokenNotPresentException())
+    async def test_changeEvents_GET_unauthorized(self, mock_authenticate):
+        response = await self.async_client.get(reverse("changeEvents"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(json.loads(response.content)["api_error_code"], "TOKEN_NOT_PRESENT")
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.applyUserBatch", return_value=([{"op": "addReq", "status": "ok", "reqId": "REQ001"}], None))
+    def test_BatchView_POST(self, mock_batch, mock_repo_info):
+        url = reverse("batchView")
+        data = {"operations": [{"op": "addReq", "docId": "REQ"}]}
+        response = self.client.post(url, data=json.dumps(data), content_type="application/json")
+        mock_batch.assert_called_once_with(data["operations"], "repo_folder/req")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {"message": "OK", "results": [{"op": "addReq", "status": "ok", "reqId": "REQ001"}]})
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.applyUserBatch")
+    def test_BatchView_POST_failed_operation(self, mock_batch, mock_repo_info):
+        results = [{"op": "editReq", "status": "failed", "message": "Not found.", "api_error_code": "REQ_NOT_FOUND"}]
+        mock_batch.return_value = (results, ReqNotFoundException("Not found."))
+        url = reverse("batchView")
+        operations = [{"op": "editReq", "docId": "REQ", "reqId": "REQ001", "reqText": "text"}]
+        response = self.client.post(url, data=json.dumps({"operations": operations}), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.json(), {"message": "Not found.", "api_error_code": "REQ_NOT_FOUND", "results": results})
+
+    @patch("MyServer.restHandlersHelpers.applyUserBatch")
+    def test_BatchView_POST_invalid_operation(self, mock_batch):
+        url = reverse("batchView")
+        response = self.client.post(url, data=json.dumps({"operations": [{"op": "rename"}]}), content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()["api_error_code"], "INVALID_BATCH")
+        mock_batch.assert_not_called()
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
+    @patch("MyServer.restHandlersHelpers.getLinkedBy", return_value=["req2", "req3"])
+    def test_LinkedByView_GET(self, mock_linked_by, mock_get_repos_from_file, mock_repo_info):
+        url = reverse("linkedByView") + "?reqId=req1"
+        response = self.client.get(url)
+        mock_linked_by.assert_called_once_with("req1", "repo_folder/req")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content, b'["req2", "req3"]')
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
 
     @patch("MyServer.authHelpers.generate_frontend_redirect_url")
@@ -268,86 +462,130 @@ class TestViews(SimpleTestCase):
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.restHandlersHelpers.getAllReqs")
-    @patch("MyServer.restHandlersHelpers.serializeAllReqs")
-    def test_allReqsView_GET(self, mock_serial, mock_get_reqs, mock_get_repos_from_file, mock_repo_info):
+    @patch("MyServer.restHandlersHelpers.streamAllReqs")
+    async def test_allReqsView_GET(self, mock_stream, mock_get_reqs, mock_get_repos_from_file, mock_repo_info):
         mock_get_reqs.return_value = ["req1", "req2"]
         url = reverse("allReqsView")
-        mock_serial.return_value = [{"id": "1", "text": "Req 1", "reviewed": True, "links": ["link1", "link2"]}]
-        response = self.client.get(url, content_type="application/json")
+        mock_stream.return_value = iter([b'[{"id": "1", "text": "Req 1", ', b'"reviewed": true, "links": ["link1", "link2"]}]'])
+        response = await self.async_client.get(url, content_type="application/json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.content, b'[{"id": "1", "text": "Req 1", "reviewed": true, "links": ["link1", "link2"]}]')
-        self.assertEqual(type(response), JsonResponse)
-        mock_get_repos_from_file.assert_called_once()
+        self.assertEqual(b"".join([chunk async for chunk in response.streaming_content]), b'[{"id": "1", "text": "Req 1", "reviewed": true, "links": ["link1", "link2"]}]')
+        self.assertEqual(type(response), StreamingHttpResponse)
+        self.assertEqual(response["Content-Type"], "application/json")
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
         mock_get_reqs.assert_called_once_with("repo_folder/req")
-        mock_serial.assert_called_once_with(["req1", "req2"])
+        mock_stream.assert_called_once_with(["req1", "req2"], None)
+
+    @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
+    @patch("MyServer.restHandlersHelpers.getReqsVersion", return_value="version")
+    @patch("MyServer.restHandlersHelpers.getAllReqs", return_value=["req1", "req2"])
+    @patch("MyServer.restHandlersHelpers.streamAllReqs")
+    async def test_allReqsView_GET_streams_chunks_under_asgi(self, mock_stream, mock_get_reqs, mock_version, mock_repo_info):
+        firstSent = threading.Event()
+
+        def stream(reqs, fields):
+            yield b'[{"id": "1"}'
+            # the rest is produced only once the first chunk was received
+            if firstSent.wait(5):
+                yield b', {"id": "2"}]'
+
+        mock_stream.side_effect = stream
+        response = await self.async_client.get(reverse("allReqsView"))
+        self.assertTrue(response.is_async)
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'[{"id": "1"}')
+        firstSent.set()
+        self.assertEqual(await anext(chunks), b', {"id": "2"}]')
+        self.assertEqual([chunk async for chunk in chunks], [])
 
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.restHandlersHelpers.getAllReqs")
-    def test_allReqsView_GET_noReqs(self, mock_get_reqs, mock_get_repos_from_file, mock_repo_info):
+    async def test_allReqsView_GET_noReqs(self, mock_get_reqs, mock_get_repos_from_file, mock_repo_info):
         mock_get_reqs.return_value = []
         url = reverse("allReqsView")
-        response = self.client.get(url, content_type="application/json")
+        response = await self.async_client.get(url, content_type="application/json")
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.content, b"[]")
         self.assertEqual(type(response), JsonResponse)
-        mock_get_repos_from_file.assert_called_once()
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
         mock_get_reqs.assert_called_once_with("repo_folder/req")
 
+    @patch("MyServer.repoHelpers.serverRepos.getRepos", return_value={"user/repo1": "https://github.com/user/repo1.git", "user/other": "https://github.com/user/other.git"})
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_repos_async", return_value=["user/repo1", "user/repo2"])
+    def test_GetUserReposList_GET(self, mock_get_repos, mock_server_repos):
+        response = self.client.get(reverse("gitReposView"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), ["user/repo1"])
+        mock_get_repos.assert_awaited_once_with("test_token")
+
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_repos_async", side_effect=OAuthProviderCommunicationException())
+    def test_GetUserReposList_GET_providerProblem(self, mock_get_repos):
+        response = self.client.get(reverse("gitReposView"))
+        self.assertEqual(response.status_code, OAuthProviderCommunicationException.status_code)
+        self.assertEqual(response.json()["api_error_code"], "OAUTH_COMMUNICATION_ERROR")
+
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity_async", return_value=("test_id", "test_username", "test_email"))
+    def test_IdentityView_GET(self, mock_get_identity):
+        response = self.client.get(reverse("identityView"))
+        self.assertEqual(response.json(), {"uid": "test_id", "login": "test_username", "email": "test_email", "provider": "gitlab"})
+        self.client.get(reverse("identityView"))
+        mock_get_identity.assert_awaited_once_with("test_token")
+
+    def test_GitCommitView_POST_invalidBody(self):
+        response = self.client.post(reverse("commitInRepo"), data="{", content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
-    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity")
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity_async")
     @patch("MyServer.repoHelpers.stageChanges", return_value=True)
-    def test_GitCommitView_POST(self, mock_stage, mock_get_identity, mock_get_repos_from_file, mock_repo_info):
+    def test_GitCommitView_POST(self, mock_stage, mock_get_identity, mock_repo_info, mock_get_repos_from_file):
         url = reverse("commitInRepo")
         data = {"commitText": "Test commit"}
-        factory = APIRequestFactory()
-        request = factory.post(url, data=data)
         mock_get_identity.return_value = ("test_id", "test_username", "test_email")
-        view = views.GitCommitView.as_view()
-        response = view(request)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        mock_get_repos_from_file.assert_called_once()
+        response = self.client.post(url, data=data, content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = self.wait_for_job(response.json()["jobId"])
+        self.assertEqual(job.status, JobStatus.SUCCEEDED)
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
-        mock_get_identity.assert_called_once_with(request.auth.token)
+        mock_get_identity.assert_called_once_with("test_token")
         mock_stage.assert_called_once_with("repo_folder", data["commitText"], "test_username", "test_email")
 
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
-    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity")
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity_async")
     @patch("MyServer.repoHelpers.stageChanges", return_value=True)
-    @patch("MyServer.authHelpers.AuthProviderAPI.getUserMail")
-    def test_GitCommitView_POST_noMail(self, mock_mail, mock_stage, mock_get_identity, mock_get_repos_from_file, mock_repo_info):
+    @patch("MyServer.authHelpers.AuthProviderAPI.getUserMailAsync")
+    def test_GitCommitView_POST_noMail(self, mock_mail, mock_stage, mock_get_identity, mock_repo_info, mock_get_repos_from_file):
         url = reverse("commitInRepo")
         data = {"commitText": "Test commit"}
-        factory = APIRequestFactory()
-        request = factory.post(url, data=data)
         mock_get_identity.return_value = ("test_id", "test_username", None)
         mock_mail.return_value = "test_email"
-        view = views.GitCommitView.as_view()
-        response = view(request)
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
-        mock_get_repos_from_file.assert_called_once()
+        response = self.client.post(url, data=data, content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.wait_for_job(response.json()["jobId"])
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
-        mock_get_identity.assert_called_once_with(request.auth.token)
+        mock_get_identity.assert_called_once_with("test_token")
         mock_stage.assert_called_once_with("repo_folder", data["commitText"], "test_username", "test_email")
 
     @patch("MyServer.repoHelpers.getReposFromFile", return_value={"repo_name": "repo_url"})
     @patch("MyServer.repoHelpers.getRepoInfo", return_value=("repo_folder", "repo_name"))
-    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity")
+    @patch("MyServer.authHelpers.AuthProviderAPI.get_identity_async")
     @patch("MyServer.repoHelpers.stageChanges", return_value=False)
-    def test_GitCommitView_POST_cantStage(self, mock_stage, mock_get_identity, mock_get_repos_from_file, mock_repo_info):
+    def test_GitCommitView_POST_cantStage(self, mock_stage, mock_get_identity, mock_repo_info, mock_get_repos_from_file):
         url = reverse("commitInRepo")
         data = {"commitText": "Test commit"}
-        factory = APIRequestFactory()
-        request = factory.post(url, data=data)
         mock_get_identity.return_value = ("test_id", "test_username", "test_email")
-        view = views.GitCommitView.as_view()
-        response = view(request)
-        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
-        mock_get_repos_from_file.assert_called_once()
+        response = self.client.post(url, data=data, content_type="application/json")
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = self.wait_for_job(response.json()["jobId"])
+        self.assertEqual(job.status, JobStatus.FAILED)
+        mock_get_repos_from_file.assert_not_called()
         mock_repo_info.assert_called_once()
-        mock_get_identity.assert_called_once_with(request.auth.token)
+        mock_get_identity.assert_called_once_with("test_token")
         mock_stage.assert_called_once_with("repo_folder", data["commitText"], "test_username", "test_email")
@@ -0,0 +1,183 @@
+"""This module provides key-value stores with expiry used to keep users' OAuth tokens.
+
+All stores implement the subset of the Redis client interface used by the server (get, set with ex, delete),
+so a Redis client can be used directly and the local stores can stand in for it.
+Stores other than the in-memory one are shared between server processes.
+"""
+
+import heapq
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from django.core.exceptions import ImproperlyConfigured
+
+
+class TokenStore(ABC):
+    @abstractmethod
+    def get(self, name: str) -> bytes | None:
+        """Get value of the key or None if it does not exist or has expired."""
+
+    @abstractmethod
+    def set(self, name: str, value: bytes, ex: int | None = None):
+        """Set value of the key, expiring after ex seconds if given."""
+
+    @abstractmethod
+    def delete(self, *names: str):
+        """Delete the keys."""
+
+
+@dataclass
+class TokenStoreStats:
+    entries: int
+    bytes: int
+    expirations: int
+    evictions: int
+
+
+class _MemoryEntry:
+    __slots__ = ("value", "expiresAt")
+
+    def __init__(self, value: bytes, expiresAt: float | None):
+        self.value = value
+        self.expiresAt = expiresAt
+
+
+class MemoryTokenStore(TokenStore):
+    """Store kept in the memory of a single process.\n
+    Expired entries are removed in order of their expiry time on every access, and when the store holds more than
+    maxEntries entries the least recently used ones are evicted."""
+
+    def __init__(self, maxEntries: int | None = None):
+        self._maxEntries = maxEntries
+        self._entries: OrderedDict[str, _MemoryEntry] = OrderedDict()
+        # (expiresAt, name) of every entry with expiry; entries replaced or deleted since are skipped when popped
+        self._expiryHeap: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._expirations = 0
+        self._evictions = 0
+
+    def get(self, name: str) -> bytes | None:
+        with self._lock:
+            self._purgeExpired(time.time())
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            self._entries.move_to_end(name)
+            return entry.value
+
+    def set(self, name: str, value: bytes, ex: int | None = None):
+        with self._lock:
+            now = time.time()
+            self._purgeExpired(now)
+            self._remove(name)
+            expiresAt = now + ex if ex is not None else None
+            self._entries[name] = _MemoryEntry(value, expiresAt)
+            self._bytes += len(name) + len(value)
+            if expiresAt is not None:
+                heapq.heappush(self._expiryHeap, (expiresAt, name))
+            self._evict()
+
+    def delete(self, *names: str):
+        with self._lock:
+            for name in names:
+                self._remove(name)
+
+    def stats(self) -> TokenStoreStats:
+        with self._lock:
+            return TokenStoreStats(len(self._entries), self._bytes, self._expirations, self._evictions)
+
+    def _remove(self, name: str):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self._bytes -= len(name) + len(entry.value)
+        if not self._entries:
+            self._expiryHeap.clear()
+
+    def _purgeExpired(self, now: float):
+        while self._expiryHeap and self._expiryHeap[0][0] <= now:
+            expiresAt, name = heapq.heappop(self._expiryHeap)
+            entry = self._entries.get(name)
+            if entry is not None and entry.expiresAt == expiresAt:
+                self._remove(name)
+                self._expirations += 1
+        if len(self._expiryHeap) > 2 * len(self._entries) + 64:
+            # drop heap items left behind by replaced and deleted entries
+            self._expiryHeap = [(entry.expiresAt, name) for name, entry in self._entries.items() if entry.expiresAt is not None]
+            heapq.heapify(self._expiryHeap)
+
+    def _evict(self):
+        while self._maxEntries is not None and len(self._entries) > self._maxEntries:
+            name = next(iter(self._entries))
+            self._remove(name)
+            self._evictions += 1
+
+
+class SQLiteTokenStore(TokenStore):
+    """Store kept in a SQLite database file, shared by all processes using the same file."""
+
+    PURGE_INTERVAL = 100
+
+    def __init__(self, path: str):
+        self._path = path
+        self._local = threading.local()
+        self._setCount = 0
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS tokens (name TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self._path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, name: str) -> bytes | None:
+        row = self._connection().execute(
+            "SELECT value FROM tokens WHERE name = ? AND (expires_at IS NULL OR expires_at > ?)", (name, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+    def set(self, name: str, value: bytes, ex: int | None = None):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO tokens (name, value, expires_at) VALUES (?, ?, ?)",
+                (name, value, time.time() + ex if ex is not None else None),
+            )
+            self._setCount += 1
+            if self._setCount % self.PURGE_INTERVAL == 0:
+                connection.execute("DELETE FROM tokens WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, *names: str):
+        with self._connection() as connection:
+            connection.executemany("DELETE FROM tokens WHERE name = ?", [(name,) for name in names])
+
+
+def createTokenStore(url: str, maxEntries: int | None = None) -> TokenStore:
+    """Create store from its url: memory://, sqlite:///relative/path.db, sqlite:////absolute/path.db (like in SQLAlchemy)
+    or redis://host:port/db (requires the redis package). maxEntries bounds the size of the in-memory store."""
+    if url == "memory://":
+        return MemoryTokenStore(maxEntries)
+    if url.startswith("sqlite://"):
+        path = url[len("sqlite://"):]
+        if not path.startswith("/") or path == "/":
+            raise ImproperlyConfigured(f"Invalid SQLite token store url: {url}, use sqlite:///<relative path> or sqlite:////<absolute path>.")
+        return SQLiteTokenStore(path[1:])
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured("The redis package is required to use a Redis token store.")
+        return redis.Redis.from_url(url)
+    raise ImproperlyConfigured(f"Unknown token store: {url}")
@@ -0,0 +1,243 @@
+"""This module provides process-wide caches of Doorstop trees and of their snapshots, keyed by user repo folder."""
+
+import hashlib
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+import doorstop
+from decouple import config
+
+from MyServer.offload import ProcessOffloadPool, treeBuildPool
+from MyServer.treeIndex import TreeIndexStore, treeIndexes
+from MyServer.treeSnapshot import TreeSnapshot, buildSnapshot, snapshotTree
+
+
+EXCLUDED_DIRNAMES = {".git", ".tox", ".venv", "venv"}
+
+
+def folderStamp(userFolder: str) -> tuple[str, int]:
+    """Compute a cheap stamp of a folder from the mtimes and sizes of its directories and files.
+    The stamp is stable between processes.\n
+    Returns: tuple[stamp, total size of files in bytes]"""
+    entries = []
+    totalSize = 0
+    pending = [userFolder]
+    while pending:
+        path = pending.pop()
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        info = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append((entry.path, info.st_mtime_ns, info.st_size))
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name not in EXCLUDED_DIRNAMES:
+                            pending.append(entry.path)
+                    else:
+                        totalSize += info.st_size
+        except OSError:
+            continue
+    entries.sort()
+    digest = hashlib.blake2b(digest_size=16)
+    for path, mtime, size in entries:
+        digest.update(f"{path}\0{mtime}\0{size}\n".encode())
+    return digest.hexdigest(), totalSize
+
+
+@dataclass
+class TreeCacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    bytes: int
+
+
+@dataclass
+class _CacheEntry:
+    value: Any
+    stamp: str
+    size: int
+
+
+class StampedCache(ABC):
+    """LRU cache of values built from repo folders (trees, snapshots), bounded by the total size of the cached folders.\n
+    An entry is served only while the stamp of its folder is unchanged, otherwise the value is rebuilt."""
+
+    def __init__(self, maxBytes: int):
+        self._maxBytes = maxBytes
+        self._entries: OrderedDict[str, _CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, userFolder: str) -> Any:
+        """Return the value of the given folder, building it only when the folder has changed since the last build."""
+        key = os.path.abspath(userFolder)
+        stamp, size = folderStamp(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.stamp == stamp:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return entry.value
+            self._misses += 1
+        value = self._build(userFolder, stamp, size)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _CacheEntry(value, stamp, size)
+            self._bytes += size
+            self._evict()
+        return value
+
+    def invalidate(self, userFolder: str):
+        """Drop the cached value of the given folder."""
+        with self._lock:
+            self._remove(os.path.abspath(userFolder))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> TreeCacheStats:
+        with self._lock:
+            return TreeCacheStats(self._hits, self._misses, self._evictions, len(self._entries), self._bytes)
+
+    @abstractmethod
+    def _build(self, userFolder: str, stamp: str, size: int) -> Any:
+        """Build the value of the folder with the given stamp and size of files."""
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        while self._bytes > self._maxBytes and len(self._entries) > 1:
+            _, entry = self._entries.popitem(last=False)
+            self._bytes -= entry.size
+            self._evictions += 1
+
+
+class TreeCache(StampedCache):
+    """Cache of built Doorstop trees, used by the modifications of the trees."""
+
+    def getTree(self, userFolder: str) -> doorstop.Tree:
+        """Return the tree of the given folder, building it only when the folder has changed since the last build."""
+        return self.get(userFolder)
+
+    @contextmanager
+    def editTree(self, userFolder: str):
+        """Yield the tree of the given folder for modification.\n
+        Doorstop updates the tree in memory while saving the files, so after a successful modification the entry is
+        restamped and kept. If the modification fails, the entry is dropped."""
+        tree = self.getTree(userFolder)
+        try:
+            yield tree
+        except BaseException:
+            self.invalidate(userFolder)
+            raise
+        self.touch(userFolder, tree)
+
+    def touch(self, userFolder: str, tree: doorstop.Tree):
+        """Restamp the entry of the given folder after the cached tree was modified."""
+        key = os.path.abspath(userFolder)
+        stamp, size = folderStamp(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.value is not tree:
+                return
+            self._bytes += size - entry.size
+            entry.stamp, entry.size = stamp, size
+
+    def getStamp(self, userFolder: str, tree: doorstop.Tree) -> str | None:
+        """Return the folder stamp the given cached tree corresponds to, or None if the tree is no longer cached."""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(userFolder))
+            if entry is None or entry.value is not tree:
+                return None
+            return entry.stamp
+
+    def peekTree(self, userFolder: str, stamp: str) -> doorstop.Tree | None:
+        """Return the cached tree of the given folder if it corresponds to the given stamp, without building it."""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(userFolder))
+            if entry is None or entry.stamp != stamp:
+                return None
+            return entry.value
+
+    def _build(self, userFolder: str, stamp: str, size: int) -> doorstop.Tree:
+        tree = doorstop.build(userFolder)
+        # documents load their items on first iteration, which is not thread-safe, so they are loaded before the tree is shared
+        for document in tree:
+            list(document)
+        return tree
+
+
+class SnapshotCache(StampedCache):
+    """Cache of snapshots of trees (see treeSnapshot), used by the read requests.\n
+    If the tree cache holds the tree of the folder (e.g. it was just edited in place), the snapshot is taken from it. Otherwise
+    snapshots of folders of at least processThreshold bytes are built in the process pool, so a large build does not hold the GIL
+    of the server process. Smaller ones take the in-process fast path through the tree cache. Concurrent requests for the same
+    missing snapshot wait for a single build. Snapshots are also loaded from and saved to the on-disk index (see treeIndex),
+    so after a restart a repo is built only if its requirements have changed."""
+
+    def __init__(self, maxBytes: int, processThreshold: int, pool: ProcessOffloadPool, trees: TreeCache, index: TreeIndexStore):
+        super().__init__(maxBytes)
+        self._processThreshold = processThreshold
+        self._pool = pool
+        self._trees = trees
+        self._index = index
+        self._building: dict[tuple[str, str], Future] = {}
+
+    def getSnapshot(self, userFolder: str) -> TreeSnapshot:
+        """Return the snapshot of the tree of the given folder, building it only when the folder has changed since the last build."""
+        return self.get(userFolder)
+
+    def _build(self, userFolder: str, stamp: str, size: int) -> TreeSnapshot:
+        key = (os.path.abspath(userFolder), stamp)
+        with self._lock:
+            future = self._building.get(key)
+            building = future is None
+            if building:
+                future = self._building[key] = Future()
+        if not building:
+            return future.result()
+        try:
+            tree = self._trees.peekTree(userFolder, stamp)
+            if tree is not None:
+                snapshot = snapshotTree(tree)
+                future.set_result(snapshot)
+                return snapshot
+            snapshot = self._index.load(userFolder, stamp)
+            if snapshot is None:
+                if self._pool.enabled and size >= self._processThreshold:
+                    snapshot = self._pool.run(buildSnapshot, key[0])
+                else:
+                    snapshot = snapshotTree(self._trees.getTree(userFolder))
+                self._index.save(userFolder, stamp, snapshot)
+            future.set_result(snapshot)
+            return snapshot
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._building[key]
+
+
+treeCache = TreeCache(config("TREE_CACHE_MAX_BYTES", default=256 * 1024 * 1024, cast=int))
+snapshotCache = SnapshotCache(config("SNAPSHOT_CACHE_MAX_BYTES", default=256 * 1024 * 1024, cast=int),
+                              config("TREE_BUILD_PROCESS_THRESHOLD", default=512 * 1024, cast=int),
+                              treeBuildPool, treeCache, treeIndexes)
@@ -0,0 +1,204 @@
+"""This module provides the on-disk index of requirement trees: snapshots (see treeSnapshot) saved next to the repos,
+so the first read of a repo after a restart does not build its Doorstop tree and parse every YAML file."""
+
+import hashlib
+import json
+import mmap
+import os
+import sys
+import threading
+
+from decouple import config
+
+from MyServer.treeSnapshot import DocumentSnapshot, TreeSnapshot
+
+
+INDEX_VERSION = 3
+# array columns of the snapshot in the order they are written, widest items first so every column is aligned,
+# followed by the review flags and the texts encoded in UTF-8
+ARRAY_COLUMNS = ("textOffsets", "linkOffsets", "linkTargets", "itemDocuments")
+COLUMN_ALIGNMENT = 8
+
+
+def indexPath(userFolder: str) -> str:
+    """Get path of the index of the given folder. It is placed next to the repo, outside its working tree."""
+    return os.path.dirname(os.path.abspath(userFolder)) + ".treeindex"
+
+
+def reqTreeHash(userFolder: str) -> str | None:
+    """Compute the git tree hash of the folder as it is in the working tree, including changes that are not committed yet.
+    The files are hashed the way git hashes them, but no object is written to the repo. Files ignored by git are hashed too.\n
+    Returns: the hash or None if the folder cannot be read"""
+    try:
+        return _objectHash(b"tree", _treeData(os.path.abspath(userFolder)))
+    except OSError:
+        return None
+
+
+def _treeData(path: str) -> bytes:
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            name = os.fsencode(entry.name)
+            if entry.is_symlink():
+                entries.append((name, b"120000", _objectHash(b"blob", os.fsencode(os.readlink(entry.path)))))
+            elif entry.is_dir():
+                data = _treeData(entry.path) if entry.name != ".git" else b""
+                # git keeps no empty trees, trees are ordered as if their names ended with a slash
+                if data:
+                    entries.append((name + b"/", b"40000", _objectHash(b"tree", data)))
+            else:
+                with open(entry.path, "rb") as file:
+                    blobHash = _objectHash(b"blob", file.read())
+                entries.append((name, b"100755" if entry.stat().st_mode & 0o111 else b"100644", blobHash))
+    entries.sort()
+    return b"".join(mode + b" " + name.rstrip(b"/") + b"\0" + bytes.fromhex(objectHash) for name, mode, objectHash in entries)
+
+
+def _objectHash(type: bytes, data: bytes) -> str:
+    return hashlib.sha1(type + b" " + str(len(data)).encode() + b"\0" + data).hexdigest()
+
+
+def dumpSnapshot(snapshot: TreeSnapshot, stamp: str, treeHash: str | None = None) -> bytes:
+    """Encode the snapshot as a JSON line with the key of the index (stamp, tree hash, format), a JSON line with the documents,
+    UIDs, levels and sizes of the columns, padded so the columns are aligned, followed by the raw bytes of its columns."""
+    texts = snapshot.texts.encode()
+    columns = [getattr(snapshot, name).tobytes() for name in ARRAY_COLUMNS] + [bytes(snapshot.reviewed), texts]
+    numbers = {id(document): number for number, document in enumerate(snapshot.documents)}
+    key = {
+        "version": INDEX_VERSION,
+        "stamp": stamp,
+        "treeHash": treeHash,
+        "byteorder": sys.byteorder,
+        "itemsizes": _itemsizes(snapshot),
+    }
+    header = {
+        "documents": [[document.prefix, document.firstItem, document.itemCount, [numbers[id(child)] for child in document.children]]
+                      for document in snapshot.documents],
+        "uids": snapshot.uids,
+        "levels": snapshot.levels,
+        "externalUIDs": snapshot.externalUIDs,
+        "lengths": [len(column) for column in columns],
+    }
+    data = json.dumps(key).encode() + b"\n" + json.dumps(header).encode()
+    # JSON allows trailing spaces
+    data += b" " * (-(len(data) + 1) % COLUMN_ALIGNMENT) + b"\n"
+    return data + b"".join(columns)
+
+
+def indexKey(data: bytes | mmap.mmap) -> dict | None:
+    """Read the key of an index encoded with dumpSnapshot without decoding the snapshot.\n
+    Returns: dict with the stamp and treeHash or None if the index was saved by another version or on another platform"""
+    try:
+        key = json.loads(data[:data.find(b"\n")])
+        if key["version"] != INDEX_VERSION or key["byteorder"] != sys.byteorder or key["itemsizes"] != _itemsizes(TreeSnapshot()):
+            return None
+        return key
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def loadSnapshot(data: bytes | mmap.mmap) -> TreeSnapshot | None:
+    """Decode a snapshot encoded with dumpSnapshot, its key is checked with indexKey. The columns of the snapshot are views
+    of the data, so the columns of a memory-mapped index are read from the file only when they are used.\n
+    Returns: the snapshot or None if the data is damaged"""
+    try:
+        start = data.find(b"\n") + 1
+        end = data.find(b"\n", start)
+        header = json.loads(data[start:end])
+        snapshot = TreeSnapshot()
+        view = memoryview(data)[end + 1:]
+        if start == 0 or end == -1 or sum(header["lengths"]) != len(view):
+            return None
+        columns = []
+        for length in header["lengths"]:
+            columns.append(view[:length])
+            view = view[length:]
+        for name, column in zip(ARRAY_COLUMNS, columns):
+            setattr(snapshot, name, column.cast(getattr(snapshot, name).typecode))
+        snapshot.reviewed = columns[len(ARRAY_COLUMNS)]
+        snapshot.texts = str(columns[len(ARRAY_COLUMNS) + 1], "utf-8")
+        snapshot.uids = header["uids"]
+        snapshot.levels = header["levels"]
+        snapshot.externalUIDs = header["externalUIDs"]
+        snapshot.documents = [DocumentSnapshot(prefix, firstItem, itemCount, [], snapshot)
+                              for prefix, firstItem, itemCount, children in header["documents"]]
+        for document, (prefix, firstItem, itemCount, children) in zip(snapshot.documents, header["documents"]):
+            document.children = [snapshot.documents[child] for child in children]
+        return snapshot
+    except (ValueError, KeyError, TypeError, IndexError):
+        return None
+
+
+def _itemsizes(snapshot: TreeSnapshot) -> list[int]:
+    return [getattr(snapshot, name).itemsize for name in ARRAY_COLUMNS]
+
+
+def _mapIndex(path: str) -> mmap.mmap | None:
+    try:
+        with open(path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # missing or empty file
+        return None
+
+
+class TreeIndexStore:
+    """Store of the on-disk indexes of repos. An index is keyed by the stamp of the requirements folder (see treeCache.folderStamp),
+    it is used only when the folder has the same stamp, otherwise the tree is rebuilt and the index is replaced.\n
+    A new checkout of the same files (e.g. the repo was cloned again) changes the stamp, so the first time a folder is loaded
+    in the process, the git tree hash of its files is compared too and a matching index is saved again with the new stamp.
+    Indexes are memory-mapped, the columns of a loaded snapshot are read straight from the file."""
+
+    def __init__(self, persist: bool):
+        self._persist = persist
+        self._loaded: set[str] = set()
+        # tree hashes computed on the first load of folders, saved with their next snapshot
+        self._treeHashes: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def load(self, userFolder: str, stamp: str) -> TreeSnapshot | None:
+        if not self._persist:
+            return None
+        folder = os.path.abspath(userFolder)
+        with self._lock:
+            coldStart = folder not in self._loaded
+            self._loaded.add(folder)
+        data = _mapIndex(indexPath(userFolder))
+        key = indexKey(data) if data is not None else None
+        if key is not None and key["stamp"] == stamp:
+            return loadSnapshot(data)
+        if not coldStart:
+            return None
+        treeHash = reqTreeHash(userFolder)
+        if treeHash is None:
+            return None
+        if key is None or key["treeHash"] != treeHash:
+            with self._lock:
+                self._treeHashes[folder] = treeHash
+            return None
+        snapshot = loadSnapshot(data)
+        if snapshot is not None:
+            self._write(userFolder, dumpSnapshot(snapshot, stamp, treeHash))
+        return snapshot
+
+    def save(self, userFolder: str, stamp: str, snapshot: TreeSnapshot):
+        if not self._persist:
+            return
+        with self._lock:
+            treeHash = self._treeHashes.pop(os.path.abspath(userFolder), None)
+        self._write(userFolder, dumpSnapshot(snapshot, stamp, treeHash))
+
+    @staticmethod
+    def _write(userFolder: str, data: bytes):
+        # the file is replaced, not written in place, as loaded snapshots keep the old one mapped
+        path = indexPath(userFolder)
+        try:
+            with open(path + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            pass
+
+
+treeIndexes = TreeIndexStore(config("TREE_INDEX_PERSIST", default=False, cast=bool))
@@ -0,0 +1,214 @@
+"""This module provides snapshots of requirement trees: compact, picklable records of documents, items and links served to read requests."""
+
+from array import array
+from itertools import repeat
+from operator import itemgetter
+from typing import Any, Iterator
+
+import doorstop
+
+
+class DocumentSnapshot:
+    """Document of a snapshot. Its items are the items firstItem, ..., firstItem + itemCount - 1 of the snapshot."""
+
+    __slots__ = ("prefix", "firstItem", "itemCount", "children", "snapshot")
+
+    def __init__(self, prefix: str, firstItem: int, itemCount: int, children: list["DocumentSnapshot"], snapshot: "TreeSnapshot"):
+        self.prefix = prefix
+        self.firstItem = firstItem
+        self.itemCount = itemCount
+        self.children = children
+        self.snapshot = snapshot
+
+    @property
+    def items(self) -> list["ItemSnapshot"]:
+        return self.snapshot.views(range(self.firstItem, self.firstItem + self.itemCount))
+
+
+class ItemSnapshot(tuple):
+    """View of one item of a snapshot: the pair (snapshot, item number). Its fields are read from the columns of the snapshot.
+    It is a tuple, so views of many items are created without calling Python code, see TreeSnapshot.views."""
+
+    __slots__ = ()
+
+    snapshot: "TreeSnapshot" = property(itemgetter(0))
+    index: int = property(itemgetter(1))
+
+    @property
+    def uid(self) -> str:
+        return self.snapshot.uids[self.index]
+
+    @property
+    def prefix(self) -> str:
+        return self.snapshot.documents[self.snapshot.itemDocuments[self.index]].prefix
+
+    @property
+    def level(self) -> str:
+        return self.snapshot.levels[self.index]
+
+    @property
+    def text(self) -> str:
+        offsets = self.snapshot.textOffsets
+        return self.snapshot.texts[offsets[self.index]:offsets[self.index + 1]]
+
+    @property
+    def reviewed(self) -> bool:
+        return bool(self.snapshot.reviewed[self.index])
+
+    @property
+    def links(self) -> list[str]:
+        snapshot = self.snapshot
+        offsets = snapshot.linkOffsets
+        return list(map(snapshot.linkUID, snapshot.linkTargets[offsets[self.index]:offsets[self.index + 1]]))
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ItemSnapshot):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "ItemSnapshot(uid={!r}, prefix={!r}, text={!r}, reviewed={!r}, links={!r})".format(*self._fields())
+
+    def _fields(self) -> tuple:
+        return self.uid, self.prefix, self.text, self.reviewed, self.links
+
+
+class TreeSnapshot:
+    """Snapshot of a Doorstop tree stored in columns. It holds no Doorstop objects, so it can be built in a worker process and sent back.\n
+    Documents are kept in hierarchy order (a document before its children) and items are numbered in the same order,
+    so the items of a document are consecutive. Texts are slices of one string, links are arrays of item numbers.
+    Links to UIDs missing from the tree get numbers after the items: len(uids) is externalUIDs[0] and so on."""
+
+    __slots__ = ("documents", "uids", "levels", "itemDocuments", "texts", "textOffsets", "reviewed", "linkOffsets", "linkTargets", "externalUIDs")
+
+    def __init__(self):
+        self.documents: list[DocumentSnapshot] = []
+        self.uids: list[str] = []
+        self.levels: list[str] = []
+        self.itemDocuments = array("I")
+        self.texts = ""
+        self.textOffsets = array("L", [0])
+        self.reviewed = bytearray()
+        self.linkOffsets = array("L", [0])
+        self.linkTargets = array("L")
+        self.externalUIDs: list[str] = []
+
+    @property
+    def root(self) -> DocumentSnapshot | None:
+        return self.documents[0] if self.documents else None
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, TreeSnapshot):
+            return NotImplemented
+        return self._state() == other._state()
+
+    __hash__ = None
+
+    def _state(self) -> tuple:
+        documents = [(document.prefix, document.firstItem, document.itemCount, [child.prefix for child in document.children])
+                     for document in self.documents]
+        return (documents, self.uids, self.levels, self.itemDocuments, self.texts, self.textOffsets, self.reviewed,
+                self.linkOffsets, self.linkTargets, self.externalUIDs)
+
+    def linkUID(self, target: int) -> str:
+        return self.uids[target] if target < len(self.uids) else self.externalUIDs[target - len(self.uids)]
+
+    def views(self, indexes: range) -> list[ItemSnapshot]:
+        return list(map(ItemSnapshot, zip(repeat(self), indexes)))
+
+    def findDocument(self, prefix: str) -> DocumentSnapshot:
+        for document in self.documents:
+            if document.prefix.lower() == prefix.lower():
+                return document
+        # the same error as Tree.find_document
+        raise doorstop.DoorstopError(f"no document with prefix: {prefix}")
+
+    def items(self) -> list[tuple[ItemSnapshot, str]]:
+        """Get all items paired with the prefixes of their documents, in hierarchy order."""
+        prefixes = [document.prefix for document in self.documents]
+        return list(zip(self.views(range(len(self.uids))), map(prefixes.__getitem__, self.itemDocuments)))
+
+    def column(self, field: str, indexes: list[int]) -> Iterator[Any]:
+        """Values of a field (uid, prefix, text, reviewed, links) of the items with the given numbers, read straight from the columns.
+        Serializing many items column by column is faster than going through their views."""
+        if field == "uid":
+            return (self.uids[index] for index in indexes)
+        if field == "prefix":
+            prefixes = [document.prefix for document in self.documents]
+            return (prefixes[self.itemDocuments[index]] for index in indexes)
+        if field == "text":
+            return (self.texts[start:end] for start, end in _bounds(self.textOffsets, indexes))
+        if field == "reviewed":
+            return (bool(self.reviewed[index]) for index in indexes)
+        if field == "links":
+            names = self.uids + self.externalUIDs
+            offsets = self.linkOffsets
+            if not _consecutive(indexes):
+                return ([names[target] for target in self.linkTargets[offsets[index]:offsets[index + 1]]] for index in indexes)
+            # resolve the links of all the items at once, the links of an item are a slice of them
+            first = offsets[indexes[0]]
+            links = [names[target] for target in self.linkTargets[first:offsets[indexes[-1] + 1]]]
+            return (links[start - first:end - first] for start, end in _bounds(offsets, indexes))
+        raise KeyError(field)
+
+
+def _consecutive(indexes: list[int]) -> bool:
+    return bool(indexes) and indexes == list(range(indexes[0], indexes[0] + len(indexes)))
+
+
+def _bounds(offsets: array, indexes: list[int]) -> Iterator[tuple[int, int]]:
+    # offsets[index], offsets[index + 1] of every index
+    if _consecutive(indexes):
+        # items of a document or of the whole tree, their offsets are a slice of the offsets
+        bounds = offsets[indexes[0]:indexes[-1] + 2]
+        return zip(bounds[:-1], bounds[1:])
+    return ((offsets[index], offsets[index + 1]) for index in indexes)
+
+
+def snapshotTree(tree: doorstop.Tree) -> TreeSnapshot:
+    """Take a snapshot of a built tree. All items are loaded and their review status is computed."""
+    snapshot = TreeSnapshot()
+    if not tree.documents:
+        return snapshot
+    texts: list[str] = []
+    links: list[list[str]] = []
+    _addDocument(snapshot, tree, texts, links)
+    snapshot.texts = "".join(texts)
+    numbers = {uid: number for number, uid in enumerate(snapshot.uids)}
+    external: dict[str, int] = {}
+    for itemLinks in links:
+        for uid in itemLinks:
+            target = numbers.get(uid)
+            if target is None:
+                target = external.get(uid)
+                if target is None:
+                    snapshot.externalUIDs.append(uid)
+                    target = external[uid] = len(snapshot.uids) + len(snapshot.externalUIDs) - 1
+            snapshot.linkTargets.append(target)
+        snapshot.linkOffsets.append(len(snapshot.linkTargets))
+    return snapshot
+
+
+def _addDocument(snapshot: TreeSnapshot, tree: doorstop.Tree, texts: list[str], links: list[list[str]]) -> DocumentSnapshot:
+    number = len(snapshot.documents)
+    document = DocumentSnapshot(str(tree.document.prefix), len(snapshot.uids), 0, [], snapshot)
+    snapshot.documents.append(document)
+    for item in tree.document.items:
+        text = str(item.text)
+        snapshot.uids.append(str(item.uid))
+        snapshot.levels.append(str(item.level))
+        snapshot.itemDocuments.append(number)
+        texts.append(text)
+        snapshot.textOffsets.append(snapshot.textOffsets[-1] + len(text))
+        snapshot.reviewed.append(bool(item.reviewed))
+        links.append([str(link) for link in item.links])
+    document.itemCount = len(snapshot.uids) - document.firstItem
+    document.children = [_addDocument(snapshot, child, texts, links) for child in tree.children]
+    return document
+
+
+def buildSnapshot(userFolder: str) -> TreeSnapshot:
+    """Build the tree of the given folder and take its snapshot. It is run in the worker processes of the tree build pool."""
+    return snapshotTree(doorstop.build(userFolder))
@@ -9,10 +9,14 @@ urlpatterns = [
     path("doc/", views.DocView.as_view(), name="doc"),
     path("req/link/", views.LinkView.as_view(), name="linkView"),
     path("req/unlink/", views.UnlinkView.as_view(), name="unlinkView"),
+    path("req/linkedBy/", views.LinkedByView.as_view(), name="linkedByView"),
+    path("req/batch/", views.BatchView.as_view(), name="batchView"),
+    path("req/events/", views.changeEvents, name="changeEvents"),
     path("login/<str:provider_str>/", views.LoginView.as_view(), name="gitlabLoginView"),
     path("login_callback/<str:provider_str>/", views.LoginCallbackView.as_view(), name="gitlabLoginCallbackView"),
     path("req/all/", views.AllReqsView.as_view(), name="allReqsView"),
     path('git/commit/', views.GitCommitView.as_view(), name="commitInRepo"),
+    path('git/jobs/<str:jobId>/', views.GitJobView.as_view(), name="gitJobView"),
     path('git/repos/', views.GetUserReposList.as_view(), name="gitReposView"),
     path('identity/', views.IdentityView.as_view(), name="identityView"),
     # path('setParent/', views.setDocumentParent),
@@ -1,20 +1,28 @@
-from typing import Any
+import hashlib
+import json
 
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.http import HttpResponseRedirect
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from oauthlib.oauth2 import AccessDeniedError
 from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 import MyServer.authHelpers
+import MyServer.changeFeed
+import MyServer.error
+import MyServer.gitJobs
+import MyServer.offload
 import MyServer.repoHelpers
 import MyServer.repoHelpers
 import MyServer.restHandlersHelpers
 import MyServer.restHandlersHelpers
-from MyServer.authHelpers import requires_jwt_login
+from MyServer.authHelpers import requires_jwt_login, requires_jwt_login_async
 
 
 # Create your views here.
@@ -32,11 +40,90 @@ If no errors described in the error.py module occur, messages containing server
 status 200 messages confirming the correct execution of the operation.
 """
 
-class ReqView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_JOB_WAIT = 30
+
+
+def jobOwner(authInfo) -> str:
+    """Get owner of the jobs submitted by the authenticated user, only the owner can read their status."""
+    return f"{authInfo.provider.name}:{authInfo.uid}"
+
+
+def parseJobWait(value: str | None) -> float:
+    """Parse number of seconds to wait for a job to finish, at most MAX_JOB_WAIT."""
+    if not value:
+        return 0
+    try:
+        wait = float(value)
+    except ValueError:
+        raise MyServer.error.InvalidQueryParameterException("wait must be a number of seconds.")
+    if not 0 <= wait:
+        raise MyServer.error.InvalidQueryParameterException("wait must be a number of seconds.")
+    return min(wait, MAX_JOB_WAIT)
+
+
+def representationETag(request, version: str) -> str:
+    """Strong ETag of the representation at the requested path with the requested query parameters, for the given version of the requirements."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(request.path.encode())
+    for key in sorted(request.GET):
+        digest.update(f"\0{key}={','.join(request.GET.getlist(key))}".encode())
+    digest.update(f"\0{version}".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def notModified(request, etag: str):
+    """Return a 304 Not Modified response if the client already has the representation with the given ETag, otherwise None."""
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        response["ETag"] = etag
+    return response
+
+
+def withETag(response, etag: str):
+    """Add the ETag to the response, the client revalidates it on every request."""
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def withNextCursor(response, nextCursor: str | None):
+    """Add the cursor of the next page of a paginated representation to the response headers."""
+    if nextCursor:
+        response[NEXT_CURSOR_HEADER] = nextCursor
+    return response
+
+
+def requestData(request) -> dict:
+    """Parse the JSON body of a request to an async view, the REST framework views get it as request.data."""
+    if not request.body:
+        return {}
+    try:
+        return json.loads(request.body)
+    except ValueError:
+        raise ParseError()
+
 
+class AsyncAPIView(View):
+    """
+    Base of the views with async handlers. Under ASGI (server.asgi) their requests wait for GitHub/GitLab and for git jobs
+    without holding a thread, blocking calls are run in the bounded offload pool. Errors are returned like by the REST framework views.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except MyServer.error.CustomAPIException as e:
+            return MyServer.error.errorResponse(e)
+        except APIException as e:
+            return JsonResponse({"detail": e.detail}, status=e.status_code)
+
+
+class ReqView(APIView):
     @method_decorator(csrf_exempt)
     def dispatch(self, *args, **kwargs):
         return super(ReqView, self).dispatch(*args, **kwargs)
@@ -76,20 +163,22 @@ class ReqView(APIView):
         doc_id = request.GET.get('docId', '')  # Get docId from query parameters
         if not doc_id:
             return Response({'message': 'Missing docId parameter in the request'}, status=status.HTTP_400_BAD_REQUEST)
+        query = MyServer.restHandlersHelpers.parseReqQuery(request.GET)
         repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
+        etag = representationETag(request, MyServer.restHandlersHelpers.getReqsVersion(repoFolder + "/req"))
+        response = notModified(request, etag)
+        if response is not None:
+            return response
         reqs = MyServer.restHandlersHelpers.getDocReqs(
             request.GET.get("docId"), repoFolder + "/req")
         if not reqs:
-            return JsonResponse([], safe=False)
-        serialized = MyServer.restHandlersHelpers.serializeDocReqs(reqs)
-        return JsonResponse(serialized, safe=False)
+            return withETag(JsonResponse([], safe=False), etag)
+        reqs, nextCursor = MyServer.restHandlersHelpers.queryReqs(reqs, query)
+        serialized = MyServer.restHandlersHelpers.serializeDocReqs(reqs, query.fields)
+        return withETag(withNextCursor(JsonResponse(serialized, safe=False), nextCursor), etag)
 
 
 class DocView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
-
     @method_decorator(csrf_exempt)
     def dispatch(self, *args, **kwargs):
         return super(DocView, self).dispatch(*args, **kwargs)
@@ -118,16 +207,16 @@ class DocView(APIView):
 
     def _getDocuments(self, request):
         repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
+        etag = representationETag(request, MyServer.restHandlersHelpers.getReqsVersion(repoFolder + "/req"))
+        response = notModified(request, etag)
+        if response is not None:
+            return response
         serialized = MyServer.restHandlersHelpers.serializeDocuments(
             repoFolder + "/req")
-        return JsonResponse(serialized, safe=False)
+        return withETag(JsonResponse(serialized, safe=False), etag)
 
 
 class LinkView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
-
     @requires_jwt_login
     def put(self, request, *args, **kwargs):
         return self._addLink(request)
@@ -139,10 +228,6 @@ class LinkView(APIView):
 
 
 class UnlinkView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
-
     @requires_jwt_login
     def put(self, request, *args, **kwargs):
         return self._removeLink(request)
@@ -157,6 +242,57 @@ class UnlinkView(APIView):
         return Response({'message': 'OK'}, status=status.HTTP_200_OK)
 
 
+class BatchView(APIView):
+    @method_decorator(csrf_exempt)
+    def dispatch(self, *args, **kwargs):
+        return super(BatchView, self).dispatch(*args, **kwargs)
+
+    @requires_jwt_login
+    def post(self, request, *args, **kwargs):
+        return self._applyBatch(request)
+
+    def _applyBatch(self, request):
+        operations = MyServer.restHandlersHelpers.parseBatch(request.data.get("operations"))
+        repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
+        results, error = MyServer.restHandlersHelpers.applyUserBatch(operations, repoFolder + "/req")
+        if error is not None:
+            return Response({'message': str(error.detail), 'api_error_code': error.api_error_code, 'results': results}, status=error.status_code)
+        return Response({'message': 'OK', 'results': results}, status=status.HTTP_200_OK)
+
+
+class LinkedByView(APIView):
+    @requires_jwt_login
+    def get(self, request, *args, **kwargs):
+        return self._getLinkedBy(request)
+
+    def _getLinkedBy(self, request):
+        repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
+        serialized = MyServer.restHandlersHelpers.getLinkedBy(request.GET.get("reqId", ""), repoFolder + "/req")
+        return JsonResponse(serialized, safe=False)
+
+
+async def changeEvents(request):
+    """
+    Stream the changes of the requirement tree of the repo to the client as server-sent events. It is a native async view, so under ASGI (server.asgi)
+    a connected client does not hold a worker thread. A client resuming after a reconnection sends the id of the last received event in the Last-Event-ID header.
+    """
+    if request.method != "GET":
+        return HttpResponse(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    try:
+        request.auth = await MyServer.authHelpers.authenticateRequestAsync(request)
+    except MyServer.error.CustomAPIException as e:
+        return MyServer.error.errorResponse(e)
+    repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
+    lastEventId = request.headers.get("Last-Event-ID") or request.GET.get("lastEventId")
+    events = MyServer.changeFeed.changeFeed.stream(
+        repoFolder, lastEventId, lambda: MyServer.restHandlersHelpers.getReqsVersion(repoFolder + "/req"))
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # proxies must not buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 class LoginCallbackView(APIView):
     def get(self, request, *args, **kwargs):
         provider = MyServer.authHelpers.OAuthProvider[kwargs.get("provider_str").upper()]
@@ -173,94 +309,96 @@ class LoginView(APIView):
         return HttpResponseRedirect(MyServer.authHelpers.generate_authorization_url(provider))
 
 
-class GitCommitView(APIView):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
-
-    @requires_jwt_login
-    def post(self, request, *args, **kwargs):
-        text = request.data.get("commitText")
-        if self._commitAndPush(request, text):
-            return Response({'message': "Successfully staged changes in repository!"}, status=status.HTTP_200_OK)
-        else:
-            return Response({'message': 'Could not publish changes in repository'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+class GitCommitView(AsyncAPIView):
+    @requires_jwt_login_async
+    async def post(self, request, *args, **kwargs):
+        text = requestData(request).get("commitText")
+        job = await self._commitAndPush(request, text)
+        return JsonResponse(job.toDict(), status=status.HTTP_202_ACCEPTED)
 
-    def _commitAndPush(self, request, commitText: str):
+    async def _commitAndPush(self, request, commitText: str) -> MyServer.gitJobs.Job:
         authInfo: MyServer.authHelpers.AuthInfo = request.auth
         repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
-        providerAPI = MyServer.authHelpers.AuthProviderAPI(authInfo.provider)
-        _, userName, userMail = providerAPI.get_identity(authInfo.token)
-        if not userMail:
-            userMail = providerAPI.getUserMail(authInfo.token)
-        return MyServer.repoHelpers.stageChanges(repoFolder, commitText, userName, userMail)
+        identity = await MyServer.authHelpers.getUserIdentityAsync(authInfo)
+        return await MyServer.offload.offloadPool.run(
+            MyServer.gitJobs.gitJobs.submit, MyServer.gitJobs.JobKind.COMMIT, repoFolder, jobOwner(authInfo),
+            lambda job: MyServer.repoHelpers.stageChanges(repoFolder, commitText, identity.login, identity.email))
 
 
-class GetUserReposList(APIView):
-    def __init__(self, **kwargs: Any) -> None:
-        super().__init__(**kwargs)
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
+class GitJobView(AsyncAPIView):
+    @requires_jwt_login_async
+    async def get(self, request, *args, **kwargs):
+        return await self._getJob(request, kwargs.get("jobId"))
 
-    @requires_jwt_login
-    def get(self, request, *args, **kwargs):
-        return self._getUserRepos(request)
+    async def _getJob(self, request, jobId: str):
+        job = await MyServer.offload.offloadPool.run(MyServer.gitJobs.gitJobs.getJob, jobId, jobOwner(request.auth))
+        wait = parseJobWait(request.GET.get("wait"))
+        if wait:
+            # long polling - answer as soon as the job finishes
+            job = await MyServer.gitJobs.gitJobs.waitAsync(job, wait)
+        return JsonResponse(job.toDict())
 
-    @requires_jwt_login
-    def post(self, request, *args, **kwargs):
-        return self._postChosenRepo(request)
 
-    def _getUserRepos(self, request):
+class GetUserReposList(AsyncAPIView):
+    @requires_jwt_login_async
+    async def get(self, request, *args, **kwargs):
+        return await self._getUserRepos(request)
+
+    @requires_jwt_login_async
+    async def post(self, request, *args, **kwargs):
+        return await self._postChosenRepo(request)
+
+    async def _getUserRepos(self, request):
         authInfo: MyServer.authHelpers.AuthInfo = request.auth
-        userRepos = MyServer.authHelpers.AuthProviderAPI(authInfo.provider).get_repos(authInfo.token)
-        serverUserRepos = MyServer.repoHelpers.getUserServerRepos(userRepos, self._serverRepos)
+        userRepos = await MyServer.authHelpers.AuthProviderAPI(authInfo.provider).get_repos_async(authInfo.token)
+        serverRepos = await MyServer.offload.offloadPool.run(MyServer.repoHelpers.serverRepos.getRepos)
+        serverUserRepos = MyServer.repoHelpers.getUserServerRepos(userRepos, serverRepos)
         return JsonResponse(serverUserRepos, safe=False)
 
-    def _postChosenRepo(self, request):
+    async def _postChosenRepo(self, request):
         authInfo: MyServer.authHelpers.AuthInfo = request.auth
         repoFolder, repoName = MyServer.repoHelpers.getRepoInfo(request)
-        repoUrl = self._serverRepos.get(repoName)
-        if MyServer.repoHelpers.checkIfExists(repoFolder):
-            MyServer.repoHelpers.pullRepo(repoFolder, authInfo.token)
-        else:
-            MyServer.repoHelpers.cloneRepo(repoFolder, repoUrl, authInfo.token, authInfo.provider)
-        return Response({'message': 'OK'}, status=status.HTTP_200_OK)
-
+        repoUrl = await MyServer.offload.offloadPool.run(MyServer.repoHelpers.serverRepos.getUrl, repoName)
+        job = await MyServer.offload.offloadPool.run(
+            MyServer.gitJobs.gitJobs.submit, MyServer.gitJobs.JobKind.SYNC, repoFolder, jobOwner(authInfo),
+            lambda job: MyServer.repoHelpers.syncRepo(repoFolder, repoUrl, authInfo.token, authInfo.provider, job),
+            coalesce=True)
+        return JsonResponse(job.toDict(), status=status.HTTP_202_ACCEPTED)
 
-class AllReqsView(APIView):
-    def __init__(self):
-        self._serverRepos = MyServer.repoHelpers.getReposFromFile()
 
-    @requires_jwt_login
-    def get(self, request, *args, **kwargs):
-        return self._getAllReqs(request)
-
-    @method_decorator(csrf_exempt)
-    def dispatch(self, *args, **kwargs):
-        return super(AllReqsView, self).dispatch(*args, **kwargs)
+class AllReqsView(AsyncAPIView):
+    @requires_jwt_login_async
+    async def get(self, request, *args, **kwargs):
+        return await self._getAllReqs(request)
 
-    def _getAllReqs(self, request):
+    async def _getAllReqs(self, request):
+        query = MyServer.restHandlersHelpers.parseReqQuery(request.GET)
         repoFolder, _ = MyServer.repoHelpers.getRepoInfo(request)
-        reqs = MyServer.restHandlersHelpers.getAllReqs(repoFolder + "/req")
+        etag = representationETag(request, await MyServer.offload.offloadPool.run(MyServer.restHandlersHelpers.getReqsVersion, repoFolder + "/req"))
+        response = notModified(request, etag)
+        if response is not None:
+            return response
+        reqs = await MyServer.offload.offloadPool.run(MyServer.restHandlersHelpers.getAllReqs, repoFolder + "/req")
         if not reqs:
-            return JsonResponse([], safe=False)
-        serialized = MyServer.restHandlersHelpers.serializeAllReqs(reqs)
-        return JsonResponse(serialized, safe=False)
+            return withETag(JsonResponse([], safe=False), etag)
+        reqs, nextCursor = await MyServer.offload.offloadPool.run(MyServer.restHandlersHelpers.queryReqs, reqs, query)
+        # an async iterator is streamed by the ASGI handler as it is produced, a sync one would be read whole first
+        chunks = MyServer.offload.offloadPool.iterate(MyServer.restHandlersHelpers.streamAllReqs(reqs, query.fields))
+        response = StreamingHttpResponse(chunks, content_type="application/json")
+        return withETag(withNextCursor(response, nextCursor), etag)
 
 
-class IdentityView(APIView):
-    @requires_jwt_login
-    def get(self, request, *args, **kwargs):
-        return self._getIdentity(request)
+class IdentityView(AsyncAPIView):
+    @requires_jwt_login_async
+    async def get(self, request, *args, **kwargs):
+        return await self._getIdentity(request)
 
-    def _getIdentity(self, request):
+    async def _getIdentity(self, request):
         authInfo: MyServer.authHelpers.AuthInfo = request.auth
-        providerAPI = MyServer.authHelpers.AuthProviderAPI(authInfo.provider)
-        uid, login, email = providerAPI.get_identity(authInfo.token)
-        if not email:
-            email = providerAPI.getUserMail(authInfo.token)
-        return JsonResponse({"uid": uid,
-                             "login": login,
-                             "email": email,
+        identity = await MyServer.authHelpers.getUserIdentityAsync(authInfo)
+        return JsonResponse({"uid": identity.uid,
+                             "login": identity.login,
+                             "email": identity.email,
                              "provider": authInfo.provider.name.lower()})
 
 
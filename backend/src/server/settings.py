@@ -27,6 +27,8 @@ ALLOWED_HOSTS = ['*']
 
 CORS_ALLOWED_ORIGINS = config('CORS_ALLOWED_ORIGINS').split('|')
 
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor', 'ETag']
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -52,6 +54,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'MyServer.offload.SyncViewLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'server.urls'
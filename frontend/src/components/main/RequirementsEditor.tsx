@@ -3,18 +3,20 @@ import { Box } from "@mui/material";
 import RequirementList from "./requirement-list/RequirementList.tsx";
 import AddRequirement from "./AddRequirement.tsx";
 import RequirementDetails from "./requirement-details/RequirementDetails.tsx";
-import { useCallback, useEffect, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import { Requirement } from "../../types.ts";
 import { fetchRequirements } from "../../lib/api/requirementService.ts";
 import { useMainContextTools } from "../../hooks/useMainContext.ts";
 import { useAuth } from "../../hooks/useAuthContext.ts";
 import useRepoContext from "../../hooks/useRepoContext.ts";
 import { APIError } from "../../lib/api/fetchAPI.ts";
+import { subscribeToChanges } from "../../lib/api/changeFeedService.ts";
 import { toast } from "react-toastify";
 
 /*
     This component is used to edit requirements.
     It will display the requirement list and the requirement details.
+    The requirements are fetched again whenever the requirements of the repository are changed, also by other users.
 */
 
 function findRequirement(requirements: Requirement[], id: string | null) {
@@ -59,6 +61,22 @@ export default function RequirementsEditor() {
         refreshRequirements().then();
     }, [refreshRequirements]);
 
+    // the subscription is kept when the selected document changes
+    const refreshRequirementsRef = useRef(refreshRequirements);
+    refreshRequirementsRef.current = refreshRequirements;
+    useEffect(() => {
+        if (!authTools.tokenStr || !repoTools.repositoryName) {
+            return;
+        }
+        return subscribeToChanges(
+            authTools.tokenStr,
+            repoTools.repositoryName,
+            () => {
+                refreshRequirementsRef.current().then();
+            },
+        );
+    }, [authTools.tokenStr, repoTools.repositoryName]);
+
     useEffect(() => {
         if (mainContextTools.data.selectedRequirementId) {
             if (
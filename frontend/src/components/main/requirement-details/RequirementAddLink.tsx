@@ -1,10 +1,10 @@
 import { Autocomplete, Box, Button, Paper, TextField } from "@mui/material";
 import { useCallback, useEffect, useState } from "react";
 import {
-    getAllRequirements,
+    getAllRequirementRefs,
     linkRequirement,
 } from "../../../lib/api/requirementService";
-import { Requirement, RequirementWithDoc } from "../../../types";
+import { Requirement, RequirementRef } from "../../../types";
 import { APIError } from "../../../lib/api/fetchAPI";
 import useRepoContext from "../../../hooks/useRepoContext.ts";
 import { useAuth } from "../../../hooks/useAuthContext.ts";
@@ -17,7 +17,7 @@ import { toast } from "react-toastify";
 */
 
 interface RequirementsAndKey {
-    allRequirements: RequirementWithDoc[];
+    allRequirements: RequirementRef[];
     autocompleteKey: number;
 }
 
@@ -31,7 +31,7 @@ export default function RequirementAddLink({
     const authTools = useAuth();
     const repoTools = useRepoContext();
     const [selectedRequirement, setSelectedRequirement] =
-        useState<Requirement>();
+        useState<RequirementRef>();
 
     const [allRequirementsAndKey, setAllRequirementsAndKey] =
         useState<RequirementsAndKey>({
@@ -42,7 +42,7 @@ export default function RequirementAddLink({
     const [errorState, setErrorState] = useState<string | null>(null);
 
     const filterRequirements = useCallback(
-        (requirements: RequirementWithDoc[]) => {
+        (requirements: RequirementRef[]) => {
             return requirements.filter((req) => {
                 const isNotSelectedReq = req.id !== requirement.id;
                 const isNotLinked = !requirement.links?.some(
@@ -58,7 +58,10 @@ export default function RequirementAddLink({
         if (!authTools.tokenStr || !repoTools.repositoryName) {
             return;
         }
-        await getAllRequirements(authTools.tokenStr, repoTools.repositoryName)
+        await getAllRequirementRefs(
+            authTools.tokenStr,
+            repoTools.repositoryName,
+        )
             .then((allReqs) => {
                 const filteredReqs = filterRequirements(allReqs.flat());
                 setAllRequirementsAndKey((prevAllRequirementsAndKey) => ({
@@ -0,0 +1,129 @@
+import { constant } from "../../constants.ts";
+
+/*
+    This file contains a function to follow the changes of a repository's requirements.
+    The backend streams them as server-sent events. They are read with fetch instead of EventSource,
+    because EventSource cannot send the Authorization header.
+*/
+
+export type ChangeEventType =
+    | "docAdded"
+    | "docDeleted"
+    | "reqAdded"
+    | "reqEdited"
+    | "reqDeleted"
+    | "linkAdded"
+    | "linkRemoved"
+    | "reset"; // the changes cannot be told, the requirements should be fetched again
+
+export type ChangeEvent = {
+    type: ChangeEventType;
+    data: {
+        docId?: string;
+        parentId?: string | null;
+        reqId?: string;
+        linkedReqId?: string;
+        text?: string;
+    };
+};
+
+const RECONNECT_DELAY = 3000;
+
+function parseEvent(message: string): { id?: string; event?: ChangeEvent } {
+    let id: string | undefined;
+    let type: string | undefined;
+    const data: string[] = [];
+    for (const line of message.split("\n")) {
+        if (line.startsWith(":")) {
+            continue;
+        }
+        const separator = line.indexOf(":");
+        const field = separator === -1 ? line : line.slice(0, separator);
+        const value =
+            separator === -1 ? "" : line.slice(separator + 1).replace(/^ /, "");
+        if (field === "id") {
+            id = value;
+        } else if (field === "event") {
+            type = value;
+        } else if (field === "data") {
+            data.push(value);
+        }
+    }
+    if (!type) {
+        return { id };
+    }
+    return {
+        id,
+        event: {
+            type: type as ChangeEventType,
+            data: data.length ? JSON.parse(data.join("\n")) : {},
+        },
+    };
+}
+
+export function subscribeToChanges(
+    tokenStr: string,
+    repositoryName: string,
+    onEvent: (event: ChangeEvent) => void,
+): () => void {
+    // returns a function closing the subscription
+    const abortController = new AbortController();
+    let lastEventId: string | undefined;
+
+    async function follow() {
+        const headers: Record<string, string> = {
+            Authorization: `Bearer ${tokenStr}`,
+        };
+        if (lastEventId) {
+            headers["Last-Event-ID"] = lastEventId;
+        }
+        const response = await fetch(
+            `${constant("VITE_APP_API_URL")}/MyServer/req/events/?repositoryName=${repositoryName}`,
+            { headers, signal: abortController.signal },
+        );
+        if (!response.ok || !response.body) {
+            throw new Error(response.statusText);
+        }
+        const reader = response.body
+            .pipeThrough(new TextDecoderStream())
+            .getReader();
+        let buffer = "";
+        for (;;) {
+            const { value, done } = await reader.read();
+            if (done) {
+                return;
+            }
+            buffer += value.replace(/\r\n?/g, "\n");
+            let end = buffer.indexOf("\n\n");
+            while (end !== -1) {
+                const { id, event } = parseEvent(buffer.slice(0, end));
+                buffer = buffer.slice(end + 2);
+                if (id) {
+                    lastEventId = id;
+                }
+                if (event) {
+                    onEvent(event);
+                }
+                end = buffer.indexOf("\n\n");
+            }
+        }
+    }
+
+    async function run() {
+        while (!abortController.signal.aborted) {
+            try {
+                await follow();
+            } catch {
+                // reconnect below
+            }
+            if (!abortController.signal.aborted) {
+                await new Promise((resolve) =>
+                    setTimeout(resolve, RECONNECT_DELAY),
+                );
+            }
+        }
+    }
+
+    run();
+    return () => abortController.abort();
+}
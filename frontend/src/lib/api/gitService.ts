@@ -1,30 +1,89 @@
-import fetchAPI from "./fetchAPI.ts";
+import fetchAPI, { APIError } from "./fetchAPI.ts";
 
 /*
     This file contains functions to manage git repositories - functions to post commits, get repositories and post chosen repository.
     It communicates with the backend through the fetchAPI function.
 */
 
-export function postCommit(
+type GitJobStatus = "queued" | "running" | "succeeded" | "failed";
+
+export type GitJobProgress = {
+    stage: string;
+    current: number;
+    total: number | null;
+    message: string;
+};
+
+export type GitJob = {
+    jobId: string;
+    kind: "commit" | "sync";
+    status: GitJobStatus;
+    message: string | null;
+    api_error_code: string | null;
+    progress: GitJobProgress | null;
+    readable: boolean;
+};
+
+const JOB_POLL_INTERVAL_MS = 1000;
+
+export function getGitJob(
+    tokenStr: string,
+    jobId: string,
+    waitSeconds: number = 0,
+): Promise<GitJob> {
+    return fetchAPI(
+        tokenStr,
+        null,
+        "GET",
+        `/MyServer/git/jobs/${jobId}/?wait=${waitSeconds}`,
+    );
+}
+
+async function waitForGitJob(tokenStr: string, job: GitJob): Promise<GitJob> {
+    while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) =>
+            setTimeout(resolve, JOB_POLL_INTERVAL_MS),
+        );
+        job = await getGitJob(tokenStr, job.jobId);
+    }
+    if (job.status === "failed") {
+        throw new APIError(
+            job.message ?? "Could not publish changes in repository",
+            409,
+            job.api_error_code ?? undefined,
+        );
+    }
+    return job;
+}
+
+export async function postCommit(
     tokenStr: string,
     repositoryName: string,
     commitText: string,
 ) {
-    return fetchAPI(tokenStr, repositoryName, "POST", "/MyServer/git/commit/", {
-        commitText: commitText,
-    });
+    const job: GitJob = await fetchAPI(
+        tokenStr,
+        repositoryName,
+        "POST",
+        "/MyServer/git/commit/",
+        {
+            commitText: commitText,
+        },
+    );
+    return waitForGitJob(tokenStr, job);
 }
 
 export function getRepos(tokenStr: string): Promise<string[]> {
     return fetchAPI(tokenStr, null, "GET", "/MyServer/git/repos/");
 }
 
-export function postRepo(tokenStr: string, repositoryName: string) {
-    return fetchAPI(
+export async function postRepo(tokenStr: string, repositoryName: string) {
+    const job: GitJob = await fetchAPI(
         tokenStr,
         repositoryName,
         "POST",
         "/MyServer/git/repos/",
         {},
     );
+    return waitForGitJob(tokenStr, job);
 }
@@ -1,5 +1,9 @@
 import fetchAPI from "./fetchAPI.ts";
-import { Requirement, RequirementWithDoc } from "../../types.ts";
+import {
+    Requirement,
+    RequirementRef,
+    RequirementWithDoc,
+} from "../../types.ts";
 
 /*
     This file contains functions to manage requirements.
@@ -95,3 +99,29 @@ export function getAllRequirements(
 ): Promise<RequirementWithDoc[]> {
     return fetchAPI(tokenStr, repositoryName, "GET", "/MyServer/req/all");
 }
+
+export function getAllRequirementRefs(
+    tokenStr: string,
+    repositoryName: string,
+): Promise<RequirementRef[]> {
+    // only ids and document prefixes are fetched, without texts and links
+    return fetchAPI(
+        tokenStr,
+        repositoryName,
+        "GET",
+        "/MyServer/req/all/?fields=id,docPrefix",
+    );
+}
+
+export function getLinkedBy(
+    tokenStr: string,
+    repositoryName: string,
+    reqId: string,
+): Promise<string[]> {
+    return fetchAPI(
+        tokenStr,
+        repositoryName,
+        "GET",
+        `/MyServer/req/linkedBy/?reqId=${reqId}`,
+    );
+}
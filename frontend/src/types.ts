@@ -27,6 +27,8 @@ export type RequirementWithDoc = Requirement & {
     docPrefix: string;
 };
 
+export type RequirementRef = Pick<RequirementWithDoc, "id" | "docPrefix">;
+
 export type OAuthProvider = "gitlab" | "github";
 
 export type AppUser = {